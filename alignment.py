@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+""" alignment.py. Sequence Alignment Inspection (@) 2021
+
+This module reads the dimensions (taxa and sites) of the gene alignments
+straight from the sequences tarball of a dataset, without extracting it,
+so they can be used to estimate the cost of the applications.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import os
+import re
+import tarfile
+from dataclasses import dataclass, field
+from typing import List
+
+NEXUS = 0
+FASTA = 1
+PHYLIP = 2
+ALL_FORMATS = (NEXUS, FASTA, PHYLIP)
+# alignment formats read by each tree method, the others are not converted
+TREE_METHOD_FORMATS = {
+    "RAXML":   (PHYLIP,),
+    "IQTREE":  (PHYLIP,),
+    "MRBAYES": (NEXUS,),
+}
+
+_DIMENSIONS = re.compile(r'dimensions\s+[^;]*?ntax\s*=\s*(\d+)[^;]*?nchar\s*=\s*(\d+)', re.IGNORECASE)
+_DIMENSIONS_NCHAR_FIRST = re.compile(r'dimensions\s+[^;]*?nchar\s*=\s*(\d+)[^;]*?ntax\s*=\s*(\d+)', re.IGNORECASE)
+_MATRIX = re.compile(r'^\s*matrix\s*$(.*?);', re.IGNORECASE | re.MULTILINE | re.DOTALL)
+
+
+@dataclass
+class AlignmentInfo:
+    name:   str
+    format: int
+    sites:  int
+    taxa:   List[str] = field(default_factory=list)
+
+    @property
+    def ntax(self) -> int:
+        return len(self.taxa)
+
+    @property
+    def cells(self) -> int:
+        return self.ntax * self.sites
+
+
+def gene_name(filename: str) -> str:
+    """The gene name used for the converted files (see apps.setup_phylip_data)."""
+    return os.path.basename(filename).split('.')[0]
+
+
+def detect_format(line: str) -> int:
+    """Detects the alignment format from its first line, as apps.setup_phylip_data does."""
+    if "#NEXUS" in line.upper():
+        return NEXUS
+    if ">" in line:
+        return FASTA
+    if len(re.findall(r'\d+\s\d+', line)) > 0:
+        return PHYLIP
+    return None
+
+
+def _taxon(token: str) -> str:
+    return token.strip("'\"")
+
+
+def _parse_nexus(name: str, text: str) -> AlignmentInfo:
+    sites = 0
+    match = _DIMENSIONS.search(text)
+    if match is not None:
+        sites = int(match.group(2))
+    else:
+        match = _DIMENSIONS_NCHAR_FIRST.search(text)
+        if match is not None:
+            sites = int(match.group(1))
+    taxa = dict()
+    matrix = _MATRIX.search(text)
+    if matrix is not None:
+        for line in matrix.group(1).splitlines():
+            tokens = line.split()
+            if len(tokens) > 1:
+                # interleaved matrices repeat the names in every block
+                taxa[_taxon(tokens[0])] = None
+    return AlignmentInfo(name, NEXUS, sites, list(taxa))
+
+
+def _parse_fasta(name: str, text: str) -> AlignmentInfo:
+    taxa = list()
+    sites = 0
+    for line in text.splitlines():
+        if line.startswith('>'):
+            taxa.append(line[1:].strip().split()[0])
+        elif len(taxa) == 1:
+            sites += len(line.strip())
+    return AlignmentInfo(name, FASTA, sites, taxa)
+
+
+def _parse_phylip(name: str, text: str) -> AlignmentInfo:
+    lines = [line for line in text.splitlines() if len(line.strip()) > 0]
+    ntax, sites = (int(v) for v in lines[0].split()[:2])
+    taxa = [line.split()[0] for line in lines[1:ntax + 1]]
+    return AlignmentInfo(name, PHYLIP, sites, taxa)
+
+
+def parse_alignment(name: str, text: str) -> AlignmentInfo:
+    """Reads the dimensions and the taxa of an alignment in nexus, fasta or phylip format."""
+    first_line = text.lstrip().split('\n', 1)[0]
+    input_format = detect_format(first_line)
+    if input_format == NEXUS:
+        return _parse_nexus(name, text)
+    if input_format == FASTA:
+        return _parse_fasta(name, text)
+    if input_format == PHYLIP:
+        return _parse_phylip(name, text)
+    raise ValueError(f"Unknown alignment format in {name}")
+
+
+def read_alignment(filename: str) -> AlignmentInfo:
+    """Reads the dimensions and the taxa of an alignment file in nexus, fasta or phylip format."""
+    with open(filename, 'r', errors='replace') as f:
+        return parse_alignment(gene_name(filename), f.read())
+
+
+def read_phylip(filename: str, patterns: bool = False) -> AlignmentInfo:
+    """Reads the dimensions of a sequential phylip file, as written by apps.setup_phylip_data.
+
+    Parameters:
+        filename: path of the phylip file
+        patterns: count the distinct site patterns (columns) instead of the sites
+            given by the header, which tracks the likelihood cost of raxml and
+            iqtree more closely on alignments with many repeated columns
+    Returns:
+        the AlignmentInfo of the gene
+    """
+    taxa = list()
+    columns = None
+    with open(filename, 'r') as f:
+        header = f.readline()
+        while len(header) > 0 and len(header.strip()) == 0:
+            header = f.readline()
+        ntax, sites = (int(v) for v in header.split()[:2])
+        sequences = list()
+        for _ in range(ntax):
+            line = f.readline()
+            while len(line) > 0 and len(line.strip()) == 0:
+                line = f.readline()
+            # the sequence may wrap, and a 10 characters name may touch it
+            record = ''.join(line.split())
+            while len(record) <= sites:
+                line = f.readline()
+                if len(line) == 0:
+                    break
+                record += ''.join(line.split())
+            taxa.append(record[:-sites] if sites > 0 else record)
+            if patterns:
+                sequences.append(record[-sites:].upper())
+        if patterns:
+            columns = len(set(zip(*sequences)))
+    return AlignmentInfo(gene_name(filename), PHYLIP, sites if columns is None else columns, taxa)
+
+
+def read_dimensions(tar_file: str) -> List[AlignmentInfo]:
+    """Reads every alignment of a sequences tarball, member by member.
+
+    Returns:
+        the AlignmentInfo of each gene, sorted by gene name
+    """
+    alignments = list()
+    with tarfile.open(tar_file, "r:*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            text = tar.extractfile(member).read().decode(errors='replace')
+            alignments.append(parse_alignment(gene_name(member.name), text))
+    return sorted(alignments, key=lambda a: a.name)
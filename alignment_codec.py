@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+""" alignment_codec.py. Native Alignment Codec (@) 2021
+
+This module reads the gene alignments (nexus, fasta or sequential phylip, the
+formats detected by apps.setup_phylip_data) from a memory map and writes them
+back as phylip-sequential, fasta and nexus, producing the same bytes as
+Bio.AlignIO. The sequences are kept as bytes, so no per-residue objects are
+built, and the map is scanned in place: only the records are copied out of
+it. Inputs outside of the supported subset (comments, quoted names,
+matchchar, ...) raise UnsupportedAlignment, and the caller falls back to
+Bio.AlignIO.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import mmap
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from alignment import NEXUS, FASTA, PHYLIP
+
+# the IUPAC DNA letters accepted by Bio.Nexus, both cases
+DNA_LETTERS = b"GATCRYWSMKHBVDNgatcrywsmkhbvdn"
+# Bio.Nexus.Nexus.PUNCTUATION and WHITESPACE
+NEXUS_PUNCTUATION = "()[]{}\\,;:=*'\"`+-<>"
+NEXUS_WHITESPACE = " \t\n"
+PHYLIP_ID_WIDTH = 10
+FASTA_WIDTH = 60
+NEXUS_INTERLEAVE = 1000
+NEXUS_BLOCK = 70
+BUFFER_SIZE = 1 << 20
+
+_KEY_VALUE = re.compile(rb'\s*=\s*')
+# the keyword of a nexus command and the first non blank byte, both matched on the memory map
+_WORD = re.compile(rb'\s*(\S*)')
+_NON_SPACE = re.compile(rb'\S')
+
+
+class UnsupportedAlignment(Exception):
+    """The alignment uses a feature the codec doesn't handle, Bio.AlignIO must be used."""
+
+
+@dataclass
+class Alignment:
+    format:    int
+    names:     List[str] = field(default_factory=list)
+    sequences: List[bytes] = field(default_factory=list)
+
+    @property
+    def sites(self) -> int:
+        return len(self.sequences[0]) if len(self.sequences) > 0 else 0
+
+
+def _check_sequences(alignment: Alignment, extra: bytes = b"-?") -> Alignment:
+    if len(alignment.sequences) == 0:
+        raise UnsupportedAlignment("empty alignment")
+    sites = alignment.sites
+    for sequence in alignment.sequences:
+        if len(sequence) != sites or sites == 0:
+            raise UnsupportedAlignment("sequences of different lengths")
+        if len(sequence.translate(None, DNA_LETTERS + extra)) > 0:
+            raise UnsupportedAlignment("non IUPAC DNA characters")
+    if len(set(alignment.names)) != len(alignment.names):
+        raise UnsupportedAlignment("repeated names")
+    return alignment
+
+
+def _nexus_name(token: bytes) -> str:
+    name = token.decode()
+    if set(name).intersection(NEXUS_PUNCTUATION):
+        raise UnsupportedAlignment(f"taxon name {name}")
+    return name
+
+
+def _nexus_options(text: bytes) -> dict:
+    options = dict()
+    for token in _KEY_VALUE.sub(b'=', text).split():
+        key, _, value = token.partition(b'=')
+        options[key.decode().lower()] = value.decode()
+    return options
+
+
+def _lines(data, start: int, end: int):
+    """The stripped, non-empty lines of data[start:end], sliced one at a time."""
+    while start < end:
+        stop = data.find(b'\n', start, end)
+        stop = end if stop < 0 else stop
+        line = data[start:stop].strip()
+        if len(line) > 0:
+            yield line
+        start = stop + 1
+
+
+def _next_line(data, start: int):
+    """The line starting at start and the start of the next one, past the end after the last line."""
+    stop = data.find(b'\n', start)
+    if stop < 0:
+        return data[start:], len(data) + 1
+    return data[start:stop], stop + 1
+
+
+def read_nexus(data) -> Alignment:
+    """Reads the data block of a nexus file as Bio.Nexus does."""
+    if data[:6].upper() != b'#NEXUS' or data.find(b'[') >= 0 or data.find(b"'") >= 0 or data.find(b'"') >= 0:
+        raise UnsupportedAlignment("nexus header, comments or quotes")
+    ntax = nchar = None
+    interleave = False
+    missing, gap = '?', '-'
+    matrix = None
+    expected = ['begin', 'dimensions', 'format', 'matrix', 'end']
+    # the commands are found in place, only the matrix is read line by line
+    start = 6
+    end = data.find(b';', start)
+    while end >= 0:
+        word = _WORD.match(data, start, end)
+        keyword = word.group(1).decode().lower()
+        if len(expected) == 0 or keyword != expected[0]:
+            raise UnsupportedAlignment(f"nexus command {keyword}")
+        expected.pop(0)
+        if keyword == 'matrix':
+            matrix = (word.end(), end)
+        else:
+            rest = data[word.end():end].strip()
+        if keyword == 'begin':
+            if rest.lower() != b'data':
+                raise UnsupportedAlignment("not a data block")
+        elif keyword == 'dimensions':
+            options = _nexus_options(rest)
+            if set(options) != {'ntax', 'nchar'}:
+                raise UnsupportedAlignment("dimensions")
+            ntax, nchar = int(options['ntax']), int(options['nchar'])
+        elif keyword == 'format':
+            for key, value in _nexus_options(rest).items():
+                if key == 'datatype' and value.lower() == 'dna':
+                    continue
+                if key == 'interleave' and value.lower() in ('', 'yes', 'no'):
+                    interleave = value.lower() != 'no'
+                elif key == 'missing' and len(value) == 1:
+                    missing = value
+                elif key == 'gap' and len(value) == 1:
+                    gap = value
+                else:
+                    raise UnsupportedAlignment(f"format {key}")
+        start = end + 1
+        end = data.find(b';', start)
+    if _NON_SPACE.search(data, start) is not None:
+        raise UnsupportedAlignment("unterminated command")
+    if matrix is None or len(expected) > 0:
+        raise UnsupportedAlignment("incomplete data block")
+    names = list()
+    rows = dict()
+    lines = _lines(data, *matrix)
+    count = 0
+    for line in lines:
+        count += 1
+        if count > ntax:
+            if not interleave:
+                raise UnsupportedAlignment("too many taxa")
+            count = 1
+        token, _, rest = line.partition(b' ') if b' ' in line else line.partition(b'\t')
+        name = _nexus_name(token)
+        if interleave:
+            chars = b''.join(rest.split()) if len(rest.strip()) > 0 else b''.join(next(lines).split())
+        else:
+            chars = b''.join(rest.split())
+            while len(chars) < nchar:
+                chars += b''.join(next(lines).split())
+        if name in rows:
+            if not interleave or names[count - 1] != name:
+                raise UnsupportedAlignment("taxa out of order")
+            rows[name].append(chars)
+        else:
+            if len(names) != count - 1:
+                raise UnsupportedAlignment("taxa out of order")
+            names.append(name)
+            rows[name] = [chars]
+    if len(names) != ntax:
+        raise UnsupportedAlignment("number of taxa")
+    alignment = Alignment(NEXUS, names, [b''.join(rows[name]) for name in names])
+    _check_sequences(alignment, (gap + missing).encode())
+    if alignment.sites != nchar:
+        raise UnsupportedAlignment("number of sites")
+    return alignment
+
+
+def read_fasta(data) -> Alignment:
+    """Reads a fasta file as Bio.SeqIO's FastaIterator does."""
+    if data[:1] != b'>' or data.find(b'\r') >= 0:
+        raise UnsupportedAlignment("fasta header")
+    names = list()
+    sequences = list()
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b'\n>', start)
+        end = size if end < 0 else end + 1
+        title_end = data.find(b'\n', start, end)
+        title_end = end if title_end < 0 else title_end
+        title = data[start + 1:title_end]
+        words = title.decode().split(None, 1)
+        if len(words) == 0:
+            raise UnsupportedAlignment("empty title")
+        # the titles are written back as they were only when they are a single word
+        if len(title.split()) != 1 or title != title.strip():
+            raise UnsupportedAlignment("fasta description")
+        names.append(words[0])
+        sequences.append(data[title_end:end].translate(None, b" \t\r\n"))
+        start = end
+    return _check_sequences(Alignment(FASTA, names, sequences))
+
+
+def read_phylip(data) -> Alignment:
+    """Reads a sequential phylip file with strict 10 characters names, as Bio.AlignIO does."""
+    if data.find(b'\t') >= 0 or data.find(b'\r') >= 0:
+        raise UnsupportedAlignment("tabs")
+    size = len(data)
+    line, i = _next_line(data, 0)
+    header = line.split()
+    if len(header) != 2:
+        raise UnsupportedAlignment("phylip header")
+    ntax, nchar = int(header[0]), int(header[1])
+    names = list()
+    sequences = list()
+    for _ in range(ntax):
+        if i > size:
+            raise UnsupportedAlignment("number of taxa")
+        line, i = _next_line(data, i)
+        line = line.rstrip()
+        names.append(line[:PHYLIP_ID_WIDTH].strip().decode())
+        sequence = line[PHYLIP_ID_WIDTH:].strip().replace(b' ', b'')
+        while len(sequence) < nchar and i <= size:
+            line, i = _next_line(data, i)
+            line = line.strip()
+            if len(line) == 0:
+                break
+            sequence += line.replace(b' ', b'')
+        sequences.append(sequence)
+    if i <= size and _NON_SPACE.search(data, i) is not None:
+        raise UnsupportedAlignment("more than one alignment")
+    alignment = _check_sequences(Alignment(PHYLIP, names, sequences))
+    if alignment.sites != nchar:
+        raise UnsupportedAlignment("number of sites")
+    return alignment
+
+
+def read_alignment(data, input_format: int) -> Alignment:
+    """Reads an alignment from bytes or a memory map."""
+    readers = {NEXUS: read_nexus, FASTA: read_fasta, PHYLIP: read_phylip}
+    if input_format not in readers:
+        raise UnsupportedAlignment("unknown format")
+    try:
+        return readers[input_format](data)
+    except (StopIteration, ValueError, IndexError) as e:
+        # malformed files are left for Bio.AlignIO to report
+        raise UnsupportedAlignment(str(e))
+
+
+def read_file(filename: str, input_format: int) -> Alignment:
+    """Reads an alignment through a memory map of the file."""
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return read_alignment(data, input_format)
+
+
+def _phylip_name(name: str) -> str:
+    # Bio.AlignIO.PhylipIO.sanitize_name
+    name = name.strip()
+    for char in "[](),":
+        name = name.replace(char, "")
+    for char in ":;":
+        name = name.replace(char, "|")
+    return name[:PHYLIP_ID_WIDTH]
+
+
+def _nexus_safename(name: str) -> str:
+    # Bio.Nexus.Nexus.safename
+    safe = name.replace("'", "''")
+    if set(safe).intersection(set(NEXUS_WHITESPACE + NEXUS_PUNCTUATION)):
+        safe = "'" + safe + "'"
+    return safe
+
+
+def write_phylip(alignment: Alignment, filename: str) -> None:
+    names = [_phylip_name(name) for name in alignment.names]
+    if len(set(names)) != len(names):
+        raise UnsupportedAlignment("repeated phylip names")
+    with open(filename, 'wb', buffering=BUFFER_SIZE) as f:
+        f.write(b" %i %i\n" % (len(names), alignment.sites))
+        for name, sequence in zip(names, alignment.sequences):
+            f.write(name.ljust(PHYLIP_ID_WIDTH).encode())
+            f.write(sequence)
+            f.write(b"\n")
+
+
+def write_fasta(alignment: Alignment, filename: str) -> None:
+    with open(filename, 'wb', buffering=BUFFER_SIZE) as f:
+        for name, sequence in zip(alignment.names, alignment.sequences):
+            f.write(b">" + name.encode() + b"\n")
+            for i in range(0, len(sequence), FASTA_WIDTH):
+                f.write(sequence[i:i + FASTA_WIDTH])
+                f.write(b"\n")
+
+
+def write_nexus(alignment: Alignment, filename: str) -> None:
+    names = [_nexus_safename(name).encode() for name in alignment.names]
+    width = max(len(name) for name in names) + 1
+    sites = alignment.sites
+    with open(filename, 'wb', buffering=BUFFER_SIZE) as f:
+        f.write(b"#NEXUS\nbegin data;\ndimensions ntax=%d nchar=%d;\n" % (len(names), sites))
+        # Bio.AlignIO interleaves the long alignments
+        interleave = sites > NEXUS_INTERLEAVE
+        f.write(b"format datatype=dna missing=? gap=-%s;\nmatrix\n" % (b" interleave" if interleave else b""))
+        if interleave:
+            for seek in range(0, sites, NEXUS_BLOCK):
+                for name, sequence in zip(names, alignment.sequences):
+                    f.write(name.ljust(width))
+                    f.write(sequence[seek:seek + NEXUS_BLOCK])
+                    f.write(b"\n")
+                f.write(b"\n")
+        else:
+            for name, sequence in zip(names, alignment.sequences):
+                f.write(name.ljust(width))
+                f.write(sequence)
+                f.write(b"\n")
+        f.write(b";\nend;\n")
+
+
+WRITERS = {NEXUS: write_nexus, FASTA: write_fasta, PHYLIP: write_phylip}
+
+# Bio.AlignIO names of the supported formats
+BIO_FORMATS = {"nexus": NEXUS, "fasta": FASTA, "phylip-sequential": PHYLIP}
+
+
+def convert(in_file: str, in_format: str, out_file: str, out_format: str, molecule_type: str = "DNA") -> None:
+    """Drop-in replacement of Bio.AlignIO.convert, which it calls for the alignments the codec doesn't support.
+
+    Parameters:
+        in_file: the alignment to be converted
+        in_format: its Bio.AlignIO format name
+        out_file: the converted alignment
+        out_format: the Bio.AlignIO format name of out_file
+        molecule_type: the molecule type given to Bio.AlignIO, only DNA is handled natively
+    """
+    if molecule_type == "DNA" and in_format in BIO_FORMATS and out_format in BIO_FORMATS:
+        try:
+            WRITERS[BIO_FORMATS[out_format]](read_file(in_file, BIO_FORMATS[in_format]), out_file)
+            return
+        except UnsupportedAlignment:
+            pass
+    from Bio import AlignIO
+    AlignIO.convert(in_file, in_format, out_file, out_format, molecule_type=molecule_type)
@@ -34,13 +34,14 @@ __status__ = "Research"
 import parsl
 from appsexception import FileCreationError, FolderDeletionError
 from bioconfig import BioConfig
-from typing import Any
+from typing import Any, List
 from utils import app_reuse, Cache
 
 
 # setup_phylip_data bash app
 @parsl.python_app(executors=['single_partition'])
 def setup_phylip_data(basedir: dict, config: BioConfig,
+                      inputs=[],
                       stderr=parsl.AUTO_LOGNAME,
                       stdout=parsl.AUTO_LOGNAME):
     """Extract the sequence alignments tar file and convert the gene alignments from the nexus format to the phylip format.
@@ -49,6 +50,8 @@ def setup_phylip_data(basedir: dict, config: BioConfig,
             basedir: it is going to search for a tar file with nexus files. The script will create:
             seqdir=input/nexus
             seqdir=input/phylip
+            seqdir=input/fasta
+            only the folders of the formats in basedir['formats'] are written.
     Returns:
         returns an parsl's AppFuture.
 
@@ -65,9 +68,21 @@ def setup_phylip_data(basedir: dict, config: BioConfig,
     from Bio import AlignIO
     from pathlib import Path
     from appsexception import AlignmentConversion
+    from alignment import ALL_FORMATS
+    from conversion import FORMATS, ConversionManifest, output_files, source_digest
 
     logging.info(f'Converting Nexus files to Phylip on {basedir["dir"]}')
     input_dir = os.path.join(basedir['dir'], 'input')
+    # only the formats read by the dataset's tree methods (see ConversionFormats)
+    formats = basedir.get('formats', ALL_FORMATS)
+    if config.conversion_engine == 'parallel':
+        # streamed from the tarball and converted on a pool of processes
+        from conversion import convert_tarball
+        try:
+            convert_tarball(basedir['sequences'], input_dir, config.conversion_workers, config.conversion_codec, formats)
+        except Exception as e:
+            raise AlignmentConversion(basedir=basedir['dir'])
+        return
     sequence_dir = os.path.join(input_dir, 'sequence')
     input_format = 0
     # First the sequences are extracted
@@ -89,46 +104,117 @@ def setup_phylip_data(basedir: dict, config: BioConfig,
         elif len(re.findall(r'\d+\s\d+', line)) > 0:
             input_format = 2 # other .i.e. phylip
 
-    input_nexus_dir = os.path.join(input_dir, 'nexus')
-    input_phylip_dir = os.path.join(input_dir, 'phylip')
-    input_fasta_dir = os.path.join(input_dir, 'fasta')
-    # So, some work must be done. Build the Nexus directory
-    if not os.path.isdir(input_nexus_dir):
-        Path(input_nexus_dir).mkdir(exist_ok=True)
-    if not os.path.isdir(input_phylip_dir):
-        Path(input_phylip_dir).mkdir(exist_ok=True)
-    if not os.path.isdir(input_fasta_dir):
-        Path(input_fasta_dir).mkdir(exist_ok=True)
+    # So, some work must be done. Build the directories of the formats
+    for output_format in formats:
+        Path(os.path.join(input_dir, FORMATS[output_format][1])).mkdir(exist_ok=True)
     # Now, use the function to convert nexus to phylip.
     files = glob.glob(os.path.join(sequence_dir,'*'))
+    convert = AlignIO.convert
+    if config.conversion_codec == 'native':
+        # memory-mapped, falling back to Bio.AlignIO for the files it doesn't support
+        from alignment_codec import convert
+    # the files converted by a previous run from the same alignment are kept
+    manifest = ConversionManifest(input_dir)
     try:
         for f in files:
-            out_name = os.path.basename(f).split('.')[0]
-            if input_format == 0:
-                AlignIO.convert(f, "nexus", os.path.join(input_phylip_dir, f'{out_name}.phy'), "phylip-sequential", molecule_type = "DNA")
-                AlignIO.convert(f, "nexus", os.path.join(input_fasta_dir, f'{out_name}.fasta'), "fasta", molecule_type = "DNA")
-                shutil.copyfile(f, os.path.join(input_nexus_dir, os.path.basename(f)))
-            if input_format == 1:
-                AlignIO.convert(f, "fasta", os.path.join(input_phylip_dir, f'{out_name}.phy'), "phylip-sequential", molecule_type = "DNA")
-                AlignIO.convert(f, "fasta", os.path.join(input_nexus_dir, f'{out_name}.nex'), "nexus", molecule_type = "DNA")
-                shutil.copyfile(f, os.path.join(input_fasta_dir, os.path.basename(f)))
-            if input_format == 2:
-                AlignIO.convert(f, "phylip-sequential", os.path.join(input_nexus_dir, f'{out_name}.nex'), "nexus", molecule_type = "DNA")
-                AlignIO.convert(f, "phylip-sequential", os.path.join(input_fasta_dir, f'{out_name}.fasta'), "fasta", molecule_type = "DNA")
-                shutil.copyfile(f, os.path.join(input_phylip_dir, os.path.basename(f)))
+            with open(f, 'rb') as s_file:
+                digest = source_digest(s_file.read())
+            for output_format, out_file in output_files(f, input_format, formats, input_dir).items():
+                if manifest.up_to_date(out_file, digest):
+                    continue
+                if output_format == input_format:
+                    shutil.copyfile(f, out_file)
+                else:
+                    convert(f, FORMATS[input_format][0], out_file, FORMATS[output_format][0], molecule_type = "DNA")
+                manifest.record(out_file, digest)
     except Exception as e:
         raise AlignmentConversion(basedir=basedir['dir'])
+    finally:
+        manifest.save()
     return
 
 
+@parsl.python_app(executors=['single_partition'])
+def extract_sequences(basedir: dict, config: BioConfig,
+                      stderr=parsl.AUTO_LOGNAME,
+                      stdout=parsl.AUTO_LOGNAME):
+    """Extracts the sequence alignments tar file to input/sequence, for the convert_genes tasks (ConversionBatch).
+
+    Parameters:
+        basedir: the dataset, whose tar file is basedir['sequences']
+    Returns:
+        returns an parsl's AppFuture with the names and formats of the alignments, also
+        saved to input/alignments.txt for a resumed run
+    """
+    import os
+    from pathlib import Path
+    from appsexception import AlignmentConversion
+    from alignment import ALL_FORMATS
+    from conversion import FORMATS, extract_alignments
+
+    input_dir = os.path.join(basedir['dir'], 'input')
+    for folder in ['sequence'] + [FORMATS[f][1] for f in basedir.get('formats', ALL_FORMATS)]:
+        Path(os.path.join(input_dir, folder)).mkdir(exist_ok=True)
+    try:
+        return extract_alignments(basedir['sequences'], input_dir)
+    except Exception as e:
+        raise AlignmentConversion(basedir=basedir['dir'])
+
+
+@parsl.python_app(executors=['single_partition'])
+def convert_genes(basedir: dict, config: BioConfig,
+                  names: list,
+                  part: int,
+                  inputs=[],
+                  stderr=parsl.AUTO_LOGNAME,
+                  stdout=parsl.AUTO_LOGNAME):
+    """Converts a batch of the gene alignments extracted by extract_sequences.
+
+    The tree inference of each gene only waits for the task of its own batch,
+    so it starts while the other batches are still being converted.
+
+    Parameters:
+        basedir: the dataset, whose formats are basedir['formats']
+        names: paths of the alignments relative to input/sequence
+        part: index of the batch, which names its part of the conversion manifest
+        inputs: the extract_sequences' AppFuture
+    Returns:
+        returns an parsl's AppFuture with the converted gene names.
+    """
+    import os
+    from appsexception import AlignmentConversion
+    from alignment import ALL_FORMATS
+    from conversion import convert_files
+
+    try:
+        return convert_files(os.path.join(basedir['dir'], 'input'), names, basedir.get('formats', ALL_FORMATS),
+                             config.conversion_codec, part)
+    except Exception as e:
+        raise AlignmentConversion(basedir=basedir['dir'])
+
+
+@parsl.join_app
+def expand(submit: Any, inputs=[]):
+    """Calls submit with the results of the inputs once they are done
+
+    Parameters:
+        submit: function of the workflow that submits more apps
+        inputs: futures whose results submit needs, handed over by parsl as their results
+    Returns:
+        returns a future with the result of submit
+    """
+    from concurrent.futures import Future
+    ret = Future()
+    ret.set_result(submit(*inputs))
+    return ret
+
+
 # raxml bash app
-@app_reuse(cache=Cache(), args_to_ignore=["basedir", "config", "stderr", "stdout", "next_pipe"])
 @parsl.bash_app(executors=['single_partition'])
 def raxml(basedir: dict, 
           config: BioConfig,
           input_file: str,
           inputs=[],
-          next_pipe: Any = None,
           stderr=parsl.AUTO_LOGNAME,
           stdout=parsl.AUTO_LOGNAME,
           seed = None):
@@ -161,14 +247,22 @@ def raxml(basedir: dict,
         x = random.randint(1, 10000)
     params = f"-T {num_threads} -p {p} -x {x} -f a -m {config.raxml_model} -N {config.bootstrap}"
     output_file = os.path.splitext(os.path.basename(input_file))[0]
+    # raxml refuses to overwrite the files left by an interrupted run
+    command = f"cd {raxml_dir}; rm -f RAxML_*.{output_file}; {raxml_exec} {params} -s {input_file} -n {output_file}"
+    if len(config.cache_dir) > 0:
+        from result_cache import ResultCache, cached_command
+        key = ResultCache.key(input_file, "raxml", config.raxml_model, config.bootstrap, seed)
+        command = cached_command(config.cache_dir, config.cache_max_size, key,
+                                 raxml_dir, output_file, "RAxML_*.{}", command)
     # Return to Parsl to be executed on the workflow
-    return f"cd {raxml_dir}; {raxml_exec} {params} -s {input_file} -n {output_file}"
+    return command
 
 
-@app_reuse(cache=Cache(), args_to_ignore=["basedir", "config", "stderr", "stdout"])
+@app_reuse(cache=Cache(), args_to_ignore=["basedir", "config", "collected", "stderr", "stdout"])
 @parsl.python_app(executors=['single_partition'])
 def setup_tree_output(basedir: dict,
                       config: BioConfig,
+                      collected: bool = None,
                       inputs=[],
                       outputs=[],
                       stderr=parsl.AUTO_LOGNAME,
@@ -177,6 +271,8 @@ def setup_tree_output(basedir: dict,
 
     Parameters:
         basedir: current working directory
+        collected: True when the GeneTreeCollector of tree_inference already wrote the
+            best tree file and the ASTRAL's BSlistfiles, otherwise they are built here
     Returns:
         returns an parsl's AppFuture
 
@@ -187,16 +283,35 @@ def setup_tree_output(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import os, glob, tarfile, logging
+    import os, glob, logging
     from pathlib import Path
     from appsexception import FolderCreationError, FolderDeletionError, FileCreationError
+    from archiver import IQTREE_ARCHIVES, RAXML_ARCHIVES, archive_outputs, group_files
+    from packed_store import pack_outputs
+    from gene_trees import gene_key
     work_dir = basedir['dir']
     tree_method = basedir['tree_method']
     logging.info(f'Setting up the tree output on {work_dir}')
+
+    def concatenate(besttree_file, tree_files, bs_file, bootstrap_files):
+        # in the gene order of the GeneTreeCollector
+        with open(besttree_file, 'w') as out:
+            for f in sorted(tree_files, key=gene_key):
+                with open(f, 'r') as gen_tree:
+                    out.write(gen_tree.readline())
+        if config.packed_store:
+            # astral lists the bootstrap files it exports from the packed store
+            return
+        Path(os.path.dirname(bs_file)).mkdir(parents=True, exist_ok=True)
+        with open(bs_file, 'w') as out:
+            for f in sorted(bootstrap_files, key=gene_key):
+                out.write(f'{f}\n')
+
     if(tree_method == "RAXML"):
         raxml_dir = os.path.join(work_dir, config.raxml_dir)
         bootstrap_dir = os.path.join(raxml_dir, "bootstrap")
         besttree_file = os.path.join(raxml_dir, config.raxml_output)
+        bs_file = os.path.join(work_dir, config.astral_dir, config.raxml_dir, 'BSlistfiles')
         try:
             Path(bootstrap_dir).mkdir(exist_ok=True)
         except Exception:
@@ -209,72 +324,38 @@ def setup_tree_output(basedir: dict,
             raise FolderDeletionError(bootstrap_dir)
         try:
             files = glob.glob(os.path.join(raxml_dir,'RAxML_bootstrap.*'))
-            for f in files:
-                os.rename(f, os.path.join(bootstrap_dir, os.path.basename(f)))
-            # compress and remove the bootstrap files
-            with tarfile.open(os.path.join(raxml_dir, "contrees.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(raxml_dir,'RAxML_bipartitions.*'))
+            if not config.packed_store:
                 for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            raxml_input = open(besttree_file, 'w')
-            files = glob.glob(os.path.join(raxml_dir, 'RAxML_bestTree.*'))
-            trees = ""
-            for f in files:
-                gen_tree = open(f, 'r')
-                trees += gen_tree.readline()
-                gen_tree.close()
-            raxml_input.write(trees)
-            raxml_input.close()
-            with tarfile.open(os.path.join(raxml_dir, "besttrees.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(raxml_dir, 'RAxML_bestTree.*'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(raxml_dir, "bipartitionsBranchLabels.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(raxml_dir, 'RAxML_bipartitionsBranchLabels.*'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(raxml_dir, "info.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(raxml_dir, 'RAxML_info.*'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
+                    os.rename(f, os.path.join(bootstrap_dir, os.path.basename(f)))
+            if not collected:
+                concatenate(besttree_file, glob.glob(os.path.join(raxml_dir, 'RAxML_bestTree.*')),
+                            bs_file, [os.path.join(bootstrap_dir, os.path.basename(f)) for f in files])
+            # pack or compress and remove the per-gene outputs
+            if config.packed_store:
+                pack_outputs(raxml_dir, RAXML_ARCHIVES + [("bootstrap", "RAxML_bootstrap.*")],
+                             config.archive_workers)
+            elif config.archive:
+                archive_outputs(raxml_dir, RAXML_ARCHIVES, config.archive_codec, config.archive_level,
+                                config.archive_workers)
         except IOError:
             raise FileCreationError(raxml_dir)
     elif(tree_method == "IQTREE"):
         phylip_dir = os.path.join(work_dir, os.path.join("input", "phylip"))
         iqtree_dir = os.path.join(work_dir, config.iqtree_dir)
         besttree_file = os.path.join(iqtree_dir, config.iqtree_output)
+        bs_file = os.path.join(work_dir, config.astral_dir, config.iqtree_dir, 'BSlistfiles')
         try:
-            files = glob.glob(os.path.join(phylip_dir, '*.iqtree'))
-            files += glob.glob(os.path.join(phylip_dir, '*.treefile'))
-            files += glob.glob(os.path.join(phylip_dir, '*.mldist'))
-            files += glob.glob(os.path.join(phylip_dir, '*.nex'))
-            files += glob.glob(os.path.join(phylip_dir, '*.contree'))
-            files += glob.glob(os.path.join(phylip_dir, '*.log'))
-            files += glob.glob(os.path.join(phylip_dir, '*.ckp.gz'))
-            files += glob.glob(os.path.join(phylip_dir, '*.bionj'))
-            #files += glob.glob(os.path.join(phylip_dir, '*.reduced'))
-            #files += glob.glob(os.path.join(phylip_dir, '*.boottrees'))
-            files += glob.glob(os.path.join(phylip_dir, '*.ufboot'))
+            # iqtree writes its outputs next to the alignments, they are found in a single listing
+            moved = ['*.iqtree', '*.treefile', '*.mldist', '*.nex', '*.contree', '*.log', '*.ckp.gz', '*.bionj',
+                     '*.ufboot']
+            files = [f for group in group_files(phylip_dir, [(p, p) for p in moved]).values() for f in group]
             for f in files:
                 new_f = os.path.join(iqtree_dir, os.path.basename(f))
                 os.replace(f, new_f)
-            iq_input = open(besttree_file, 'w+')
-            files = glob.glob(os.path.join(iqtree_dir, '*.treefile'))
-            trees = ""
-            for f in files:
-                gen_tree = open(f, 'r')
-                trees += gen_tree.readline()
-                gen_tree.close()
-            iq_input.write(trees)
-            iq_input.close()
+            if not collected:
+                concatenate(besttree_file, glob.glob(os.path.join(iqtree_dir, '*.treefile')),
+                            bs_file, [os.path.join(iqtree_dir, "bootstrap", os.path.basename(f))
+                                      for f in glob.glob(os.path.join(iqtree_dir, '*.ufboot'))])
         except IOError:
             raise FileCreationError(iqtree_dir)
         bootstrap_dir = os.path.join(iqtree_dir, "bootstrap")
@@ -289,60 +370,11 @@ def setup_tree_output(basedir: dict,
         except Exception:
             raise FolderDeletionError(bootstrap_dir)
         try:
-            with tarfile.open(os.path.join(iqtree_dir, "iqtree.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.iqtree'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "treefile.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.treefile'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "mldist.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.mldist'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "nex.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.nex'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "contree.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.contree'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "log.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.log'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "ckp.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.ckp.gz'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "bionj.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.bionj.gz'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
-            with tarfile.open(os.path.join(iqtree_dir, "reduced.tgz"), "w:gz") as tar:
-                files = glob.glob(os.path.join(iqtree_dir,'*.reduced.gz'))
-                for f in files:
-                    tar.add(f, arcname=os.path.basename(f))
-                for f in files:
-                    os.remove(f)
+            if config.packed_store:
+                pack_outputs(iqtree_dir, IQTREE_ARCHIVES + [("bootstrap", "*.ufboot")], config.archive_workers)
+            elif config.archive:
+                archive_outputs(iqtree_dir, IQTREE_ARCHIVES, config.archive_codec, config.archive_level,
+                                config.archive_workers)
             files = glob.glob(os.path.join(iqtree_dir,'*.ufboot'))
             for f in files:
                 os.rename(f, os.path.join(bootstrap_dir, os.path.basename(f)))
@@ -360,6 +392,11 @@ def root_tree(basedir: dict,
               stdout=parsl.AUTO_LOGNAME):
     """Opens the best tree file from raxml or iqtree and root all the trees according to an outgroup 
 
+    The trees are rooted in chunks on RootingWorkers processes, by the native
+    engine of newick.py or by Bio.Phylo (RootingEngine). The trees that cannot
+    be rooted are left out of the output and listed, with the reason, in the
+    unrooted_trees.txt of the tree folder.
+
     Parameters:
         basedir: current working directory
     TODO: 
@@ -369,40 +406,36 @@ def root_tree(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    from Bio import Phylo
-    import os
+    import os, logging
+    from appsexception import RootMissing
+    from newick import root_trees
     tree_method = basedir['tree_method']
     work_dir = basedir['dir']
     outgroup = basedir['outgroup']
-    buffer = ""
     if tree_method == "RAXML":
         tree_dir = os.path.join(work_dir, config.raxml_dir)
         tree_path = os.path.join(tree_dir, config.raxml_output)
-        try:
-            trees = Phylo.parse(tree_path, "newick")
-            for tree in trees:
-                tree.root_with_outgroup(outgroup)
-                buffer+=tree.format("newick")
-            with open(os.path.join(tree_dir, config.raxml_rooted_output), 'w') as out:
-                out.write(buffer)  
-                out.close() 
-        except:
-            pass
-    if tree_method == "IQTREE":
+        rooted_path = os.path.join(tree_dir, config.raxml_rooted_output)
+    elif tree_method == "IQTREE":
         tree_dir = os.path.join(work_dir, config.iqtree_dir)
         tree_path = os.path.join(tree_dir, config.iqtree_output)
-        try:
-            trees = Phylo.parse(tree_path, "newick")
-            for tree in trees:
-                tree.root_with_outgroup(outgroup)
-                buffer+=tree.format("newick")
-            with open(os.path.join(tree_dir, config.iqtree_rooted_output), 'w') as out:
-                out.write(buffer)    
-                out.close()
-        except:
-            pass
+        rooted_path = os.path.join(tree_dir, config.iqtree_rooted_output)
+    else:
+        return
+    rooted, failed = root_trees(tree_path, outgroup, rooted_path, config.rooting_engine,
+                                config.rooting_workers, config.rooting_chunk)
+    report = os.path.join(tree_dir, 'unrooted_trees.txt')
+    if len(failed) > 0:
+        with open(report, 'w') as f:
+            for number, reason in failed:
+                f.write(f'{number}\t{reason}\n')
+        logging.warning(f'{len(failed)} trees of {tree_path} could not be rooted with {outgroup}, see {report}')
+        if rooted == 0:
+            raise RootMissing(work_dir, f"None of the trees could be rooted with the outgroup {outgroup}, see {report}")
+    elif os.path.exists(report):
+        os.remove(report)
     return
-        
+
 @parsl.bash_app(executors=['single_partition'])
 def astral(basedir: dict,
            config: BioConfig,
@@ -425,6 +458,7 @@ def astral(basedir: dict,
         named according to task id and saved under task_logs in the run directory.
     """
     import glob, os, logging
+    from gene_trees import gene_key
     from pathlib import Path
     work_dir = basedir['dir']
     tree_method = basedir['tree_method']
@@ -432,6 +466,16 @@ def astral(basedir: dict,
     logging.info(f'ASTRAL called with {work_dir}')
     astral_dir = os.path.join(work_dir,config.astral_dir)
     exec_astral = config.astral
+
+    def list_bootstrap(bs_file, tree_output, boot_strap):
+        # the list is written after the best trees, an older one was left by
+        # a previous run, possibly of another set of genes
+        if os.path.exists(bs_file) and os.path.getmtime(bs_file) >= os.path.getmtime(tree_output):
+            return
+        with open(bs_file, 'w') as f:
+            for i in sorted(glob.glob(boot_strap), key=gene_key):
+                f.write(f'{i}\n')
+
     tree_output = ""
     astral_output = ""
     if(tree_method == "RAXML"):
@@ -444,9 +488,9 @@ def astral(basedir: dict,
         raxm_dir = os.path.join(work_dir, config.raxml_dir)
         tree_output = os.path.join(raxm_dir,config.raxml_output)
         boot_strap = os.path.join(os.path.join(work_dir,config.raxml_dir),"bootstrap/*")
-        with open(bs_file, 'w') as f:
-            for i in glob.glob(boot_strap):
-                f.write(f'{i}\n')
+        # written by setup_tree_output, or by the gene tree collector as the genes finished
+        if not config.packed_store:
+            list_bootstrap(bs_file, tree_output, boot_strap)
         astral_output = os.path.join(astral_raxml, config.astral_output)
     elif(tree_method == "IQTREE"):
         try:
@@ -458,10 +502,24 @@ def astral(basedir: dict,
         iqtree_dir = os.path.join(work_dir, config.iqtree_dir)
         tree_output = os.path.join(iqtree_dir,config.iqtree_output)
         boot_strap = os.path.join(os.path.join(work_dir,config.iqtree_dir),"bootstrap/*")
+        # written by setup_tree_output, or by the gene tree collector as the genes finished
+        if not config.packed_store:
+            list_bootstrap(bs_file, tree_output, boot_strap)
+        astral_output = os.path.join(astral_iqtree, config.astral_output)
+    cleanup = ''
+    if config.packed_store:
+        # the bootstrap files are exported from the packed store to the node's scratch (TMPDIR),
+        # listed there and removed once astral is done. -b only takes a list of files, one per
+        # gene, so they can't be streamed to astral as a single multi-tree file
+        import tempfile
+        from packed_store import PackedStore
+        store = PackedStore(os.path.join(os.path.dirname(tree_output), "bootstrap"))
+        scratch = tempfile.mkdtemp(prefix='astral_')
+        bs_file = os.path.join(scratch, 'BSlistfiles')
         with open(bs_file, 'w') as f:
-            for i in glob.glob(boot_strap):
+            for i in store.export(scratch, sorted(store.keys(), key=gene_key)):
                 f.write(f'{i}\n')
-        astral_output = os.path.join(astral_iqtree, config.astral_output)
+        cleanup = f'; status=$?; rm -rf {scratch}; exit $status'
     # Return to Parsl to be executed on the workflow
     params = f'-i {tree_output} -b {bs_file} -r {config.bootstrap} -o {astral_output}'
     if len(mapping) > 0:
@@ -471,9 +529,116 @@ def astral(basedir: dict,
             for specie in species:
                 map_.write(specie.strip() + '\n')
             map_.close()
-        return f'{exec_astral} -i {tree_output} -b {bs_file} -r {config.bootstrap} -a {map_filename} -o {astral_output}'
+        return f'{exec_astral} -i {tree_output} -b {bs_file} -r {config.bootstrap} -a {map_filename} -o {astral_output}{cleanup}'
+    else:
+        return f'{exec_astral} -i {tree_output} -b {bs_file} -r {config.bootstrap} -o {astral_output}{cleanup}'
+
+@parsl.python_app(executors=['single_partition'])
+def setup_quartets(basedir: dict,
+                   config: BioConfig,
+                   inputs=[],
+                   stderr=parsl.AUTO_LOGNAME,
+                   stdout=parsl.AUTO_LOGNAME):
+    """Lists the quartets of the CF table given to snaq, chosen by config.quartet_strategy among the taxa of the gene trees
+
+    The taxa are the species of the dataset's mapping when it has one, as in
+    the CF table computed by snaq.jl.
+
+    Parameters:
+        basedir: current working directory
+        inputs: the setup_tree_output's AppFuture
+    Returns:
+        returns an parsl's AppFuture with the number of taxa and of quartets listed
+
+    NB:
+        Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
+        named according to task id and saved under task_logs in the run directory.
+    """
+    import os, logging
+    from pathlib import Path
+    from concordance import species_map
+    from newick import leaf_labels
+    from quartets import log_selection, select_quartets, snaq_quartets, write_manifest
+    work_dir = basedir['dir']
+    tree_method = basedir['tree_method']
+    logging.info(f'Selecting the quartets of {work_dir}')
+    if tree_method == "RAXML":
+        tree_file = os.path.join(work_dir, config.raxml_dir, config.raxml_output)
+    else:
+        tree_file = os.path.join(work_dir, config.iqtree_dir, config.iqtree_output)
+    taxa = set()
+    with open(tree_file) as f:
+        for line in f:
+            taxa |= leaf_labels(line)
+    if len(basedir['mapping']) > 0:
+        species = species_map(basedir['mapping'])
+        taxa = {species.get(t, t) for t in taxa}
+    taxa = sorted(taxa)
+    quartets = select_quartets(taxa, config.quartet_strategy, config.quartet_budget,
+                               config.quartet_seed, config.quartet_coverage)
+    output_folder = os.path.join(work_dir, config.snaq_dir)
+    Path(output_folder).mkdir(exist_ok=True)
+    count = write_manifest(os.path.join(output_folder, snaq_quartets(os.path.basename(work_dir), tree_method)), quartets)
+    log_selection(work_dir, len(taxa), count, config.quartet_strategy)
+    return len(taxa), count
+
+
+@parsl.python_app(executors=['single_partition'])
+def setup_cf_table(basedir: dict,
+                   config: BioConfig,
+                   inputs=[],
+                   stderr=parsl.AUTO_LOGNAME,
+                   stdout=parsl.AUTO_LOGNAME):
+    """Computes the CF table of the gene trees read by every snaq process of the dataset
+
+    The quartets are the ones of the species of the dataset's mapping, only
+    the ones listed by setup_quartets when config.quartet_strategy selects
+    them. The table is kept in the result cache, keyed by the hash of the
+    gene trees and the settings of the selection.
+
+    Parameters:
+        basedir: current working directory
+        inputs: the setup_tree_output's AppFuture, and setup_quartets' if any
+    Returns:
+        returns an parsl's AppFuture
+
+    NB:
+        Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
+        named according to task id and saved under task_logs in the run directory.
+    """
+    import os, logging
+    from pathlib import Path
+    from concordance import TABLE_SUFFIX, gene_tree_cf, snaq_table
+    from quartets import read_manifest, snaq_quartets
+    work_dir = basedir['dir']
+    tree_method = basedir['tree_method']
+    dir_name = os.path.basename(work_dir)
+    logging.info(f'Computing the CF table of {work_dir}')
+    if tree_method == "RAXML":
+        tree_file = os.path.join(work_dir, config.raxml_dir, config.raxml_output)
     else:
-        return f'{exec_astral} -i {tree_output} -b {bs_file} -r {config.bootstrap} -o {astral_output}'
+        tree_file = os.path.join(work_dir, config.iqtree_dir, config.iqtree_output)
+    output_folder = os.path.join(work_dir, config.snaq_dir)
+    Path(output_folder).mkdir(exist_ok=True)
+    table = snaq_table(dir_name, tree_method, config.quartet_strategy)
+    name = table[:-len(TABLE_SUFFIX)]
+    if len(config.cache_dir) > 0:
+        from result_cache import PLACEHOLDER, ResultCache
+        cache = ResultCache(config.cache_dir, config.cache_max_size)
+        key = ResultCache.key(tree_file, "tableCF", basedir['mapping'], config.quartet_strategy,
+                              config.quartet_budget, config.quartet_seed, config.quartet_coverage)
+        if cache.restore(key, output_folder, name):
+            logging.info(f'Restored {table} from the result cache ({key})')
+            return
+    quartets = None
+    if config.quartet_strategy != "all":
+        quartets = read_manifest(os.path.join(output_folder, snaq_quartets(dir_name, tree_method)))
+    ntax, count = gene_tree_cf(tree_file, os.path.join(output_folder, table), basedir['mapping'], quartets)
+    logging.info(f'{count} quartets of {ntax} taxa written to {table}')
+    if len(config.cache_dir) > 0:
+        cache.store(key, output_folder, name, PLACEHOLDER + TABLE_SUFFIX)
+    return
+
 
 @parsl.bash_app(executors=['single_partition'])
 def snaq(basedir: dict,
@@ -481,14 +646,16 @@ def snaq(basedir: dict,
         hmax: str,
         inputs=[],
         outputs=[],
-        next_pipe: Any = None,
         stderr=parsl.AUTO_LOGNAME,
         stdout=parsl.AUTO_LOGNAME,
-        seed = None):
+        seed = None,
+        start = None):
     """Runs the phylonetwork algorithm (snaq) and create the phylogenetic network in newick format
 
     Parameters:
         basedir: current working directory
+        hmax: maximum number of hybridizations, or a comma-separated list run one after the other
+        start: (optional) network of a previous hmax used as the starting topology
     Returns:
         returns an parsl's AppFuture
 
@@ -511,44 +678,51 @@ def snaq(basedir: dict,
     num_threads = config.snaq_threads
     output_folder = os.path.join(work_dir, config.snaq_dir)
     runs = config.snaq_runs
+    from julia_pool import julia_command
+    options = list()
+    if start is not None:
+        options.append(f"--start={start}")
+    from concordance import snaq_table
+    cf_table = os.path.join(output_folder, snaq_table(os.path.basename(work_dir), tree_method, config.quartet_strategy))
+    if config.snaq_cf == "python" and tree_method != "MRBAYES":
+        # the CF table was computed by setup_cf_table, with the selected quartets only
+        options.append(f"--cftable={cf_table}")
+        options.append("--require-cftable")
+    else:
+        if config.quartet_strategy != "all" and tree_method != "MRBAYES":
+            # the CF table keeps the quartets listed by setup_quartets; bucky only ran the selected ones
+            from quartets import snaq_quartets
+            options.append(f"--quartets={os.path.join(output_folder, snaq_quartets(os.path.basename(work_dir), tree_method))}")
+        if config.snaq_sweep != "none" and tree_method != "MRBAYES":
+            # the CF table is computed by the first process of the sweep and read by the others
+            options.append(f"--cftable={cf_table}")
     if tree_method == "RAXML":
         raxml_tree = os.path.join(os.path.join(work_dir, config.raxml_dir), config.raxml_output)
         astral_tree = os.path.join(work_dir, os.path.join(config.astral_dir, config.raxml_dir))
         astral_tree = os.path.join(astral_tree, config.astral_output)
+        args = [tree_method, raxml_tree, astral_tree, output_folder, num_threads, hmax, runs]
         if len(mapping) > 0:
-            return f'julia {snaq_exec} {tree_method} {raxml_tree} {astral_tree} {output_folder} {num_threads} {hmax} {runs} \'{mapping}\''
-        else:
-            return f'julia {snaq_exec} {tree_method} {raxml_tree} {astral_tree} {output_folder} {num_threads} {hmax} {runs}'
+            args.append(mapping)
+        return julia_command(config, snaq_exec, args + options)
     elif tree_method == "IQTREE":
         iqtree_tree = os.path.join(os.path.join(work_dir, config.iqtree_dir), config.iqtree_output)
         astral_tree = os.path.join(work_dir, os.path.join(config.astral_dir,config.iqtree_dir))
         astral_tree = os.path.join(astral_tree, config.astral_output)
+        args = [tree_method, iqtree_tree, astral_tree, output_folder, num_threads, hmax, runs]
         if len(mapping) > 0:
-            return f'julia {snaq_exec} {tree_method} {iqtree_tree} {astral_tree} {output_folder} {num_threads} {hmax} {runs} \'{mapping}\''
-        else:
-            return f'julia {snaq_exec} {tree_method} {iqtree_tree} {astral_tree} {output_folder} {num_threads} {hmax} {runs}'
+            args.append(mapping)
+        return julia_command(config, snaq_exec, args + options)
     elif tree_method == "MRBAYES":
         dir_name = os.path.basename(work_dir)
         qmc_output = os.path.join(os.path.join(work_dir, config.quartet_maxcut_dir), f'{dir_name}.tre')
         bucky_folder = os.path.join(work_dir, config.bucky_dir)
         bucky_table = os.path.join(bucky_folder, f"{dir_name}.csv")
         #mrbayes flow doesn't support mapping
-        return f'julia {snaq_exec} {tree_method} {bucky_table} {qmc_output} {output_folder} {num_threads} {hmax} {runs}'
+        args = [tree_method, bucky_table, qmc_output, output_folder, num_threads, hmax, runs]
+        return julia_command(config, snaq_exec, args + options)
     else:
         return
 
-@parsl.python_app(executors=['single_partition'])
-def prepare_prunetrees(basedir: dict,
-                       config: BioConfig,
-                       input_file: str,
-                       inputs=[],
-                       stderr=parsl.AUTO_LOGNAME,
-                       stdout=parsl.AUTO_LOGNAME):
-    import os, glob
-    bucky_folder = os.path.join(basedir['dir'], "bucky")
-    prune_trees = glob.glob(os.path.join(bucky_folder, "*.txt"))
-    return prune_trees
-
 # Mr.Bayes bash app
 
 
@@ -589,7 +763,15 @@ def mrbayes(basedir: dict,
     if seed is not None:
         par = f"begin mrbayes;\nset nowarnings=yes;\nset autoclose=yes;\nlset nst=2;\n{config.mrbayes_parameters};\nSeed={seed};\nmcmc;\nsumt;\nend;"
     gene_par.write(par)
-    return f"{config.mrbayes} {os.path.join(mb_folder, gene_name)}"
+    gene_par.close()
+    command = f"{config.mrbayes} {os.path.join(mb_folder, gene_name)}"
+    # an unseeded chain is not cached, since its samples differ from run to run
+    if len(config.cache_dir) > 0 and seed is not None:
+        from result_cache import ResultCache, cached_command
+        key = ResultCache.key(input_file, "mrbayes", config.mrbayes_parameters, "", seed)
+        command = cached_command(config.cache_dir, config.cache_max_size, key,
+                                 mb_folder, gene_name, "{}.*", command)
+    return command
 
 # mbsum bash app
 
@@ -634,9 +816,17 @@ def mbsum(basedir: dict,
     trim = (((par_dir['ngen']/par_dir['samplefreq']) *
             par_dir['nruns']*par_dir['burninfrac'])/par_dir['nruns']) + 1
     # select all the mrbayes .t files of the gene alignment file
-    trees = glob.glob(os.path.join(mrbayes_folder, gene_name + '*.t'))
+    trees = sorted(glob.glob(os.path.join(mrbayes_folder, gene_name + '*.t')))
     params = f"{(' ').join(trees)} -n {trim} -o {os.path.join(mbsum_folder, gene_name + '.sum')}"
-    return f"{config.mbsum} {params}"
+    command = f"{config.mbsum} {params}"
+    if len(config.cache_dir) > 0:
+        # mbsum only summarizes the sampled trees, so it is keyed by them and
+        # not by the alignment, whose unseeded chains sample other trees
+        from result_cache import ResultCache, cached_command
+        key = ResultCache.outputs_key(trees, "mbsum", trim)
+        command = cached_command(config.cache_dir, config.cache_max_size, key,
+                                 mbsum_folder, gene_name, "{}.sum", command)
+    return command
 
 
 @parsl.python_app(executors=['single_partition'])
@@ -645,12 +835,12 @@ def setup_bucky_data(basedir: dict,
                      inputs=[],
                      stderr=parsl.AUTO_LOGNAME,
                      stdout=parsl.AUTO_LOGNAME):
-    """Prepares bucky's input, creating a prune tree for each selected quartet
+    """Prepares bucky's input, listing the quartets of the selected taxa chosen by config.quartet_strategy in the quartet manifest
 
     Parameters:
         basedir: current working directory
     Returns:
-        returns an parsl's AppFuture
+        returns an parsl's AppFuture with the number of taxa and of quartets listed
 
     TODO: Provide provenance.
 
@@ -658,95 +848,60 @@ def setup_bucky_data(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import re, os, glob, logging
-    from pathlib import Path
-    from itertools import combinations
+    import os, glob, logging
+    from quartets import CHUNK_PREFIX, MANIFEST, log_selection, select_quartets, shared_taxa, write_manifest
     work_dir = basedir['dir']
     logging.info(f'Setting up bucky data in {work_dir}')
     mbsum_folder = os.path.join(work_dir, config.mbsum_dir)
     bucky_folder = os.path.join(work_dir, config.bucky_dir)
-    # parse the sumarized taxa by mbsum
-    files = glob.glob(os.path.join(mbsum_folder, '*.sum'))
-    taxa = {}
-    selected_taxa = {}
-    pattern = re.compile(r'translate(\n\s*\d+\s+\w+(,|;))+')
-    taxa_pattern = re.compile(r'(\w+(,|;))')
-    for file in files:
-        gene_sum = open(file, 'r')
-        text = gene_sum.read()
-        gene_sum.close()
-        translate_block = pattern.search(text)
-        for match in re.findall(taxa_pattern, translate_block[0]):
-            key = re.sub(re.compile(r'(,|;)'), '', match[0])
-            if key in taxa:
-                taxa[key] += 1
-            else:
-                taxa[key] = 1
-    # select the taxa shared across all genes
-    for t in taxa:
-        if(taxa[t] == len(files)):
-            selected_taxa[t] = t
-    # create all the selected quartets combinations
-    quartets = combinations(selected_taxa, 4)
-    for quartet in quartets:
-        prune_tree_output = "translate\n"
-        count = 0
-        filename = ""
-        for member in tuple(quartet):
-            filename += member
-            count += 1
-            prune_tree_output += f" {count} {member}"
-            if count == 4:
-                prune_tree_output += ";\n"
-            else:
-                filename += "--"
-                prune_tree_output += ",\n"
-        # create the prune tree file necessary for bucky
-        prune_file_path = os.path.join(bucky_folder, f"{filename}-prune.txt")
-        output_file = os.path.join(bucky_folder, filename)
-        prune_file = open(prune_file_path, 'w')
-        prune_file.write(prune_tree_output)
-        prune_file.close()
-    return
+    # the taxa shared across all genes, read from the translate blocks of the
+    # mbsum outputs (in parallel) or from mbsum/taxa.json when they didn't change
+    selected_taxa = shared_taxa(mbsum_folder)
+    # list all the selected quartets combinations in the manifest, the outputs
+    # of a previous run are removed since their chunks may not match it anymore
+    for stale in ("*-prune.txt", "*.out", "*.concordance", f"{CHUNK_PREFIX}*", f"tmp-{CHUNK_PREFIX}*"):
+        for f in glob.glob(os.path.join(bucky_folder, stale)):
+            os.remove(f)
+    quartets = select_quartets(selected_taxa, config.quartet_strategy, config.quartet_budget,
+                               config.quartet_seed, config.quartet_coverage)
+    count = write_manifest(os.path.join(bucky_folder, MANIFEST), quartets)
+    log_selection(work_dir, len(selected_taxa), count, config.quartet_strategy)
+    return len(selected_taxa), count
 
 
-@parsl.bash_app(executors=['single_partition'])
-def bucky(basedir: dict,
-          config: BioConfig,
-          prune_file: str,
-          inputs=[],
-          outputs=[],
-          stderr=parsl.AUTO_LOGNAME,
-          stdout=parsl.AUTO_LOGNAME,
-          seed = None):
-    """Runs bucky's executable using as input a certain prune tree file
+@parsl.python_app(executors=['single_partition'])
+def bucky_chunk(basedir: dict,
+                config: BioConfig,
+                first: int,
+                count: int,
+                inputs=[],
+                stderr=parsl.AUTO_LOGNAME,
+                stdout=parsl.AUTO_LOGNAME):
+    """Runs bucky's executable on a chunk of quartets of the quartet manifest
+
+    The quartets run on config.bucky_workers processes of the worker's node and
+    their outputs are packed in one store of the bucky folder, see quartets.py.
 
     Parameters:
         basedir: current working directory
-        prune_file:  prune tree file
+        first: index of the chunk's first quartet in the manifest
+        count: number of quartets of the chunk
     Returns:
-        returns an parsl's AppFuture
-
-    TODO: Provide provenance.
+        returns an parsl's AppFuture with the number of quartets run
 
     NB:
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import os, glob, re, logging
+    import os, glob, logging
+    from quartets import MANIFEST, chunk_store, run_bucky_chunk
     work_dir = basedir['dir']
-    logging.info(f'BUCKy called with {work_dir}')
+    logging.info(f'BUCKy called with {work_dir} on quartets {first} to {first + count - 1}')
     mbsum_folder = os.path.join(work_dir, config.mbsum_dir)
     bucky_folder = os.path.join(work_dir, config.bucky_dir)
-    files = glob.glob(os.path.join(mbsum_folder, '*.sum'))
-    output_file = os.path.basename(prune_file)
-    output_file = re.sub("-prune.txt", "", output_file)
-    output_file = os.path.join(bucky_folder, output_file)
-
-    params = f"-a 1 -n 1000000 -cf 0 -o {output_file} -p {prune_file} {(' ').join(files)}"
-    if seed is not None:
-        params+= f" -s1 {seed} -s2 {seed}"
-    return f"{config.bucky} {params}"
+    files = sorted(glob.glob(os.path.join(mbsum_folder, '*.sum')))
+    return run_bucky_chunk(config.bucky, "-a 1 -n 1000000 -cf 0", files, os.path.join(bucky_folder, MANIFEST),
+                           first, count, chunk_store(bucky_folder, first), config.bucky_workers)
 
 
 @parsl.python_app(executors=['single_partition'])
@@ -761,7 +916,8 @@ def setup_bucky_output(basedir: dict,
     Parameters:
         basedir: current working directory
     Returns:
-        returns an parsl's AppFuture
+        returns an parsl's AppFuture, whose result is the CFTable of the table
+        written to the bucky folder (see qmc.py)
 
     TODO: Provide provenance.
 
@@ -769,82 +925,21 @@ def setup_bucky_output(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import re, os, glob, logging
+    import os, logging
+    from quartets import write_cf_table
     work_dir = basedir['dir']
     logging.info(f'Setting up BUCky output in {work_dir}')
     bucky_folder = os.path.join(work_dir, config.bucky_dir)
-    pattern = re.compile(r"Read \d+ genes with a ")
-    out_files = glob.glob(os.path.join(bucky_folder, "*.out"))
-    table_string = "taxon1,taxon2,taxon3,taxon4,CF12.34,CF12.34_lo,CF12.34_hi,CF13.24,CF13.24_lo,CF13.24_hi,CF14.23,CF14.23_lo,CF14.23_hi,ngenes\n"
-    cf_95_pattern = re.compile(r"(95% CI for CF = \(\w+,\w+\))")
-    mean_num_loci_pattern = re.compile(r"(=\s+\d+\.\d+\s+\(number of loci\))")
-    translate_block_pattern = re.compile(r"translate\n(\s*\w+\s*\w+(,|;)\n*)+")
-    # open all the bucky's output files and parse them
-    for out_file in out_files:
-        taxa = []
-        splits = {}
-        f = open(out_file, 'r')
-        lines = f.read()
-        f.close()
-        num_genes = re.search(pattern, lines).group(0)
-        num_genes = re.search(r"\d+", num_genes).group(0)
-        name_wo_extension = re.sub(".out|", "", os.path.basename(out_file))
-        concordance_file = os.path.join(os.path.dirname(
-            out_file), f"{name_wo_extension}.concordance")
-        f = open(concordance_file, 'r')
-        lines = f.read()
-        f.close()
-        translate_block = re.search(translate_block_pattern, lines).group(0)
-        translate_block = re.sub(r"(,|;|translate\n)", "", translate_block)
-        taxon_list = translate_block.split('\n')
-        for taxon in taxon_list:
-            if(taxon == ""):
-                break
-            t = taxon.split(" ")
-            taxa.append(t[2])
-        all_splits_block = lines.split("All Splits:\n")[1]
-        split = re.findall("{\w+,\w+\|\w+,\w+}", all_splits_block)
-        cf = re.findall(mean_num_loci_pattern, all_splits_block)
-        cf_95 = re.findall(cf_95_pattern, all_splits_block)
-        for i in range(0, len(split)):
-            split[i] = re.sub("({|,|})", "", split[i])
-            split_dict = {}
-            cf[i] = re.sub(r"(=|\(number of loci\)|\s+)", "", cf[i])
-            cf_95[i] = re.sub(r"(95% CI for CF = \(|\))", "", cf_95[i])
-            cf_95_list = cf_95[i].split(',')
-            split_dict['CF'] = float(cf[i])/float(num_genes)
-            split_dict['95_CI_LO'] = float(cf_95_list[0])/float(num_genes)
-            split_dict['95_CI_HI'] = float(cf_95_list[1])/float(num_genes)
-            splits[split[i]] = split_dict
-        parsed_line = (',').join(taxa)
-        parsed_line += ','
-        if "12|34" in splits:
-            parsed_line += f"{splits['12|34']['CF']},{splits['12|34']['95_CI_LO']},{splits['12|34']['95_CI_HI']},"
-        else:
-            parsed_line += "0,0,0,"
-        if "13|24" in splits:
-            parsed_line += f"{splits['13|24']['CF']},{splits['13|24']['95_CI_LO']},{splits['13|24']['95_CI_HI']},"
-
-        else:
-            parsed_line += "0,0,0,"
-        if "14|23" in splits:
-            parsed_line += f"{splits['14|23']['CF']},{splits['14|23']['95_CI_LO']},{splits['14|23']['95_CI_HI']}"
-        else:
-            parsed_line += "0,0,0"
-        parsed_line += f",{num_genes}\n"
-        table_string += parsed_line
-    # create the table folder
-    table_name = os.path.basename(work_dir)
-    table_name = os.path.join(bucky_folder, f"{table_name}.csv")
-    table_file = open(table_name, 'w')
-    table_file.write(table_string)
-    table_file.close()
-    return
+    # the rows parsed by each chunk are concatenated, the outputs without them are parsed again
+    table_name = os.path.join(bucky_folder, f"{os.path.basename(work_dir)}.csv")
+    # the csv is still written for SNaQ, the columns of Quartet MaxCut are returned
+    return write_cf_table(table_name, bucky_folder, config.bucky_reparse, config.bucky_workers)
 
 
 @parsl.python_app(executors=['single_partition'])
 def setup_qmc_data(basedir: dict,
                    config: BioConfig,
+                   table=None,
                    inputs=[],
                    outputs=[],
                    stderr=parsl.AUTO_LOGNAME,
@@ -852,8 +947,12 @@ def setup_qmc_data(basedir: dict,
     """Prepares the Quartet MaxCut input
 
     Parameters:
-        basedir: current working directory    Returns:
-        returns an parsl's AppFuture
+        basedir: current working directory
+        table: the CFTable returned by setup_bucky_output, or None to read
+            the CF table of the bucky folder (e.g. when bucky was not run again)
+    Returns:
+        returns an parsl's AppFuture, whose result is the list of taxa, the
+        taxon of id i at index i - 1
 
     TODO: Provide provenance.
 
@@ -861,67 +960,19 @@ def setup_qmc_data(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import pandas as pd
-    import json, os, logging
-    from pathlib import Path
+    import os, logging
+    from qmc import qmc_quartets, read_cf_table, write_qmc_input
     work_dir = basedir['dir']
     logging.info(f'Setting up Quartet MaxCut data in {work_dir}')
     dir_name = os.path.basename(work_dir)
-    bucky_folder = os.path.join(work_dir, config.bucky_dir)
-    table_filename = os.path.join(bucky_folder, f'{dir_name}.csv')
-    try:
-        table = pd.read_csv(table_filename, delimiter=',', dtype='string')
-    except Exception:
-        print("Failed to open CF table")
-    table = pd.read_csv(table_filename, delimiter=',', dtype='string')
-    # parse the table
-    quartets = []
-    taxa = {}
-    for index, row in table.iterrows():
-        for i in range(1, 5):
-            if row['taxon' + str(i)] in taxa:
-                taxa[row['taxon' + str(i)]] += 1
-            else:
-                taxa[row['taxon' + str(i)]] = 1
-        cf = {'CF12.34': float(row['CF12.34']), 'CF13.24': float(
-            row['CF13.24']), 'CF14.23': float(row['CF14.23'])}
-        cf_sorted = [k for k in sorted(cf, key=cf.get, reverse=True)]
-        cf_1 = row[cf_sorted[0]]
-        cf_2 = row[cf_sorted[1]]
-        cf_3 = row[cf_sorted[2]]
-        split_1 = f"{row['taxon' + cf_sorted[0][2]]},{row['taxon' + cf_sorted[0][3]]}|{row['taxon' + cf_sorted[0][5]]},{row['taxon' + cf_sorted[0][6]]}"
-        split_2 = f"{row['taxon' + cf_sorted[1][2]]},{row['taxon' + cf_sorted[1][3]]}|{row['taxon' + cf_sorted[1][5]]},{row['taxon' + cf_sorted[1][6]]}"
-        split_3 = f"{row['taxon' + cf_sorted[2][2]]},{row['taxon' + cf_sorted[2][3]]}|{row['taxon' + cf_sorted[2][5]]},{row['taxon' + cf_sorted[2][6]]}"
-        if(cf_1 == cf_2 == cf_3):
-            quartets.extend([split_1, split_2, split_3])
-        elif (cf_1 == cf_2):
-            quartets.extend([split_1, split_2])
-        else:
-            quartets.append(split_1)
-    # change taxon names to ids
-    taxa_id = 1
-    taxon_to_id = {}
-    id_to_taxon = {}
-    dir_name = os.path.basename(work_dir)
-    for k in sorted(taxa):
-        taxon_to_id[str(taxa_id)] = k
-        id_to_taxon[k] = taxa_id
-        taxa_id += 1
-    for i in range(0, len(quartets)):
-        tmp1 = quartets[i].split('|')
-        old_quartets = []
-        old_quartets.extend(tmp1[0].split(','))
-        old_quartets.extend(tmp1[1].split(','))
-        quartets[i] = f"{id_to_taxon[old_quartets[0]]},{id_to_taxon[old_quartets[1]]}|{id_to_taxon[old_quartets[2]]},{id_to_taxon[old_quartets[3]]}"
-    qmc_folder = os.path.join(work_dir, "qmc")
-    qmc_input = os.path.join(qmc_folder, f'{dir_name}.txt')
-    qmc_input_file = open(qmc_input, 'w+')
-    qmc_input_file.write((' ').join(quartets))
-    qmc_input_file.close()
-    # dump ids
-    with open(os.path.join(qmc_folder, f'{dir_name}.json'), "w+") as outfile:
-        json.dump(taxon_to_id, outfile)
-    return
+    if table is None:
+        bucky_folder = os.path.join(work_dir, config.bucky_dir)
+        table = read_cf_table(os.path.join(bucky_folder, f'{dir_name}.csv'))
+    # each row's splits are ranked by their concordance factors on arrays (see qmc.py)
+    quartets = qmc_quartets(table)
+    qmc_folder = os.path.join(work_dir, config.quartet_maxcut_dir)
+    write_qmc_input(os.path.join(qmc_folder, f'{dir_name}.txt'), quartets)
+    return table.names
 
 
 @parsl.bash_app(executors=['single_partition'])
@@ -958,6 +1009,7 @@ def quartet_maxcut(basedir: dict,
 @parsl.python_app(executors=['single_partition'])
 def setup_qmc_output(basedir: dict,
                      config: BioConfig,
+                     names: List[str],
                      inputs=[],
                      outputs=[],
                      stderr=parsl.AUTO_LOGNAME,
@@ -966,6 +1018,7 @@ def setup_qmc_output(basedir: dict,
 
     Parameters:
         basedir: current working directory
+        names: the taxa returned by setup_qmc_data
     Returns:
         returns an parsl's AppFuture
 
@@ -975,49 +1028,41 @@ def setup_qmc_output(basedir: dict,
         Stdout and Stderr are defaulted to parsl.AUTO_LOGNAME, so the log will be automatically 
         named according to task id and saved under task_logs in the run directory.
     """
-    import os, json, logging
-    import pandas as pd
+    import os, logging
+    from newick import relabel
+    from qmc import taxon_ids
     work_dir = basedir['dir']
     logging.info(f'Setting up Quartet MaxCut in {work_dir}')
     dir_name = os.path.basename(work_dir)
     qmc_folder = os.path.join(work_dir, config.quartet_maxcut_dir)
     qmc_output = os.path.join(qmc_folder, f'{dir_name}.tre')
-    taxon_json = os.path.join(qmc_folder, f'{dir_name}.json')
-    with open(taxon_json, 'r') as f:
-        taxon_to_id = json.load(f)
-    tree_file = open(qmc_output, 'r+')
-    lines = tree_file.read()
-    tree_file.close()
-    tree_file = open(qmc_output, 'w')
-    parsed = ""
-    id_search = ""
-    for character in lines:
-        if(not character.isnumeric()):
-            if(id_search == ""):
-                parsed += character
-            else:
-                parsed += str(taxon_to_id[id_search])
-                id_search = ""
-                parsed+= character
-        else:
-            id_search+= character
-    tree_file.write(parsed)
-    tree_file.close()
+    taxon_to_id = taxon_ids(names)
+    with open(qmc_output, 'r') as tree_file:
+        tree = tree_file.read()
+    # the leaves of the quartet maxcut's tree are the ids given by setup_qmc_data
+    with open(qmc_output, 'w') as tree_file:
+        tree_file.write(relabel(tree, taxon_to_id))
     return
 
 
 @parsl.python_app(executors=['single_partition'])
 def setup_phylonet_data(basedir: dict,
                         config: BioConfig,
-                        hmax: str,
+                        hmax: List[str],
                         inputs=[],
                         outputs=[],
                         stderr=parsl.AUTO_LOGNAME,
                         stdout=parsl.AUTO_LOGNAME):
-    """Get the raxml/iqtree's output and create a NEXUS file as output for the phylonet in the basedir
+    """Get the raxml/iqtree's output and create the NEXUS files given to phylonet in the basedir
+
+    The rooted gene trees are read once and a NEXUS file is written for each
+    element of hmax.
 
     Parameters:
         basedir: current working directory
+        hmax: the maximum numbers of reticulations of each file, an element being either a single
+              value or a comma-separated list of them, in which case the PHYLONET block has one
+              InferNetwork_MP command (and output file) per value
     Returns:
         returns an parsl's AppFuture
 
@@ -1028,6 +1073,7 @@ def setup_phylonet_data(basedir: dict,
         named according to task id and saved under task_logs in the run directory.
     """
     import os, logging, re
+    from newick import write_nexus_trees, write_phylonet_block
     work_dir = basedir['dir']
     tree_method = basedir['tree_method']
     network_method = basedir['network_method']
@@ -1039,37 +1085,34 @@ def setup_phylonet_data(basedir: dict,
     elif(tree_method == "IQTREE"):
         gene_trees = os.path.join(os.path.join(work_dir, config.iqtree_dir), config.iqtree_rooted_output)
     out_dir = os.path.join(work_dir, config.phylonet_dir)
-    out_filepath = os.path.join(out_dir, (tree_method + '_' + hmax +'_' + config.phylonet_input))
+    if isinstance(hmax, str):
+        hmax = [hmax]
     try:
-        in_file = open(gene_trees, 'r')
+        with open(gene_trees, 'r') as in_file:
+            trees = [tree for tree in in_file if len(tree.strip()) > 0]
     except IOError:
         print("Error! Could not open Gene tree file.")
         return 
-    try:
-        out_file = open(out_filepath, 'w+')
-    except IOError:
-        print("Error! Could not open output file.")
-        return
-    tree_index = 0
-    buffer = "#NEXUS\nBEGIN TREES;\n"
-    for tree in in_file.readlines():
-        tree_index+=1
-        buffer+="Tree geneTree" + str(tree_index) + " = " + tree
-    in_file.close()
-    buffer+='END;\nBEGIN PHYLONET;\nInferNetwork_MP ('
-    for i in range(0, tree_index-1):
-        buffer+="geneTree" + str(i+1) +','
-    filename = f"{os.path.basename(work_dir)}_{tree_method}_{network_method}_{hmax}.nex"
-    output_network = os.path.join(out_dir,filename)
-    if(len(mapping) == 0):
-        buffer+="geneTree" + str(tree_index) +') ' + hmax + " -pl " + config.phylonet_threads + " -x " + config.phylonet_runs + " " + output_network + ';\nEND;'
-    else:
-        mapping = re.sub(" ", "_", mapping)
-        buffer+="geneTree" + str(tree_index) +') ' + hmax + " -pl " + config.phylonet_threads + " -a <" + mapping +"> -x " + config.phylonet_runs + " " + output_network + ';\nEND;'
-
-    #---
-    out_file.write(buffer)
-    out_file.close()
+    mapping = re.sub(" ", "_", mapping)
+    for batch in hmax:
+        out_filepath = os.path.join(out_dir, (tree_method + '_' + batch.replace(',', '_') +'_' + config.phylonet_input))
+        try:
+            out_file = open(out_filepath, 'w+')
+        except IOError:
+            print("Error! Could not open output file.")
+            return
+        with out_file:
+            gene_tree_list = ','.join(write_nexus_trees(out_file, trees))
+            # a single JVM parses the gene trees once and runs every hmax
+            commands = list()
+            for h in batch.split(','):
+                filename = f"{os.path.basename(work_dir)}_{tree_method}_{network_method}_{h}.nex"
+                output_network = os.path.join(out_dir,filename)
+                if(len(mapping) == 0):
+                    commands.append(f"InferNetwork_MP ({gene_tree_list}) {h} -pl {config.phylonet_threads} -x {config.phylonet_runs} {output_network}")
+                else:
+                    commands.append(f"InferNetwork_MP ({gene_tree_list}) {h} -pl {config.phylonet_threads} -a <{mapping}> -x {config.phylonet_runs} {output_network}")
+            write_phylonet_block(out_file, commands)
     return
 
 
@@ -1079,7 +1122,6 @@ def phylonet(basedir: dict,
             input_file: str,
             inputs=[],
             outputs=[],
-            next_pipe: Any = None,
             stderr=parsl.AUTO_LOGNAME,
             stdout=parsl.AUTO_LOGNAME):
     """Runs PhyloNet using as input the phylonet_input variable
@@ -1104,13 +1146,11 @@ def phylonet(basedir: dict,
     # Return to Parsl to be executed on the workflow
     return f'cd {output_dir};{exec_phylonet} {input_file}'
 
-@app_reuse(cache=Cache(), args_to_ignore=["basedir", "config", "stderr", "stdout", "next_pipe"])
 @parsl.bash_app(executors=['single_partition'])
 def iqtree(basedir: dict,
             config: BioConfig,
             input_file: str,
             inputs=[],
-            next_pipe: Any = None,
             stderr=parsl.AUTO_LOGNAME,
             stdout=parsl.AUTO_LOGNAME,
             seed= None):
@@ -1136,14 +1176,22 @@ def iqtree(basedir: dict,
         flags = f"-T AUTO -ntmax {config.iqtree_threads} -B {config.bootstrap} --boot-trees -m TEST -s {input_file} --keep-ident -redo"
     else:
         flags = f"-T AUTO -ntmax {config.iqtree_threads} -B {config.bootstrap} --boot-trees -m {config.iqtree_model}  -s {input_file} --keep-ident -redo"
+    command = f"cd {iqtree_dir}; {config.iqtree} {flags}"
+    if len(config.cache_dir) > 0:
+        # iqtree writes its outputs next to the alignment
+        from result_cache import ResultCache, cached_command
+        key = ResultCache.key(input_file, "iqtree", config.iqtree_model, config.bootstrap, seed)
+        command = cached_command(config.cache_dir, config.cache_max_size, key,
+                                 os.path.dirname(input_file), os.path.basename(input_file), "{}.*", command)
     # Return to Parsl to be executed on the workflow
-    return f"cd {iqtree_dir}; {config.iqtree} {flags}"
+    return command
 
 
 @parsl.python_app(executors=['single_partition'])
 def create_folders(basedir: dict,
                    config: BioConfig,
                    folders=[],
+                   clean=True,
                    inputs=[],
                    outputs=[],
                    stderr=parsl.AUTO_LOGNAME,
@@ -1155,7 +1203,8 @@ def create_folders(basedir: dict,
     logging.info(f'Removing folders from old executions')
     for folder in folders:
         full_path = os.path.join(work_dir, folder)
-        if(os.path.exists(full_path)):
+        # a resumed run keeps the outputs of the completed stages
+        if(clean and os.path.exists(full_path)):
             try:
                 shutil.rmtree(full_path, ignore_errors=True)
             except Exception:
@@ -1193,4 +1242,194 @@ def plot_networks(config: BioConfig,
                 if len(networks) > 0:
                     networks+=','
                 networks+=os.path.join(phylonet_dir, name)
-    return f'julia {config.plot_script} \'{networks}\''
+    from julia_pool import julia_command
+    return julia_command(config, config.plot_script, [networks])
+
+
+#
+# Parsl Join Applications
+#
+# Join apps run in the workflow process and expand the DAG of a dataset only
+# when the files they fan out on actually exist, so no barrier is needed
+# while the remaining datasets are being submitted.
+
+@parsl.join_app
+def tree_inference(basedir: dict,
+                   config: BioConfig,
+                   scheduler: Any,
+                   manifest: Any,
+                   conversions: dict = None,
+                   inputs=[]):
+    """Submits one raxml/iqtree task per gene alignment found in the phylip folder
+
+    With GeneOrder = longest the genes are submitted longest first, with their
+    estimated run time (see planner.gene_tree_work) as the scheduler priority,
+    and none of them starts before all of them are queued. The genes of the
+    other datasets are not held meanwhile.
+    With ConversionBatch the phylip files are still being written: the genes
+    are the ones of conversions, and each task waits for its convert_genes task.
+    The best tree of each gene is collected as soon as its task finishes, so the
+    best trees file and the ASTRAL's BSlistfiles are written when the last one does.
+
+    Parameters:
+        basedir: current working directory
+        scheduler: the workflow's TokenScheduler, which starts each gene when its threads are free
+        manifest: the dataset's StageManifest, which skips the genes completed by a previous run
+        conversions: the (stage, convert_genes' AppFuture, source alignment) of
+            each converted file, None when the folder was converted by setup_phylip_data
+        inputs: futures that produce the phylip folder (setup_phylip_data or extract_sequences, create_folders)
+    Returns:
+        returns the setup_tree_output's AppFuture of the dataset
+    """
+    import os, glob
+    from gene_trees import GeneTreeCollector
+    tree_method = basedir['tree_method']
+    phylip_dir = os.path.join("input", "phylip")
+    if tree_method == "RAXML":
+        tree_app = raxml
+        threads = config.raxml_threads
+    elif tree_method == "IQTREE":
+        tree_app = iqtree
+        threads = config.iqtree_threads
+    if conversions is None:
+        genes = [(0.0, f) for f in glob.glob(os.path.join(basedir['dir'], phylip_dir, '*.phy'))]
+    else:
+        genes = [(0.0, f) for f in conversions if os.path.dirname(f) == os.path.join(basedir['dir'], phylip_dir)]
+    if config.gene_order == 'longest':
+        from alignment import read_alignment, read_phylip
+        from planner import gene_tree_work
+        patterns = config.gene_cost == 'patterns'
+
+        def alignment(f):
+            if conversions is None:
+                return read_phylip(f, patterns)
+            # the sites of the source alignment, as the phylip file may not be written yet
+            return read_alignment(conversions[f][2])
+        genes = [(gene_tree_work(config, tree_method, alignment(f))/int(threads), f) for _, f in genes]
+        genes.sort(key=lambda g: g[0], reverse=True)
+    # the best trees are gathered as each gene finishes, see gene_trees.GeneTreeCollector
+    work_dir = basedir['dir']
+
+    def bootstrap(name):
+        # the key of the packed bootstrap store, or the file moved to the bootstrap folder
+        return name if config.packed_store else os.path.join(tree_dir, "bootstrap", name)
+
+    def bs_file(tree_folder):
+        return None if config.packed_store else os.path.join(work_dir, config.astral_dir, tree_folder, 'BSlistfiles')
+
+    if tree_method == "RAXML":
+        tree_dir = os.path.join(work_dir, config.raxml_dir)
+        collector = GeneTreeCollector(
+            tree_dir,
+            [(os.path.basename(f),
+              os.path.join(tree_dir, f"RAxML_bestTree.{os.path.splitext(os.path.basename(f))[0]}"),
+              bootstrap(f"RAxML_bootstrap.{os.path.splitext(os.path.basename(f))[0]}"))
+             for _, f in genes],
+            os.path.join(tree_dir, config.raxml_output),
+            bs_file(config.raxml_dir))
+    else:
+        tree_dir = os.path.join(work_dir, config.iqtree_dir)
+        collector = GeneTreeCollector(
+            tree_dir,
+            [(os.path.basename(f), f"{f}.treefile",
+              bootstrap(f"{os.path.basename(f)}.ufboot"))
+             for _, f in genes],
+            os.path.join(tree_dir, config.iqtree_output),
+            bs_file(config.iqtree_dir))
+    ret_tree = list()
+    hold = scheduler.hold() if config.gene_order == 'longest' else None
+    try:
+        for duration, input_file in genes:
+            gene = os.path.basename(input_file)
+            if tree_method == "RAXML":
+                gene_files = [os.path.join(config.raxml_dir, f"RAxML_*.{os.path.splitext(gene)[0]}")]
+            else:
+                # iqtree writes its outputs next to the alignment
+                gene_files = [os.path.join(phylip_dir, f"{gene}.*")]
+            after, conversion = ["phylip"], []
+            if conversions is not None:
+                after, conversion = [conversions[input_file][0]], [conversions[input_file][1]]
+            ret_tree.append(manifest.run(f"{tree_method}/tree/{gene}", gene_files, after,
+                                         scheduler.submit, tree_app, threads,
+                                         basedir=basedir,
+                                         config=config,
+                                         input_file=input_file,
+                                         inputs=conversion,
+                                         priority=duration,
+                                         hold=hold))
+            collector.watch(gene, ret_tree[-1])
+    finally:
+        if hold is not None:
+            hold.release()
+    # the archives are written by a pool, which holds its cores like the gene trees
+    workers = config.archive_workers if config.packed_store or config.archive else 1
+    return scheduler.submit(setup_tree_output, workers, basedir=basedir, config=config,
+                            collected=collector.future, inputs=ret_tree)
+
+
+@parsl.join_app
+def bayesian_inference(basedir: dict,
+                       config: BioConfig,
+                       manifest: Any,
+                       conversions: dict = None,
+                       inputs=[]):
+    """Submits one mrbayes and one mbsum task per gene alignment found in the nexus folder
+
+    Parameters:
+        basedir: current working directory
+        manifest: the dataset's StageManifest, which skips the genes completed by a previous run
+        conversions: the (stage, convert_genes' AppFuture, source alignment) of
+            each converted file, None when the folder was converted by setup_phylip_data
+        inputs: futures that produce the nexus folder (setup_phylip_data or extract_sequences, create_folders)
+    Returns:
+        returns the setup_bucky_data's AppFuture of the dataset
+    """
+    import os, glob
+    nexus_dir = os.path.join(os.path.join(basedir['dir'], "input"), "nexus")
+
+    def gene_summary(input_file, inputs=[]):
+        ret_mb = mrbayes(basedir, config, input_file=input_file, inputs=inputs)
+        return mbsum(basedir, config, input_file=input_file, inputs=[ret_mb])
+
+    ret_mbsum = list()
+    if conversions is None:
+        files = glob.glob(os.path.join(nexus_dir, '*.nex'))
+    else:
+        # each gene waits for the convert_genes task that writes it
+        files = [f for f in conversions if os.path.dirname(f) == nexus_dir]
+    for input_file in files:
+        gene = os.path.basename(input_file)
+        after, conversion = ["phylip"], []
+        if conversions is not None:
+            after, conversion = [conversions[input_file][0]], [conversions[input_file][1]]
+        ret_mbsum.append(manifest.run(f"MRBAYES/tree/{gene}", [os.path.join(config.mbsum_dir, f"{gene}.sum")],
+                                      after, gene_summary, input_file, inputs=conversion))
+    return setup_bucky_data(basedir, config, inputs=ret_mbsum)
+
+
+@parsl.join_app
+def bucky_quartets(basedir: dict,
+                   config: BioConfig,
+                   scheduler: Any,
+                   inputs=[]):
+    """Submits one bucky_chunk task per config.bucky_chunk quartets of the manifest written by setup_bucky_data
+
+    Each chunk, and setup_bucky_output, holds config.bucky_workers cores of the
+    scheduler, the size of its process pool.
+
+    Parameters:
+        basedir: current working directory
+        scheduler: the workflow's TokenScheduler
+        inputs: the setup_bucky_data's AppFuture
+    Returns:
+        returns the setup_bucky_output's AppFuture of the dataset
+    """
+    import os, logging
+    from quartets import MANIFEST, chunks, manifest_size
+    bucky_folder = os.path.join(basedir['dir'], config.bucky_dir)
+    total = manifest_size(os.path.join(bucky_folder, MANIFEST))
+    ret_bucky = list()
+    for first, count in chunks(total, config.bucky_chunk):
+        ret_bucky.append(scheduler.submit(bucky_chunk, config.bucky_workers, basedir, config, first, count))
+    logging.info(f'{total} quartets of {basedir["dir"]} in {len(ret_bucky)} bucky chunks')
+    return scheduler.submit(setup_bucky_output, config.bucky_workers, basedir, config, inputs=ret_bucky)
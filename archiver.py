@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+""" archiver.py. Output Archiving (@) 2021
+
+This module packs the per-gene outputs of the tree inference (raxml and
+iqtree) into one archive per kind of file. The folder is listed once, each
+file is assigned to the first archive whose pattern it matches, and the
+archives are written in parallel, by threads since zlib and lzma release the
+GIL while compressing.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import fnmatch
+import logging
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from conversion import available_cores
+
+logger = logging.getLogger(__name__)
+
+# tarfile mode, archive extension, compression level keyword and default level
+CODECS = {
+    "none": ("w", "tar", None, None),
+    "gzip": ("w:gz", "tgz", "compresslevel", 9),
+    "xz":   ("w:xz", "txz", "preset", 6),
+    "zstd": ("w:zst", "tzst", "level", 3),
+}
+
+# archive name and file pattern of the outputs of each tree method, the first match wins
+RAXML_ARCHIVES = [
+    ("contrees", "RAxML_bipartitions.*"),
+    ("besttrees", "RAxML_bestTree.*"),
+    ("bipartitionsBranchLabels", "RAxML_bipartitionsBranchLabels.*"),
+    ("info", "RAxML_info.*"),
+]
+IQTREE_ARCHIVES = [
+    ("iqtree", "*.iqtree"),
+    ("treefile", "*.treefile"),
+    ("mldist", "*.mldist"),
+    ("nex", "*.nex"),
+    ("contree", "*.contree"),
+    ("log", "*.log"),
+    ("ckp", "*.ckp.gz"),
+    ("bionj", "*.bionj.gz"),
+    ("reduced", "*.reduced.gz"),
+]
+
+
+def available_codec(codec: str) -> str:
+    """The codec itself, or gzip when this python's tarfile doesn't support it (zstd before 3.14)."""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown archive codec {codec}")
+    if codec == "zstd":
+        try:
+            import compression.zstd  # noqa: F401
+        except ImportError:
+            logger.warning("zstd is not available in this python, the outputs are archived with gzip")
+            return "gzip"
+    return codec
+
+
+def group_files(folder: str, archives: List[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """Lists the folder once and assigns each file to the first archive whose pattern matches its name.
+
+    Returns:
+        the sorted paths of the files of each archive, every archive being present
+    """
+    groups = {name: list() for name, _ in archives}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            for name, pattern in archives:
+                if fnmatch.fnmatchcase(entry.name, pattern):
+                    groups[name].append(entry.path)
+                    break
+    return {name: sorted(files) for name, files in groups.items()}
+
+
+def write_archive(archive: str, files: List[str], codec: str = "gzip", level: int = -1) -> str:
+    """Writes the files to the archive, by their base names, and removes them once it is complete."""
+    mode, _, keyword, default = CODECS[codec]
+    options = dict()
+    if keyword is not None:
+        options[keyword] = default if level < 0 else level
+    with tarfile.open(archive, mode, **options) as tar:
+        for f in files:
+            tar.add(f, arcname=os.path.basename(f))
+    for f in files:
+        os.remove(f)
+    return archive
+
+
+def archive_outputs(folder: str, archives: List[Tuple[str, str]], codec: str = "gzip",
+                    level: int = -1, workers: int = 0) -> List[str]:
+    """Packs the files of a folder in one archive per pattern, as setup_tree_output does.
+
+    An archive is written for every pattern, even when no file matches it.
+
+    Parameters:
+        folder: the folder with the outputs, where the archives are written
+        archives: the (archive name, file pattern) list, see RAXML_ARCHIVES and IQTREE_ARCHIVES
+        codec: none, gzip, xz or zstd
+        level: the compression level, -1 uses the default of the codec
+        workers: number of archives written at the same time, 0 uses the cores available to this process
+    Returns:
+        the paths of the archives
+    """
+    codec = available_codec(codec)
+    extension = CODECS[codec][1]
+    groups = group_files(folder, archives)
+    if workers < 1:
+        workers = available_cores()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as pool:
+        futures = [pool.submit(write_archive, os.path.join(folder, f"{name}.{extension}"), files, codec, level)
+                   for name, files in groups.items()]
+        return [f.result() for f in futures]
@@ -0,0 +1,75 @@
+""" Time of the tree output archiving of setup_tree_output, per codec.
+
+A folder of synthetic iqtree outputs (one file of each kind per gene) is
+archived the old way, one glob and one serial "w:gz" tarfile per kind of
+file, and with archiver.archive_outputs for every codec available. The size
+of the archives is reported next to the time.
+
+Usage:
+    python3 benchmarks/archive_outputs.py --genes 2000 --size 20
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from archiver import CODECS, IQTREE_ARCHIVES, archive_outputs, available_codec  # noqa: E402
+
+
+def synthetic_outputs(folder, genes, size, seed):
+    """Newick-like text of about size kB for every gene and kind of file."""
+    rng = random.Random(seed)
+    os.makedirs(folder)
+    words = [f"T{t:03d}:{rng.random():.6f}" for t in range(200)]
+    for g in range(genes):
+        for _, pattern in IQTREE_ARCHIVES:
+            text = ','.join(rng.choice(words) for _ in range(size*1024//12))
+            with open(os.path.join(folder, pattern.replace('*', f"gene{g:05d}.phy")), 'w') as f:
+                f.write(text)
+
+
+def serial(folder):
+    for name, pattern in IQTREE_ARCHIVES:
+        with tarfile.open(os.path.join(folder, f"{name}.tgz"), "w:gz") as tar:
+            files = glob.glob(os.path.join(folder, pattern))
+            for f in files:
+                tar.add(f, arcname=os.path.basename(f))
+            for f in files:
+                os.remove(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=20, help='kB per file')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(f"{'method':>16} {'seconds':>9} {'MB':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, 'serial')
+        synthetic_outputs(folder, args.genes, args.size, args.seed)
+        start = time.perf_counter()
+        serial(folder)
+        base = time.perf_counter() - start
+        size = sum(os.path.getsize(f) for f in glob.glob(os.path.join(folder, '*')))/2**20
+        print(f"{'serial gzip':>16} {base:>9.2f} {size:>9.1f} {1.0:>7.2f}x")
+        for codec in CODECS:
+            if available_codec(codec) != codec:
+                continue
+            folder = os.path.join(tmp, codec)
+            synthetic_outputs(folder, args.genes, args.size, args.seed)
+            start = time.perf_counter()
+            archives = archive_outputs(folder, IQTREE_ARCHIVES, codec, workers=args.workers)
+            elapsed = time.perf_counter() - start
+            size = sum(os.path.getsize(f) for f in archives)/2**20
+            print(f"{codec:>16} {elapsed:>9.2f} {size:>9.1f} {base/elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
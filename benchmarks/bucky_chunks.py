@@ -0,0 +1,73 @@
+""" Scheduler overhead of the bucky quartets against the chunk size (BuckyChunk).
+
+The quartets of a synthetic manifest are run by quartets.run_bucky_chunk, one
+task per chunk submitted to a pool of processes that stands for the Parsl
+workers of a node, with a stub bucky that only writes the .out and
+.concordance files of its quartet. A chunk of 1 is the old layout of one task
+per quartet; the time of the stub is the same for every chunk size, so the
+differences are the cost of dispatching the tasks and of the files they leave.
+
+Usage:
+    python3 benchmarks/bucky_chunks.py --taxa 20 --chunks 1,10,100,1000
+"""
+import argparse
+import os
+import stat
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversion import available_cores  # noqa: E402
+from quartets import MANIFEST, chunk_store, chunks, run_bucky_chunk, write_manifest  # noqa: E402
+
+STUB = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    if [ "$1" = "-o" ]; then out=$2; shift; fi
+    shift
+done
+echo "Read 2 genes with a total of 3 different sampled tree topologies" > $out.out
+printf 'translate\\n 1 A,\\n 2 B,\\n 3 C,\\n 4 D;\\n\\nAll Splits:\\n{1,2|3,4}\\n' > $out.concordance
+"""
+
+
+def run(bucky, folder, total, size, workers, slots):
+    manifest = os.path.join(folder, MANIFEST)
+    with ProcessPoolExecutor(max_workers=slots) as pool:
+        futures = [pool.submit(run_bucky_chunk, bucky, "-a 1", [], manifest, first, count,
+                               chunk_store(folder, first), workers)
+                   for first, count in chunks(total, size)]
+        done = sum(f.result() for f in futures)
+    assert done == total
+    return len(futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--taxa', type=int, default=20)
+    parser.add_argument('--chunks', default='1,10,100,1000')
+    parser.add_argument('--workers', type=int, default=1, help="bucky processes of each chunk")
+    args = parser.parse_args()
+    slots = max(1, available_cores()//args.workers)
+    with tempfile.TemporaryDirectory() as tmp:
+        bucky = os.path.join(tmp, 'bucky')
+        with open(bucky, 'w') as f:
+            f.write(STUB)
+        os.chmod(bucky, os.stat(bucky).st_mode | stat.S_IEXEC)
+        taxa = [f"T{t:03d}" for t in range(args.taxa)]
+        print(f"{'chunk':>6} {'tasks':>7} {'files':>7} {'seconds':>9} {'quartets/s':>11}")
+        for size in [int(c) for c in args.chunks.split(',')]:
+            folder = os.path.join(tmp, f'chunk{size}')
+            os.mkdir(folder)
+            total = write_manifest(os.path.join(folder, MANIFEST), combinations(taxa, 4))
+            start = time.perf_counter()
+            tasks = run(bucky, folder, total, size, args.workers, slots)
+            elapsed = time.perf_counter() - start
+            files = len(os.listdir(folder))
+            print(f"{size:>6} {tasks:>7} {files:>7} {elapsed:>9.2f} {total/elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
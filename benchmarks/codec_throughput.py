@@ -0,0 +1,113 @@
+""" Throughput and peak memory of the native alignment codec against Bio.AlignIO.
+
+Synthetic nexus, fasta and phylip alignments are converted to the two other
+formats, as setup_phylip_data does, once with Bio.AlignIO.convert and once
+with alignment_codec.convert (ConversionCodec = native). Every run is a fresh
+process, which reports its own peak resident memory (VmHWM, as ru_maxrss
+keeps the peak of the parent across exec on Linux). The outputs of both
+codecs are compared byte by byte.
+
+Usage:
+    python3 benchmarks/codec_throughput.py --genes 200 --taxa 50 --sites 5000
+"""
+import argparse
+import filecmp
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EXTENSIONS = {"nexus": "nex", "fasta": "fasta", "phylip-sequential": "phy"}
+
+
+def synthetic_alignments(folder, in_format, genes, taxa, sites, seed):
+    rng = random.Random(seed)
+    names = [f"T{t:04d}" for t in range(taxa)]
+    os.makedirs(folder)
+    for g in range(genes):
+        base = [rng.choice("ACGT") for _ in range(sites)]
+        seqs = [''.join(c if rng.random() > 0.05 else rng.choice("ACGT-") for c in base) for _ in names]
+        if in_format == "nexus":
+            lines = ["#NEXUS", "", "BEGIN DATA;", f"\tDIMENSIONS NTAX={taxa} NCHAR={sites};",
+                     "\tFORMAT DATATYPE=DNA MISSING=? GAP=-;", "MATRIX"]
+            lines += [f"{name}  {seq}" for name, seq in zip(names, seqs)]
+            lines += [";", "END;"]
+        elif in_format == "fasta":
+            lines = [line for name, seq in zip(names, seqs) for line in (f">{name}", seq)]
+        else:
+            lines = [f" {taxa} {sites}"] + [name.ljust(10) + seq for name, seq in zip(names, seqs)]
+        with open(os.path.join(folder, f"gene{g:05d}.{EXTENSIONS[in_format]}"), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def peak_rss():
+    """The peak resident memory of this process, in kilobytes."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def convert_folder(codec, in_folder, in_format, out_folder):
+    """Runs in a child process: converts every file of in_folder to the other formats."""
+    if codec == "native":
+        from alignment_codec import convert
+    else:
+        from Bio.AlignIO import convert
+    os.makedirs(out_folder)
+    for name in sorted(os.listdir(in_folder)):
+        gene = name.split('.')[0]
+        for out_format, extension in EXTENSIONS.items():
+            if out_format != in_format:
+                convert(os.path.join(in_folder, name), in_format,
+                        os.path.join(out_folder, f"{gene}.{extension}"), out_format, molecule_type="DNA")
+    print(peak_rss())
+
+
+def run(codec, in_folder, in_format, out_folder):
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, __file__, '--child', codec, in_folder, in_format, out_folder],
+                           check=True, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    # the child prints its own peak, in kilobytes
+    return elapsed, int(child.stdout.split()[-1])/1024
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        convert_folder(*sys.argv[2:6])
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=200)
+    parser.add_argument('--taxa', type=int, default=50)
+    parser.add_argument('--sites', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(f"{'input':>18} {'codec':>10} {'seconds':>9} {'MB/s':>8} {'max RSS MB':>11} {'speedup':>8} {'identical':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for in_format in EXTENSIONS:
+            in_folder = os.path.join(tmp, in_format)
+            synthetic_alignments(in_folder, in_format, args.genes, args.taxa, args.sites, args.seed)
+            mbytes = sum(os.path.getsize(os.path.join(in_folder, f)) for f in os.listdir(in_folder))/2**20
+            native_out = os.path.join(tmp, f"{in_format}.native")
+            native, native_rss = run("native", in_folder, in_format, native_out)
+            bio_out = os.path.join(tmp, f"{in_format}.biopython")
+            bio, bio_rss = run("biopython", in_folder, in_format, bio_out)
+            files = sorted(os.listdir(bio_out))
+            _, mismatch, errors = filecmp.cmpfiles(bio_out, native_out, files, shallow=False)
+            same = len(mismatch) == 0 and len(errors) == 0
+            print(f"{in_format:>18} {'biopython':>10} {bio:>9.2f} {mbytes/bio:>8.1f} {bio_rss:>11.1f} {1.0:>7.2f}x {'-':>10}")
+            print(f"{in_format:>18} {'native':>10} {native:>9.2f} {mbytes/native:>8.1f} {native_rss:>11.1f} {bio/native:>7.2f}x {str(same):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+""" Time of the serial and parallel alignment conversion of setup_phylip_data.
+
+A tarball of synthetic nexus alignments is converted by the serial engine
+(extract the tarball, then two Bio.AlignIO.convert calls per gene, as
+setup_phylip_data does with ConversionEngine = serial) and by
+conversion.convert_tarball with a growing number of processes. The outputs
+of both engines are compared file by file.
+
+Usage:
+    python3 benchmarks/conversion_engine.py --genes 1000 --taxa 30 --sites 1500
+"""
+import argparse
+import filecmp
+import glob
+import io
+import os
+import random
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversion import available_cores, convert_tarball  # noqa: E402
+
+
+def synthetic_tarball(path, genes, taxa, sites, seed):
+    """Nexus alignments with a log-normal spread of lengths around sites."""
+    rng = random.Random(seed)
+    names = [f"T{t:04d}" for t in range(taxa)]
+    with tarfile.open(path, "w:gz") as tar:
+        for g in range(genes):
+            nchar = max(30, int(sites*rng.lognormvariate(0.0, 0.5)))
+            base = [rng.choice("ACGT") for _ in range(nchar)]
+            lines = ["#NEXUS", "", "BEGIN DATA;", f"\tDIMENSIONS NTAX={taxa} NCHAR={nchar};",
+                     "\tFORMAT DATATYPE=DNA MISSING=? GAP=-;", "MATRIX"]
+            for name in names:
+                seq = ''.join(c if rng.random() > 0.05 else rng.choice("ACGT-") for c in base)
+                lines.append(f"{name}  {seq}")
+            lines += [";", "END;", ""]
+            data = '\n'.join(lines).encode()
+            info = tarfile.TarInfo(f"gene{g:05d}.nex")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def serial(tar_file, input_dir):
+    from Bio import AlignIO
+    for folder in ('sequence', 'nexus', 'phylip', 'fasta'):
+        os.makedirs(os.path.join(input_dir, folder), exist_ok=True)
+    with tarfile.open(tar_file, "r:gz") as tar:
+        tar.extractall(path=os.path.join(input_dir, 'sequence'))
+    for f in glob.glob(os.path.join(input_dir, 'sequence', '*')):
+        out_name = os.path.basename(f).split('.')[0]
+        AlignIO.convert(f, "nexus", os.path.join(input_dir, 'phylip', f'{out_name}.phy'), "phylip-sequential", molecule_type="DNA")
+        AlignIO.convert(f, "nexus", os.path.join(input_dir, 'fasta', f'{out_name}.fasta'), "fasta", molecule_type="DNA")
+        shutil.copyfile(f, os.path.join(input_dir, 'nexus', os.path.basename(f)))
+
+
+def same_outputs(a, b):
+    for folder in ('sequence', 'nexus', 'phylip', 'fasta'):
+        files = sorted(os.listdir(os.path.join(a, folder)))
+        if files != sorted(os.listdir(os.path.join(b, folder))):
+            return False
+        _, mismatch, errors = filecmp.cmpfiles(os.path.join(a, folder), os.path.join(b, folder), files, shallow=False)
+        if mismatch or errors:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=1000)
+    parser.add_argument('--taxa', type=int, default=30)
+    parser.add_argument('--sites', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        tar_file = os.path.join(tmp, 'sequences.tar.gz')
+        synthetic_tarball(tar_file, args.genes, args.taxa, args.sites, args.seed)
+        start = time.perf_counter()
+        serial(tar_file, os.path.join(tmp, 'serial'))
+        base = time.perf_counter() - start
+        print(f"{'engine':>12} {'workers':>8} {'seconds':>9} {'speedup':>8} {'identical':>10}")
+        print(f"{'serial':>12} {1:>8} {base:>9.2f} {1.0:>7.2f}x {'-':>10}")
+        workers = 1
+        while workers <= available_cores():
+            out_dir = os.path.join(tmp, f'parallel{workers}')
+            start = time.perf_counter()
+            convert_tarball(tar_file, out_dir, workers)
+            elapsed = time.perf_counter() - start
+            same = same_outputs(os.path.join(tmp, 'serial'), out_dir)
+            print(f"{'parallel':>12} {workers:>8} {elapsed:>9.2f} {base/elapsed:>7.2f}x {str(same):>10}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+""" Time of the CF table of the gene trees computed by concordance.py (SnaqCF = python).
+
+Random binary gene trees of a growing number of taxa are summarized into the
+CF table read by SNaQ, once with a loop over the quartets and the clades of
+every gene tree, as a per-quartet count does, and once with the bipartitions
+encoded as bitsets and the quartets of all gene trees counted on NumPy arrays.
+Both tables are compared where the loop runs. Each SNaQ process of a dataset
+computed the table again before, so the time is paid once instead of once per
+hmax.
+
+Usage:
+    python3 benchmarks/gene_tree_cf.py --taxa 10,20,30,40 --genes 1000 --loop-max 12
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from concordance import gene_tree_cf  # noqa: E402
+from newick import Tree, read_trees  # noqa: E402
+
+SPLITS = (((0, 1), (2, 3)), ((0, 2), (1, 3)), ((0, 3), (1, 2)))
+
+
+def random_tree(taxa, rng):
+    nodes = list(taxa)
+    while len(nodes) > 2:
+        i, j = sorted(rng.sample(range(len(nodes)), 2), reverse=True)
+        pair = f"({nodes.pop(i)},{nodes.pop(j)}):{rng.random():.4f}"
+        nodes.append(pair)
+    return f"({','.join(nodes)});"
+
+
+def loop_cf(tree_file):
+    """The CF table by a loop over the quartets and the clades of each gene tree."""
+    genes = list()
+    for text in read_trees(tree_file):
+        tree = Tree.parse(text)
+        below = dict()
+
+        def leaves(node):
+            if not tree.children[node]:
+                below[node] = frozenset([tree.name[node]])
+            else:
+                below[node] = frozenset().union(*(leaves(c) for c in tree.children[node]))
+            return below[node]
+        genes.append((leaves(tree.root), [c for n, c in below.items() if tree.children[n]]))
+    taxa = sorted(set().union(*(g[0] for g in genes)))
+    rows = list()
+    for quartet in combinations(taxa, 4):
+        cf, ngenes = [0.0, 0.0, 0.0], 0
+        for found, clades in genes:
+            if not all(t in found for t in quartet):
+                continue
+            ngenes += 1
+            shown = [any(len(c & {quartet[p[0]], quartet[p[1]]}) == 2 and
+                         len(c & {quartet[q[0]], quartet[q[1]]}) == 0 or
+                         len(c & {quartet[q[0]], quartet[q[1]]}) == 2 and
+                         len(c & {quartet[p[0]], quartet[p[1]]}) == 0 for c in clades) for p, q in SPLITS]
+            for k in range(3):
+                cf[k] += shown[k] if any(shown) else 1/3
+        if ngenes > 0:
+            rows.append((quartet, [round(v/ngenes, 12) for v in cf], ngenes))
+    return rows
+
+
+def read_table(table_file):
+    rows = list()
+    with open(table_file) as f:
+        next(f)
+        for line in f:
+            fields = line.rstrip('\n').split(',')
+            rows.append((tuple(fields[:4]), [round(float(v), 12) for v in fields[4:7]], int(fields[7])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--taxa', default='10,20,30,40')
+    parser.add_argument('--genes', type=int, default=1000)
+    parser.add_argument('--loop-max', type=int, default=12, help="most taxa given to the loop")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    print(f"{'taxa':>5} {'quartets':>9} {'loop':>9} {'numpy':>8} {'speedup':>8} {'identical':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for ntax in [int(t) for t in args.taxa.split(',')]:
+            taxa = [f"T{t:03d}" for t in range(ntax)]
+            tree_file = os.path.join(tmp, f'{ntax}.tre')
+            with open(tree_file, 'w') as f:
+                for _ in range(args.genes):
+                    f.write(random_tree(taxa, rng) + '\n')
+            table_file = os.path.join(tmp, f'{ntax}.csv')
+            start = time.perf_counter()
+            _, count = gene_tree_cf(tree_file, table_file)
+            fast = time.perf_counter() - start
+            if ntax <= args.loop_max:
+                start = time.perf_counter()
+                rows = loop_cf(tree_file)
+                slow = time.perf_counter() - start
+                same = rows == read_table(table_file)
+                print(f"{ntax:>5} {count:>9} {slow:>9.2f} {fast:>8.2f} {slow/fast:>7.1f}x {str(same):>10}")
+            else:
+                print(f"{ntax:>5} {count:>9} {'-':>9} {fast:>8.2f} {'-':>8} {'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+""" Makespan of longest-first gene submission against the folder (glob) order.
+
+The gene trees of every dataset of a workload are handed to the TokenScheduler,
+one dataset after the other, either in the order of the phylip folders or
+longest first with the estimated run time as priority, which also orders the
+genes left in the queue across the datasets. The durations follow a
+log-normal law (a few very long genes), and the estimate used for the priority
+is the true duration times a log-normal error, since the taxa x sites model is
+not exact. The tail is the time the run lasts after the first core goes idle.
+
+Usage:
+    python3 benchmarks/lpt_order.py --datasets 4 --genes 250 --nodes 2 --cores 24 --threads 6
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import TokenScheduler  # noqa: E402
+
+
+def workload(datasets, genes, sigma, error, seed):
+    """(duration, estimate) of every gene, dataset by dataset."""
+    rng = random.Random(seed)
+    result = list()
+    for _ in range(datasets):
+        durations = [rng.lognormvariate(0.0, sigma) for _ in range(genes)]
+        result.append([(d, d*rng.lognormvariate(0.0, error)) for d in durations])
+    return result
+
+
+class SimulatedApp:
+    """Returns futures that complete on a simulated clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = list()
+        self.seq = 0
+        self.starts = list()
+
+    def __call__(self, duration, inputs=[]):
+        fut = Future()
+        self.seq += 1
+        self.starts.append(self.now)
+        heapq.heappush(self.events, (self.now + duration, self.seq, fut))
+        return fut
+
+    def run(self):
+        while self.events:
+            self.now, _, fut = heapq.heappop(self.events)
+            fut.set_result(self.now)
+        return self.now
+
+
+def simulate(data, nodes, cores, threads, longest):
+    app = SimulatedApp()
+    scheduler = TokenScheduler(nodes, cores)
+    if longest:
+        # as apps.tree_inference: each dataset holds its own genes until they
+        # are queued, the datasets being ready one after the other
+        for genes in data:
+            hold = scheduler.hold()
+            for duration, estimate in sorted(genes, key=lambda g: g[1], reverse=True):
+                scheduler.submit(app, threads, duration, priority=estimate, hold=hold)
+            hold.release()
+    else:
+        for genes in data:
+            for duration, _ in genes:
+                scheduler.submit(app, threads, duration)
+    makespan = app.run()
+    # the last start is when the queue runs dry and cores begin to idle
+    return makespan, makespan - max(app.starts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--datasets', type=int, default=4)
+    parser.add_argument('--genes', type=int, default=250)
+    parser.add_argument('--nodes', type=int, default=2)
+    parser.add_argument('--cores', type=int, default=24)
+    parser.add_argument('--threads', type=int, default=6)
+    parser.add_argument('--error', type=float, default=0.3, help='sigma of the estimate error')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    slots = args.nodes*(args.cores//args.threads)
+    print(f"{'sigma':>6} {'glob':>10} {'longest':>10} {'bound':>10} {'glob tail':>10} {'lpt tail':>10} {'gain':>7}")
+    for sigma in (0.25, 0.5, 1.0, 1.5, 2.0):
+        data = workload(args.datasets, args.genes, sigma, args.error, args.seed)
+        durations = [d for genes in data for d, _ in genes]
+        glob_span, glob_tail = simulate(data, args.nodes, args.cores, args.threads, False)
+        lpt_span, lpt_tail = simulate(data, args.nodes, args.cores, args.threads, True)
+        bound = max(sum(durations)/slots, max(durations))
+        print(f"{sigma:>6} {glob_span:>10.1f} {lpt_span:>10.1f} {bound:>10.1f} "
+              f"{glob_tail:>10.1f} {lpt_tail:>10.1f} {glob_span/lpt_span:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+""" Time of root_tree with Bio.Phylo and with the native rooting engine.
+
+A file of synthetic gene trees, unrooted and with branch lengths as RAxML
+writes them, is rooted with an outgroup by the old root_tree loop (Bio.Phylo
+parse, root_with_outgroup and buffer += tree.format) and by newick.root_trees
+with the native engine on a growing number of processes. The outputs are
+compared with the one of Bio.Phylo.
+
+Usage:
+    python3 benchmarks/newick_rooting.py --trees 10000 --taxa 30
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conversion import available_cores  # noqa: E402
+from newick import root_trees  # noqa: E402
+
+
+def synthetic_trees(path, trees, taxa, seed):
+    """Random unrooted binary trees (a trifurcation at the top) over the same taxa, in random order."""
+    rng = random.Random(seed)
+    names = [f"T{t:04d}" for t in range(taxa)]
+    with open(path, 'w') as f:
+        for _ in range(trees):
+            nodes = [f"{name}:{rng.random():.5f}" for name in rng.sample(names, taxa)]
+            while len(nodes) > 3:
+                a = nodes.pop(rng.randrange(len(nodes)))
+                b = nodes.pop(rng.randrange(len(nodes)))
+                nodes.append(f"({a},{b}):{rng.random():.5f}")
+            f.write(f"({','.join(nodes)});\n")
+
+
+def biopython(tree_file, outgroup, out_file):
+    from Bio import Phylo
+    buffer = ""
+    for tree in Phylo.parse(tree_file, "newick"):
+        tree.root_with_outgroup(outgroup)
+        buffer += tree.format("newick")
+    with open(out_file, 'w') as out:
+        out.write(buffer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trees', type=int, default=10000)
+    parser.add_argument('--taxa', type=int, default=30)
+    parser.add_argument('--chunk', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_file = os.path.join(tmp, 'besttrees.tre')
+        synthetic_trees(tree_file, args.trees, args.taxa, args.seed)
+        reference = os.path.join(tmp, 'biopython.tre')
+        start = time.perf_counter()
+        biopython(tree_file, "T0000", reference)
+        base = time.perf_counter() - start
+        with open(reference) as f:
+            expected = f.read()
+        print(f"{'engine':>10} {'workers':>8} {'seconds':>9} {'speedup':>8} {'identical':>10}")
+        print(f"{'bio.phylo':>10} {1:>8} {base:>9.2f} {1.0:>7.2f}x {'-':>10}")
+        workers = 1
+        while workers <= available_cores():
+            out_file = os.path.join(tmp, f'native{workers}.tre')
+            start = time.perf_counter()
+            root_trees(tree_file, "T0000", out_file, "native", workers, args.chunk)
+            elapsed = time.perf_counter() - start
+            with open(out_file) as f:
+                same = f.read() == expected
+            print(f"{'native':>10} {workers:>8} {elapsed:>9.2f} {base/elapsed:>7.2f}x {str(same):>10}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+""" Time of setup_qmc_data with pandas iterrows and with the NumPy quartet selection.
+
+A synthetic CF table, as setup_bucky_output writes it, is turned into the
+input of Quartet MaxCut by the old loop of setup_qmc_data (two read_csv with
+dtype='string', then iterrows, a dict and a sort per row) and by qmc.py (one
+read, an argsort per table and vector masks for the ties). The factors are
+drawn from a few values, so many rows tie, and the missing splits are written
+as 0 like bucky's tables. Both outputs are compared where the old loop runs.
+
+Usage:
+    python3 benchmarks/qmc_data.py --quartets 10000,100000,1000000 --old-max 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qmc import format_quartets, qmc_quartets, read_cf_table, taxon_ids  # noqa: E402
+from quartets import CF_HEADER  # noqa: E402
+
+
+def synthetic_table(path, quartets, taxa, seed):
+    rng = random.Random(seed)
+    names = [f"T{t:04d}" for t in range(taxa)]
+    genes = 10
+    with open(path, 'w') as f:
+        f.write(CF_HEADER)
+        for _ in range(quartets):
+            counts = [rng.randint(0, genes) for _ in range(3)]
+            columns = list()
+            for c in counts:
+                if c == 0 and rng.random() < 0.5:
+                    columns.append("0,0,0")
+                else:
+                    columns.append(f"{c/genes},{max(c - 1, 0)/genes},{c/genes}")
+            f.write(f"{','.join(rng.sample(names, 4))},{','.join(columns)},{genes}\n")
+
+
+def old_setup_qmc_data(table_filename):
+    """The loop of setup_qmc_data before qmc.py, returning its two outputs."""
+    import pandas as pd
+    table = pd.read_csv(table_filename, delimiter=',', dtype='string')
+    table = pd.read_csv(table_filename, delimiter=',', dtype='string')
+    quartets = []
+    taxa = {}
+    for index, row in table.iterrows():
+        for i in range(1, 5):
+            if row['taxon' + str(i)] in taxa:
+                taxa[row['taxon' + str(i)]] += 1
+            else:
+                taxa[row['taxon' + str(i)]] = 1
+        cf = {'CF12.34': float(row['CF12.34']), 'CF13.24': float(
+            row['CF13.24']), 'CF14.23': float(row['CF14.23'])}
+        cf_sorted = [k for k in sorted(cf, key=cf.get, reverse=True)]
+        cf_1 = row[cf_sorted[0]]
+        cf_2 = row[cf_sorted[1]]
+        cf_3 = row[cf_sorted[2]]
+        split_1 = f"{row['taxon' + cf_sorted[0][2]]},{row['taxon' + cf_sorted[0][3]]}|{row['taxon' + cf_sorted[0][5]]},{row['taxon' + cf_sorted[0][6]]}"
+        split_2 = f"{row['taxon' + cf_sorted[1][2]]},{row['taxon' + cf_sorted[1][3]]}|{row['taxon' + cf_sorted[1][5]]},{row['taxon' + cf_sorted[1][6]]}"
+        split_3 = f"{row['taxon' + cf_sorted[2][2]]},{row['taxon' + cf_sorted[2][3]]}|{row['taxon' + cf_sorted[2][5]]},{row['taxon' + cf_sorted[2][6]]}"
+        if(cf_1 == cf_2 == cf_3):
+            quartets.extend([split_1, split_2, split_3])
+        elif (cf_1 == cf_2):
+            quartets.extend([split_1, split_2])
+        else:
+            quartets.append(split_1)
+    taxa_id = 1
+    taxon_to_id = {}
+    id_to_taxon = {}
+    for k in sorted(taxa):
+        taxon_to_id[str(taxa_id)] = k
+        id_to_taxon[k] = taxa_id
+        taxa_id += 1
+    for i in range(0, len(quartets)):
+        tmp1 = quartets[i].split('|')
+        old_quartets = []
+        old_quartets.extend(tmp1[0].split(','))
+        old_quartets.extend(tmp1[1].split(','))
+        quartets[i] = f"{id_to_taxon[old_quartets[0]]},{id_to_taxon[old_quartets[1]]}|{id_to_taxon[old_quartets[2]]},{id_to_taxon[old_quartets[3]]}"
+    return (' ').join(quartets), json.dumps(taxon_to_id)
+
+
+def new_setup_qmc_data(table_filename):
+    table = read_cf_table(table_filename)
+    return format_quartets(qmc_quartets(table)), json.dumps(taxon_ids(table.names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quartets', default='10000,100000,1000000')
+    parser.add_argument('--taxa', type=int, default=60)
+    parser.add_argument('--old-max', type=int, default=100000, help="largest table given to the old loop")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(f"{'quartets':>9} {'iterrows':>9} {'numpy':>8} {'speedup':>8} {'identical':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(q) for q in args.quartets.split(',')]:
+            table = os.path.join(tmp, f'{size}.csv')
+            synthetic_table(table, size, args.taxa, args.seed)
+            start = time.perf_counter()
+            new = new_setup_qmc_data(table)
+            fast = time.perf_counter() - start
+            if size <= args.old_max:
+                start = time.perf_counter()
+                old = old_setup_qmc_data(table)
+                slow = time.perf_counter() - start
+                print(f"{size:>9} {slow:>9.2f} {fast:>8.2f} {slow/fast:>7.1f}x {str(old == new):>10}")
+            else:
+                print(f"{size:>9} {'-':>9} {fast:>8.2f} {'-':>8} {'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+""" Makespan of the core-token scheduler against the round-robin chaining.
+
+The old pipeline builders chained the N-th RAxML/IQ-TREE task to the task
+N-k (k = cores/threads) through a CircularList, so every chain ran its genes
+one after the other. This benchmark replays a skewed gene-size workload on a
+simulated clock, using the real TokenScheduler for the token policy.
+
+Usage:
+    python3 benchmarks/scheduler_makespan.py --genes 1000 --nodes 2 --cores 24 --threads 6
+"""
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import TokenScheduler  # noqa: E402
+
+
+def gene_durations(genes, sigma, seed):
+    """Log-normal gene run times: most genes are short, a few are very long."""
+    rng = random.Random(seed)
+    return [rng.lognormvariate(0.0, sigma) for _ in range(genes)]
+
+
+def round_robin_makespan(durations, slots):
+    # task i waits for task i - slots, i.e. every slot is a sequential chain
+    chains = [0.0 for _ in range(slots)]
+    for i, d in enumerate(durations):
+        chains[i % slots] += d
+    return max(chains)
+
+
+class SimulatedApp:
+    """Returns futures that complete on a simulated clock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.events = list()
+        self.seq = 0
+
+    def __call__(self, duration, inputs=[]):
+        fut = Future()
+        self.seq += 1
+        heapq.heappush(self.events, (self.now + duration, self.seq, fut))
+        return fut
+
+    def run(self):
+        while self.events:
+            self.now, _, fut = heapq.heappop(self.events)
+            fut.set_result(self.now)
+        return self.now
+
+
+def token_makespan(durations, nodes, cores, threads):
+    app = SimulatedApp()
+    scheduler = TokenScheduler(nodes, cores)
+    for d in durations:
+        scheduler.submit(app, threads, d)
+    return app.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=1000)
+    parser.add_argument('--nodes', type=int, default=2)
+    parser.add_argument('--cores', type=int, default=24)
+    parser.add_argument('--threads', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    slots = math.floor(args.nodes*args.cores/args.threads)
+    print(f"{'sigma':>6} {'round-robin':>12} {'tokens':>12} {'lower bound':>12} {'gain':>7}")
+    for sigma in (0.25, 0.5, 1.0, 1.5, 2.0):
+        durations = gene_durations(args.genes, sigma, args.seed)
+        rr = round_robin_makespan(durations, slots)
+        tk = token_makespan(durations, args.nodes, args.cores, args.threads)
+        lower = max(sum(durations)/slots, max(durations))
+        print(f"{sigma:>6} {rr:>12.1f} {tk:>12.1f} {lower:>12.1f} {rr/tk:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
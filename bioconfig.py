@@ -22,6 +22,8 @@ from genericpath import isfile
 from parsl import bash_app, python_app
 import parsl, os, json, glob
 from appsexception import JsonMissingData, RootMissing, TarMissingData
+from alignment import ALL_FORMATS, TREE_METHOD_FORMATS
+from conversion import CONVERSION_MANIFEST
 
 # COPYRIGHT SECTION
 __author__ = "Diego Carvalho"
@@ -69,6 +71,8 @@ class BioConfig:
     workflow_walltime:  str
     workflow_core:    int
     workflow_node:    int
+    gene_order:         str
+    gene_cost:          str
     raxml:              str
     raxml_dir:          str
     raxml_output:       str
@@ -90,6 +94,8 @@ class BioConfig:
     snaq_threads:       int
     snaq_hmax:          field(default_factory=list)
     snaq_runs:          int
+    snaq_sweep:         str
+    snaq_cf:            str
     snaq_dir:           str
     mrbayes:            str
     mrbayes_parameters: str
@@ -98,6 +104,9 @@ class BioConfig:
     bucky_dir:          str
     mbsum:              str
     mbsum_dir:          str
+    bucky_chunk:        int
+    bucky_workers:      int
+    bucky_reparse:      bool
     quartet_maxcut:     str
     quartet_maxcut_exec_dir: str
     quartet_maxcut_dir: str
@@ -109,7 +118,30 @@ class BioConfig:
     phylonet_input:     str
     phylonet_dir:       str
     phylonet_runs:      str
+    phylonet_batch:     bool
     plot_script:        str
+    conversion_engine:  str
+    conversion_workers: int
+    conversion_codec:   str
+    conversion_formats: str
+    conversion_batch:   int
+    archive:            bool
+    archive_codec:      str
+    archive_level:      int
+    archive_workers:    int
+    packed_store:       bool
+    rooting_engine:     str
+    rooting_workers:    int
+    rooting_chunk:      int
+    quartet_strategy:   str
+    quartet_budget:     int
+    quartet_seed:       int
+    quartet_coverage:   int
+    cache_dir:          str
+    cache_max_size:     int
+    julia_pool:         bool
+    julia_sysimage:     str
+    julia_idle:         int
 
     def __hash__(self):
         workload_tuples = [tuple(item.items()) for item in self.workload]
@@ -129,6 +161,8 @@ class BioConfig:
             self.workflow_walltime,
             self.workflow_core,
             self.workflow_node,
+            self.gene_order,
+            self.gene_cost,
             self.raxml,
             self.raxml_dir,
             self.raxml_output,
@@ -150,6 +184,8 @@ class BioConfig:
             self.snaq_threads,
             tuple(self.snaq_hmax),
             self.snaq_runs,
+            self.snaq_sweep,
+            self.snaq_cf,
             self.snaq_dir,
             self.mrbayes,
             self.mrbayes_parameters,
@@ -158,6 +194,9 @@ class BioConfig:
             self.bucky_dir,
             self.mbsum,
             self.mbsum_dir,
+            self.bucky_chunk,
+            self.bucky_workers,
+            self.bucky_reparse,
             self.quartet_maxcut,
             self.quartet_maxcut_exec_dir,
             self.quartet_maxcut_dir,
@@ -169,7 +208,30 @@ class BioConfig:
             self.phylonet_input,
             self.phylonet_dir,
             self.phylonet_runs,
+            self.phylonet_batch,
             self.plot_script,
+            self.conversion_engine,
+            self.conversion_workers,
+            self.conversion_codec,
+            self.conversion_formats,
+            self.conversion_batch,
+            self.archive,
+            self.archive_codec,
+            self.archive_level,
+            self.archive_workers,
+            self.packed_store,
+            self.rooting_engine,
+            self.rooting_workers,
+            self.rooting_chunk,
+            self.quartet_strategy,
+            self.quartet_budget,
+            self.quartet_seed,
+            self.quartet_coverage,
+            self.cache_dir,
+            self.cache_max_size,
+            self.julia_pool,
+            self.julia_sysimage,
+            self.julia_idle,
         ))
 
 
@@ -227,7 +289,9 @@ class ConfigFactory:
                     input_dir = os.path.join(dir_['dir'], 'input')
                     if os.path.isdir(input_dir) == False:
                         input_dir = os.path.join(dir_['dir'], 'Input')
-                    json_file = glob.glob(os.path.join(input_dir, '*.json'))
+                    # the conversion manifests are written next to the details of the dataset
+                    json_file = [f for f in glob.glob(os.path.join(input_dir, '*.json'))
+                                 if not os.path.basename(f).startswith(CONVERSION_MANIFEST.replace('.json', ''))]
                     if len(json_file) > 0:
                         with open(json_file[0], 'r') as jf:
                             json_data = json.load(jf)
@@ -260,6 +324,22 @@ class ConfigFactory:
             workflow_walltime = None
             workflow_core = int(cf["WORKFLOW"]["MaxCore"]) #hardcoded to ensure a free core to parsl 
             workflow_node = int(cf["WORKFLOW"]["CoresPerWorker"])
+        # the cores of a parsl worker (the executor's cores_per_worker). The workers
+        # are not pinned, so the *Workers = 0 pools use this instead of the node's cores
+        worker_cores = 1 if execution_provider == "SLURM" else max(workflow_node, 1)
+
+        def pool_size(section, option):
+            workers = cf.getint(section, option, fallback=0)
+            return workers if workers > 0 else worker_cores
+        # longest: the gene trees are submitted longest first (estimated from
+        # the alignment sizes), none: in the order of the phylip folder
+        gene_order = cf.get('WORKFLOW', 'GeneOrder', fallback='longest').strip().lower()
+        if gene_order not in ('longest', 'none'):
+            gene_order = 'longest'
+        # cells: taxa x sites, patterns: taxa x distinct site patterns
+        gene_cost = cf.get('WORKFLOW', 'GeneCost', fallback='cells').strip().lower()
+        if gene_cost not in ('cells', 'patterns'):
+            gene_cost = 'cells'
         #RAXML
         raxml = cf['RAXML']['RaxmlExecutable']
         raxml_dir = 'raxml'
@@ -288,6 +368,16 @@ class ConfigFactory:
         for h in snaq_hmax_raw.split(','):
             snaq_hmax.append(h.strip())
         snaq_runs = int(cf['SNAQ']['SnaqRuns'])
+        # none: one independent run per hmax, chain: each hmax starts from the
+        # previous best network, single: one process runs all the hmax values
+        snaq_sweep = cf.get('SNAQ', 'SnaqSweep', fallback='none').strip().lower()
+        if snaq_sweep not in ('none', 'chain', 'single'):
+            snaq_sweep = 'none'
+        # python: the CF table of the gene trees is computed once per dataset by
+        # setup_cf_table, julia: every snaq.jl process computes it
+        snaq_cf = cf.get('SNAQ', 'SnaqCF', fallback='julia').strip().lower()
+        if snaq_cf not in ('python', 'julia'):
+            snaq_cf = 'julia'
         snaq_dir = 'snaq'
         
         #PHYLONET
@@ -296,6 +386,8 @@ class ConfigFactory:
         phylonet = f"java -jar {os.path.join(phylonet_exec_dir, phylonet_jar)}"
         phylonet_threads = cf['PHYLONET']['PhyloNetThreads']
         phylonet_runs = cf['PHYLONET']['PhyloNetRuns']
+        # all the hmax values of a dataset in a single PhyloNet (JVM) run
+        phylonet_batch = cf.getboolean('PHYLONET', 'PhyloNetBatch', fallback=False)
         phylonet_hmax_raw = cf['PHYLONET']['PhyloNetHMax']
         phylonet_hmax = list()
         for h in phylonet_hmax_raw.split(','):
@@ -312,12 +404,70 @@ class ConfigFactory:
         #MBSUM
         mbsum = cf['BUCKY']['MbSumExecutable']
         mbsum_dir = 'mbsum'
+        bucky_chunk = max(cf.getint('BUCKY', 'BuckyChunk', fallback=100), 1)
+        bucky_workers = pool_size('BUCKY', 'BuckyWorkers')
+        bucky_reparse = cf.getboolean('BUCKY', 'BuckyReparse', fallback=False)
         #QUARTET MAXCUT
         quartet_maxcut = cf['QUARTETMAXCUT']['QmcExecutable']
         quartet_maxcut_exec_dir = cf['QUARTETMAXCUT']['QmcExecDir']
         quartet_maxcut_dir = 'qmc'
         #PLOT SCRIPT
         plot_script = os.path.join(script_dir, "plot.jl")
+        #CONVERSION (serial: Bio.AlignIO file by file, parallel: streamed on a process pool)
+        conversion_engine = cf.get('CONVERSION', 'ConversionEngine', fallback='serial').strip().lower()
+        if conversion_engine not in ('serial', 'parallel'):
+            conversion_engine = 'serial'
+        conversion_workers = pool_size('CONVERSION', 'ConversionWorkers')
+        # biopython: Bio.AlignIO, native: alignment_codec, which falls back to Bio.AlignIO
+        conversion_codec = cf.get('CONVERSION', 'ConversionCodec', fallback='biopython').strip().lower()
+        if conversion_codec not in ('biopython', 'native'):
+            conversion_codec = 'biopython'
+        # required: only the formats read by the tree methods of each dataset, all: nexus, fasta and phylip
+        conversion_formats = cf.get('CONVERSION', 'ConversionFormats', fallback='required').strip().lower()
+        if conversion_formats not in ('required', 'all'):
+            conversion_formats = 'required'
+        formats = dict()
+        for dir_ in workload:
+            required = ALL_FORMATS if conversion_formats == 'all' else TREE_METHOD_FORMATS.get(dir_['tree_method'], ALL_FORMATS)
+            formats.setdefault(dir_['dir'], set()).update(required)
+        # a folder listed with several methods is converted once, for all of them
+        for dir_ in workload:
+            dir_['formats'] = tuple(sorted(formats[dir_['dir']]))
+        # genes per convert_genes task, 0 converts each dataset in a single setup_phylip_data task
+        conversion_batch = max(cf.getint('CONVERSION', 'ConversionBatch', fallback=0), 0)
+        #ARCHIVE (the per-gene tree outputs packed by setup_tree_output, left as they are with Archive = False)
+        archive = cf.getboolean('ARCHIVE', 'Archive', fallback=True)
+        archive_codec = cf.get('ARCHIVE', 'ArchiveCodec', fallback='gzip').strip().lower()
+        if archive_codec not in ('none', 'gzip', 'xz', 'zstd'):
+            archive_codec = 'gzip'
+        archive_level = cf.getint('ARCHIVE', 'ArchiveLevel', fallback=-1)
+        archive_workers = pool_size('ARCHIVE', 'ArchiveWorkers')
+        # one data file plus an offset index per kind of output (bootstrap included) instead of the archives
+        packed_store = cf.getboolean('ARCHIVE', 'PackedStore', fallback=False)
+        #ROOTING (root_tree, see newick.py)
+        rooting_engine = cf.get('ROOTING', 'RootingEngine', fallback='native').strip().lower()
+        if rooting_engine not in ('native', 'biopython'):
+            rooting_engine = 'native'
+        rooting_workers = pool_size('ROOTING', 'RootingWorkers')
+        rooting_chunk = max(cf.getint('ROOTING', 'RootingChunk', fallback=500), 1)
+        #QUARTETS (setup_bucky_data and the CF table of snaq, see quartets.py)
+        quartet_strategy = cf.get('QUARTETS', 'QuartetStrategy', fallback='all').strip().lower()
+        if quartet_strategy not in ('all', 'random', 'covering'):
+            quartet_strategy = 'all'
+        quartet_budget = max(cf.getint('QUARTETS', 'QuartetBudget', fallback=10000), 1)
+        quartet_seed = cf.getint('QUARTETS', 'QuartetSeed', fallback=0)
+        quartet_coverage = max(cf.getint('QUARTETS', 'QuartetCoverage', fallback=1), 1)
+        #RESULT CACHE (disabled when there is no CacheDir)
+        cache_dir = cf.get('CACHE', 'CacheDir', fallback='').strip()
+        if len(cache_dir) > 0:
+            cache_dir = os.path.abspath(cache_dir)
+        cache_max_size = cf.getint('CACHE', 'CacheMaxSize', fallback=10240)*1024*1024 #MB
+        #JULIA (warm worker pool and precompiled sysimage, both optional)
+        julia_pool = cf.getboolean('JULIA', 'JuliaPool', fallback=False)
+        julia_sysimage = cf.get('JULIA', 'JuliaSysimage', fallback='').strip()
+        if len(julia_sysimage) > 0:
+            julia_sysimage = os.path.abspath(julia_sysimage)
+        julia_idle = cf.getint('JULIA', 'JuliaIdleTimeout', fallback=600)
         self.bioconfig = BioConfig(script_dir=script_dir,
                                    execution_provider=execution_provider,
                                    plot_networks=plot_networks,
@@ -333,6 +483,8 @@ class ConfigFactory:
                                    workflow_walltime=workflow_walltime,
                                    workflow_core=workflow_core,
                                    workflow_node=workflow_node,
+                                   gene_order=gene_order,
+                                   gene_cost=gene_cost,
                                    raxml=raxml,
                                    raxml_dir=raxml_dir,
                                    raxml_output=raxml_output,
@@ -354,6 +506,8 @@ class ConfigFactory:
                                    snaq_threads=snaq_threads,
                                    snaq_hmax=snaq_hmax,
                                    snaq_runs=snaq_runs,
+                                   snaq_sweep=snaq_sweep,
+                                   snaq_cf=snaq_cf,
                                    snaq_dir=snaq_dir,
                                    mrbayes=mrbayes,
                                    mrbayes_parameters=mrbayes_parameters,
@@ -362,6 +516,9 @@ class ConfigFactory:
                                    bucky_dir=bucky_dir,
                                    mbsum=mbsum,
                                    mbsum_dir=mbsum_dir,
+                                   bucky_chunk=bucky_chunk,
+                                   bucky_workers=bucky_workers,
+                                   bucky_reparse=bucky_reparse,
                                    quartet_maxcut=quartet_maxcut,
                                    quartet_maxcut_exec_dir=quartet_maxcut_exec_dir,
                                    quartet_maxcut_dir=quartet_maxcut_dir,
@@ -373,6 +530,29 @@ class ConfigFactory:
                                    phylonet_input=phylonet_input,
                                    phylonet_dir=phylonet_dir,
                                    phylonet_runs=phylonet_runs,
-                                   plot_script=plot_script
+                                   phylonet_batch=phylonet_batch,
+                                   plot_script=plot_script,
+                                   conversion_engine=conversion_engine,
+                                   conversion_workers=conversion_workers,
+                                   conversion_codec=conversion_codec,
+                                   conversion_formats=conversion_formats,
+                                   conversion_batch=conversion_batch,
+                                   archive=archive,
+                                   archive_codec=archive_codec,
+                                   archive_level=archive_level,
+                                   archive_workers=archive_workers,
+                                   packed_store=packed_store,
+                                   rooting_engine=rooting_engine,
+                                   rooting_workers=rooting_workers,
+                                   rooting_chunk=rooting_chunk,
+                                   quartet_strategy=quartet_strategy,
+                                   quartet_budget=quartet_budget,
+                                   quartet_seed=quartet_seed,
+                                   quartet_coverage=quartet_coverage,
+                                   cache_dir=cache_dir,
+                                   cache_max_size=cache_max_size,
+                                   julia_pool=julia_pool,
+                                   julia_sysimage=julia_sysimage,
+                                   julia_idle=julia_idle
                                    )
         return self.bioconfig
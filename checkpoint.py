@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+""" checkpoint.py. Stage Manifest for Checkpoint and Resume (@) 2021
+
+This module records, for every dataset, which stages of the workflow have
+completed and the fingerprints of their outputs, so a run killed by the
+walltime of the allocation can be resubmitted with --resume and rebuild only
+the missing part of the DAG.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "hp2net_manifest.json"
+
+
+class CompletedStage(Future):
+    """An already finished future standing for a stage that was not run again."""
+
+    def __init__(self, stage: str) -> None:
+        super().__init__()
+        self.stage = stage
+        self.set_result(None)
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _settings_digest(settings: Optional[str], dataset: Optional[List[dict]]) -> Optional[str]:
+    """Hashes the settings file and the workload entries of the dataset, e.g. its outgroup and mapping."""
+    if (settings is None or not os.path.isfile(settings)) and dataset is None:
+        return None
+    digest = hashlib.sha256()
+    if settings is not None and os.path.isfile(settings):
+        digest.update(_file_digest(settings).encode())
+    if dataset is not None:
+        digest.update(json.dumps(sorted(json.dumps(entry, sort_keys=True, default=str) for entry in dataset)).encode())
+    return digest.hexdigest()
+
+
+class StageManifest:
+    """Per-dataset record of the completed stages.
+
+    A stage is described by its name and by its files, given as paths or glob
+    patterns relative to the dataset folder (a folder stands for all of its
+    files). When a stage finishes, the SHA-256 of its files is written to
+    hp2net_manifest.json; on a resumed run the stage is skipped if the files
+    still match and none of the stages it comes after was executed again.
+    Every stage runs again when the settings file or the description of the
+    dataset (its workload entries, outgroup, mapping and sequences) changed.
+
+    Example of use:
+
+    manifest = StageManifest(basedir['dir'], resume=True, settings=cf.config_file, dataset=[basedir])\\
+    ret_ast = manifest.run("RAXML/astral", ["astral/raxml/astral.tre"], ["RAXML/setup_tree_output"],
+                           apps.astral, basedir, bio_config, inputs=[ret_sad])
+    """
+
+    def __init__(self, work_dir: str, resume: bool, settings: Optional[str] = None,
+                 dataset: Optional[List[dict]] = None) -> None:
+        self.work_dir = work_dir
+        self.resume = resume
+        self.manifest_file = os.path.join(work_dir, MANIFEST)
+        self.settings = _settings_digest(settings, dataset)
+        self.stages = dict()
+        self.executed = set()
+        self._lock = threading.Lock()
+        if resume:
+            try:
+                with open(self.manifest_file, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get("settings") == self.settings:
+                    self.stages = manifest.get("stages", dict())
+                else:
+                    logger.warning(f'The settings changed since the last run of {work_dir}, every stage will run again')
+            except (IOError, ValueError):
+                logger.info(f'No stage manifest found in {work_dir}')
+        if os.path.isdir(work_dir):
+            self._save()
+
+    def fingerprint(self, files: List[str]) -> Optional[str]:
+        """Hashes the content of the files, or None if any of them is missing."""
+        digest = hashlib.sha256()
+        for name in files:
+            path = os.path.join(self.work_dir, name)
+            if os.path.isdir(path):
+                path = os.path.join(path, '*')
+            matches = sorted(f for f in glob.glob(path) if os.path.isfile(f))
+            if len(matches) == 0:
+                return None
+            for f in matches:
+                digest.update(os.path.relpath(f, self.work_dir).encode() + b'\0')
+                digest.update(_file_digest(f).encode())
+        return digest.hexdigest()
+
+    def completed(self, stage: str, files: List[str], after: List[str] = []) -> bool:
+        if not self.resume or stage not in self.stages:
+            return False
+        if any(previous in self.executed for previous in after):
+            return False
+        return self.stages[stage] == self.fingerprint(files)
+
+    def run(self, stage: str, files: List[str], after: List[str], submit: Callable, *args, **kwargs) -> Future:
+        """Calls submit(*args, **kwargs) unless the stage is already completed.
+
+        Parameters:
+            stage: name of the stage, unique in the dataset
+            files: files, folders or glob patterns written by the stage, plus the
+                   ones it reads from outside the DAG (e.g. the sequences tarball)
+            after: stages whose outputs this stage reads
+            submit: parsl's application or any callable returning a future
+        Returns:
+            the future of the stage, already done if it was skipped
+        """
+        if self.completed(stage, files, after):
+            logger.info(f'Skipping the completed stage {stage} of {self.work_dir}')
+            return CompletedStage(stage)
+        with self._lock:
+            self.executed.add(stage)
+            # the old record is dropped before the outputs start being rewritten
+            if self.stages.pop(stage, None) is not None:
+                self._save()
+        future = submit(*args, **kwargs)
+        future.add_done_callback(lambda f: self._done(stage, files, f))
+        return future
+
+    def _done(self, stage: str, files: List[str], future: Future) -> None:
+        if future.exception() is not None:
+            return
+        fingerprint = self.fingerprint(files)
+        if fingerprint is None:
+            logger.warning(f'The stage {stage} of {self.work_dir} finished without its files')
+            return
+        with self._lock:
+            self.stages[stage] = fingerprint
+            self._save()
+
+    def _save(self) -> None:
+        tmp = f"{self.manifest_file}.{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump({"settings": self.settings, "stages": self.stages}, f, indent=1)
+        os.replace(tmp, self.manifest_file)
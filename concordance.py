@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+""" concordance.py. Quartet Concordance Factors (@) 2021
+
+This module computes the CF table of the gene trees given to SNaQ in the RAxML
+and IQ-TREE flows, once per dataset, instead of every snaq.jl process doing it
+with readTrees2CF or countquartetsintrees. Each gene tree is reduced to its
+bipartitions, encoded as bitsets: bit e of the row of a taxon is set when the
+taxon is below the internal edge e. A quartet a,b|c,d is then displayed by a
+gene tree when some edge has a and b on one side and c and d on the other,
+
+    (A & B & ~C & ~D) | (~A & ~B & C & D) != 0
+
+which is evaluated for blocks of quartets and every gene tree at once with
+NumPy. The table is written as PhyloNetworks' writeTableCF writes it:
+
+    t1,t2,t3,t4,CF12_34,CF13_24,CF14_23,ngenes
+
+With a species mapping the quartets are the ones of the species, as in
+countquartetsintrees: a gene tree adds to the factors of four species the mean
+over its quartets of individuals of those species, and counts as one gene.
+A quartet left unresolved by a gene tree adds 1/3 to each of its factors.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import os
+from itertools import combinations, product
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from newick import Tree, read_trees
+
+TABLE_SUFFIX = "_tableCF.csv"
+TABLE_HEADER = "t1,t2,t3,t4,CF12_34,CF13_24,CF14_23,ngenes\n"
+# number of bytes of the (genes, quartets, edge words) arrays evaluated at once
+BLOCK_BYTES = 1 << 23
+
+
+def snaq_table(dir_name: str, tree_method: str, strategy: str = "all") -> str:
+    """The name of the CF table of snaq, in the snaq folder."""
+    selection = "" if strategy == "all" else f"_{strategy}"
+    return f"{dir_name}_{tree_method}{selection}{TABLE_SUFFIX}"
+
+
+def species_map(mapping: str) -> Dict[str, str]:
+    """The species of each allele of a mapping written as species1:taxon1,taxon2;species2:taxon3."""
+    species = dict()
+    for spec in mapping.split(';'):
+        if len(spec.strip()) == 0:
+            continue
+        sp, alleles = spec.strip().split(':')
+        for allele in alleles.split(','):
+            species[allele.strip()] = sp.strip()
+    return species
+
+
+def clades(tree: Tree, index: Dict[str, int]) -> Tuple[int, List[int]]:
+    """The taxa of a gene tree and the taxa below each internal edge, as bitsets of their indexes."""
+    children, name = tree.children, tree.name
+    below = [0]*len(children)
+    order, stack = list(), [tree.root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(children[node])
+    for node in reversed(order):
+        if children[node]:
+            for child in children[node]:
+                below[node] |= below[child]
+        elif name[node] in index:
+            below[node] = 1 << index[name[node]]
+    taxa = below[tree.root]
+    ntax = bin(taxa).count("1")
+    # the edges with a single taxon on one of their sides display no quartet
+    edges = [below[node] for node in order[1:] if children[node] and 2 <= bin(below[node]).count("1") <= ntax - 2]
+    return taxa, edges
+
+
+def gene_bitsets(trees: Sequence[Tree], index: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Encodes the bipartitions of the gene trees.
+
+    Returns:
+        the (genes, taxa, words) uint64 array of the edges above each taxon,
+        bit e of a row standing for the e-th internal edge of its gene tree,
+        and the (genes, taxa) mask of the taxa of each gene tree
+    """
+    ntax = len(index)
+    found = [clades(tree, index) for tree in trees]
+    # the edges are packed in 64-bit words, a single one up to 66 taxa
+    words = max([1] + [(len(edges) + 63)//64 for _, edges in found])
+    width = (ntax + 7)//8
+    packed = np.zeros((len(trees), ntax, 8*words), dtype=np.uint8)
+    present = np.zeros((len(trees), ntax), dtype=bool)
+
+    def bits(value):
+        return np.unpackbits(np.frombuffer(value.to_bytes(width, 'little'), dtype=np.uint8), bitorder='little')[:ntax]
+
+    for g, (taxa, edges) in enumerate(found):
+        present[g] = bits(taxa)
+        if edges:
+            # (edges, taxa) membership, packed along the edges
+            members = np.stack([bits(e) for e in edges])
+            packed[g, :, :(len(edges) + 7)//8] = np.packbits(members.T, axis=1, bitorder='little')
+    return packed.view(np.uint64), present
+
+
+def quartet_rows(quartets: Sequence[Tuple[str, ...]], alleles: Dict[str, List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """The quartets of taxa standing for each quartet of species.
+
+    Returns:
+        a (rows, 4) array of taxon indexes, in the order of the species of
+        their quartet, and the first row of each quartet followed by the number of rows
+    """
+    rows, starts = list(), [0]
+    for quartet in quartets:
+        rows.extend(product(*(alleles[sp] for sp in quartet)))
+        starts.append(len(rows))
+    return np.array(rows, dtype=np.intp).reshape(-1, 4), np.array(starts, dtype=np.intp)
+
+
+def count_quartets(bitsets: np.ndarray, present: np.ndarray, rows: np.ndarray,
+                   starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sums the concordance factors of each quartet over the gene trees.
+
+    Parameters:
+        bitsets, present: the gene trees encoded by gene_bitsets
+        rows, starts: the quartets encoded by quartet_rows
+    Returns:
+        the (quartets, 3) sums of the factors of 12|34, 13|24 and 14|23, and the
+        number of gene trees with the four species of each quartet
+    """
+    genes, _, words = bitsets.shape
+    nquartets = len(starts) - 1
+    sums = np.zeros((nquartets, 3))
+    ngenes = np.zeros(nquartets, dtype=np.int64)
+    block = max(1, BLOCK_BYTES//(8*max(1, genes*words)))
+    first = 0
+    while first < nquartets:
+        # whole quartets of species, about block quartets of taxa
+        last = max(first + 1, int(np.searchsorted(starts, starts[first] + block, side='right')) - 1)
+        last = min(last, nquartets)
+        a, b, c, d = rows[starts[first]:starts[last]].T
+        A, B, C, D = bitsets[:, a], bitsets[:, b], bitsets[:, c], bitsets[:, d]
+        split = np.empty((3,) + A.shape[:2], dtype=bool)
+        split[0] = ((A & B & ~C & ~D) | (~A & ~B & C & D)).any(axis=2)
+        split[1] = ((A & C & ~B & ~D) | (~A & ~C & B & D)).any(axis=2)
+        split[2] = ((A & D & ~B & ~C) | (~A & ~D & B & C)).any(axis=2)
+        both = present[:, a] & present[:, b] & present[:, c] & present[:, d]
+        unresolved = both & ~split.any(axis=0)
+        if len(rows) == nquartets:
+            # a taxon per species, the genes are summed right away
+            sums[first:last] = ((split & both).sum(axis=1) + unresolved.sum(axis=0)/3).T
+            ngenes[first:last] = both.sum(axis=0)
+        else:
+            # the rows of each quartet of species are averaged per gene tree
+            factor = (split & both) + unresolved/3
+            offsets = starts[first:last] - starts[first]
+            seen = np.add.reduceat(both, offsets, axis=1, dtype=np.int64)
+            mean = np.add.reduceat(factor, offsets, axis=2)/np.maximum(seen, 1)
+            sums[first:last] = mean.sum(axis=1).T
+            ngenes[first:last] = (seen > 0).sum(axis=0)
+        first = last
+    return sums, ngenes
+
+
+def write_table(table_file: str, quartets: Sequence[Tuple[str, ...]], sums: np.ndarray, ngenes: np.ndarray) -> int:
+    """Writes the quartets found in some gene tree as writeTableCF does.
+
+    Returns:
+        the number of quartets written
+    """
+    keep = np.flatnonzero(ngenes > 0)
+    cf = sums[keep]/ngenes[keep, None]
+    tmp = f"{table_file}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        f.write(TABLE_HEADER)
+        for i, row in zip(keep.tolist(), cf.tolist()):
+            f.write(f"{','.join(quartets[i])},{row[0]!r},{row[1]!r},{row[2]!r},{ngenes[i]}\n")
+    os.replace(tmp, table_file)
+    return len(keep)
+
+
+def gene_tree_cf(tree_file: str, table_file: str, mapping: str = "",
+                 quartets: Iterable[Tuple[str, ...]] = None) -> Tuple[int, int]:
+    """Computes the CF table of the gene trees of a Newick file.
+
+    Parameters:
+        tree_file: the gene trees, e.g. setup_tree_output's
+        table_file: the CF table written
+        mapping: the species mapping of the dataset, empty when each taxon is a species
+        quartets: the quartets of species of the table, all of them when None
+    Returns:
+        the number of species and of quartets written
+    """
+    trees = [Tree.parse(text) for text in read_trees(tree_file)]
+    taxa = sorted({name for tree in trees for node, name in enumerate(tree.name)
+                   if name and not tree.children[node]})
+    species = species_map(mapping)
+    alleles = dict()
+    for i, taxon in enumerate(taxa):
+        alleles.setdefault(species.get(taxon, taxon), list()).append(i)
+    names = sorted(alleles)
+    if quartets is None:
+        quartets = combinations(names, 4)
+    # the taxa of each quartet in the order of the names, as t1 < t2 < t3 < t4 of writeTableCF
+    quartets = [tuple(sorted(q)) for q in quartets if all(sp in alleles for sp in q)]
+    bitsets, present = gene_bitsets(trees, {taxon: i for i, taxon in enumerate(taxa)})
+    rows, starts = quartet_rows(quartets, alleles)
+    sums, ngenes = count_quartets(bitsets, present, rows, starts)
+    return len(names), write_table(table_file, quartets, sums, ngenes)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+""" conversion.py. Parallel Alignment Conversion (@) 2021
+
+This module converts the gene alignments of a sequences tarball to the
+phylip, fasta and nexus formats used by the applications. The members are
+read straight from the tar stream and converted by a pool of processes, each
+alignment being parsed only once for all of its output formats.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import alignment_codec
+from alignment import NEXUS, FASTA, PHYLIP, ALL_FORMATS, detect_format, gene_name
+
+# Bio.AlignIO name, folder and extension of every format
+FORMATS = {
+    NEXUS:  ("nexus", "nexus", "nex"),
+    FASTA:  ("fasta", "fasta", "fasta"),
+    PHYLIP: ("phylip-sequential", "phylip", "phy"),
+}
+CONVERSION_MANIFEST = "conversion_manifest.json"
+# the alignments of the tarball, written by extract_alignments; not a .json
+# file, which would be taken for the details of the dataset
+ALIGNMENT_LIST = "alignments.txt"
+
+
+def available_cores() -> int:
+    """Cores this process may run on.
+
+    The parsl workers are not pinned to cores (no cpu_affinity), so inside a
+    task this is every core of the node, not the worker's share: the workflow
+    gives the pools an explicit size instead (see bioconfig, *Workers = 0).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def source_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def output_files(filename: str, input_format: int, formats: Sequence[int], input_dir: str) -> Dict[int, str]:
+    """Files written for an alignment in the given formats.
+
+    The file is copied to the folder of its own format under its own name, and
+    converted to the other formats as <gene>.<extension>.
+
+    Parameters:
+        filename: the alignment's file name
+        input_format: the format of the alignment
+        formats: the formats needed by the dataset
+        input_dir: the dataset's input folder
+    Returns:
+        the path written for each format
+    """
+    basename = os.path.basename(filename)
+    outputs = dict()
+    for output_format in formats:
+        _, folder, extension = FORMATS[output_format]
+        name = basename if output_format == input_format else f'{gene_name(basename)}.{extension}'
+        outputs[output_format] = os.path.join(input_dir, folder, name)
+    return outputs
+
+
+class ConversionManifest:
+    """Record of the converted files of a dataset, kept in input/conversion_manifest.json.
+
+    Each file is stored with the SHA-256 of its source alignment and its own
+    size and modification time. A file is up to date, and is not written
+    again, while its source is unchanged and the file wasn't touched since.
+
+    The conversion tasks of a batch of genes (ConversionBatch) run at the same
+    time, so each one saves its records in its own part,
+    input/conversion_manifest.<part>.json. The records of every part are read.
+    """
+
+    def __init__(self, input_dir: str, part: Optional[int] = None) -> None:
+        self.input_dir = input_dir
+        name = CONVERSION_MANIFEST if part is None else CONVERSION_MANIFEST.replace('.json', f'.{part}.json')
+        self.manifest_file = os.path.join(input_dir, name)
+        self.files = dict()
+        self.own = dict()
+        for manifest_file in sorted(glob.glob(os.path.join(input_dir, CONVERSION_MANIFEST.replace('.json', '*.json')))):
+            try:
+                with open(manifest_file, 'r') as f:
+                    files = json.load(f)
+            except (IOError, ValueError):
+                continue
+            self.files.update(files)
+            if manifest_file == self.manifest_file:
+                self.own = files
+
+    def up_to_date(self, path: str, digest: str) -> bool:
+        record = self.files.get(os.path.relpath(path, self.input_dir))
+        if record is None or record[0] != digest:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return record[1:] == [stat.st_size, stat.st_mtime_ns]
+
+    def record(self, path: str, digest: str) -> None:
+        stat = os.stat(path)
+        key = os.path.relpath(path, self.input_dir)
+        self.files[key] = self.own[key] = [digest, stat.st_size, stat.st_mtime_ns]
+
+    def save(self) -> None:
+        tmp = f"{self.manifest_file}.{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(self.own, f, indent=1)
+        os.replace(tmp, self.manifest_file)
+
+
+def convert_alignment(name: str, data: bytes, input_dir: str, codec: str = "biopython",
+                      outputs: Dict[int, str] = None) -> str:
+    """Writes an alignment of the tarball in the formats of its dataset, as apps.setup_phylip_data does.
+
+    The original file is saved in input/sequence and, when its format is
+    needed, in the folder of its own format. The other formats are written
+    from a single parse.
+
+    Parameters:
+        name: the file name of the tar member
+        data: the content of the tar member
+        input_dir: the dataset's input folder
+        codec: biopython or native (alignment_codec, with Bio.AlignIO for the unsupported files)
+        outputs: the files to write (see output_files), None writes all the formats
+    Returns:
+        the gene name
+    """
+    filename = os.path.basename(name)
+    out_name = gene_name(filename)
+    text = data.decode()
+    input_format = detect_format(text.lstrip().split('\n', 1)[0])
+    if input_format is None:
+        raise ValueError(f"Unknown alignment format in {name}")
+    if outputs is None:
+        outputs = output_files(filename, input_format, ALL_FORMATS, input_dir)
+    with open(os.path.join(input_dir, 'sequence', filename), 'wb') as f:
+        f.write(data)
+    write_alignment(data, input_format, outputs, codec)
+    return out_name
+
+
+def write_alignment(data: bytes, input_format: int, outputs: Dict[int, str], codec: str = "biopython") -> None:
+    """Copies the alignment to the output of its own format and converts it, parsed once, to the others."""
+    if input_format in outputs:
+        with open(outputs[input_format], 'wb') as f:
+            f.write(data)
+    conversions = {output_format: path for output_format, path in outputs.items() if output_format != input_format}
+    if len(conversions) == 0:
+        return
+    if codec == 'native':
+        try:
+            alignment = alignment_codec.read_alignment(data, input_format)
+            for output_format, path in conversions.items():
+                alignment_codec.WRITERS[output_format](alignment, path)
+            return
+        except alignment_codec.UnsupportedAlignment:
+            pass
+    from Bio import AlignIO
+    alignments = list(AlignIO.parse(io.StringIO(data.decode()), FORMATS[input_format][0]))
+    for alignment in alignments:
+        for record in alignment:
+            record.annotations["molecule_type"] = "DNA"
+    for output_format, path in conversions.items():
+        AlignIO.write(alignments, path, FORMATS[output_format][0])
+
+
+def convert_tarball(tar_file: str, input_dir: str, workers: int = 0, codec: str = "biopython",
+                    formats: Sequence[int] = ALL_FORMATS) -> List[str]:
+    """Converts every alignment of a sequences tarball on a pool of processes.
+
+    The tarball is read as a stream, member by member, and at most a few
+    alignments per process are held in memory at any time. The files that are
+    up to date in the conversion manifest are not written again.
+
+    Parameters:
+        tar_file: the dataset's sequences tarball
+        input_dir: the dataset's input folder, where sequence and the folders of the formats are created
+        workers: number of processes, 0 uses all the cores available to this process
+        codec: biopython or native, see convert_alignment
+        formats: the formats needed by the dataset
+    Returns:
+        the converted gene names
+    """
+    for folder in ['sequence'] + [FORMATS[f][1] for f in formats]:
+        os.makedirs(os.path.join(input_dir, folder), exist_ok=True)
+    if workers < 1:
+        workers = available_cores()
+    manifest = ConversionManifest(input_dir)
+    genes = list()
+    pending = dict()
+
+    def collect(done):
+        for f in done:
+            genes.append(f.result())
+            digest, outputs = pending.pop(f)
+            for path in outputs.values():
+                manifest.record(path, digest)
+
+    # spawn, since the parsl worker that calls it may be running threads
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            with tarfile.open(tar_file, "r|*") as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    data = tar.extractfile(member).read()
+                    input_format = detect_format(data.lstrip().split(b'\n', 1)[0].decode())
+                    if input_format is None:
+                        raise ValueError(f"Unknown alignment format in {member.name}")
+                    digest = source_digest(data)
+                    outputs = {output_format: path for output_format, path
+                               in output_files(member.name, input_format, formats, input_dir).items()
+                               if not manifest.up_to_date(path, digest)}
+                    sequence = os.path.join(input_dir, 'sequence', os.path.basename(member.name))
+                    if len(outputs) == 0 and os.path.isfile(sequence):
+                        genes.append(gene_name(member.name))
+                        continue
+                    pending[pool.submit(convert_alignment, member.name, data, input_dir, codec, outputs)] = (digest, outputs)
+                    if len(pending) >= 4*workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+            collect(list(pending))
+    finally:
+        manifest.save()
+    return sorted(genes)
+
+
+def extract_alignments(tar_file: str, input_dir: str) -> List[Tuple[str, int]]:
+    """Extracts a sequences tarball to input/sequence and saves the list of its alignments.
+
+    Only the first line of each alignment is read, to detect its format. The
+    members keep the folders they have in the tarball, so an alignment is
+    listed by its path relative to input/sequence.
+
+    Returns:
+        the paths and formats of its alignments, sorted by path
+    """
+    alignments = list()
+    with tarfile.open(tar_file, "r:*") as tar:
+        tar.extractall(path=os.path.join(input_dir, 'sequence'))
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            name = os.path.normpath(member.name)
+            with open(os.path.join(input_dir, 'sequence', name), 'rb') as f:
+                line = f.readline().decode(errors='replace')
+            alignments.append((name, detect_format(line)))
+    alignments.sort()
+    with open(os.path.join(input_dir, ALIGNMENT_LIST), 'w') as f:
+        for name, input_format in alignments:
+            f.write(f"{name}\t{input_format}\n")
+    return alignments
+
+
+def listed_alignments(input_dir: str) -> List[Tuple[str, int]]:
+    """The alignments saved by extract_alignments."""
+    alignments = list()
+    with open(os.path.join(input_dir, ALIGNMENT_LIST)) as f:
+        for line in f:
+            name, _, input_format = line.rstrip('\n').rpartition('\t')
+            alignments.append((name, None if input_format == 'None' else int(input_format)))
+    return alignments
+
+
+def convert_files(input_dir: str, names: List[str], formats: Sequence[int], codec: str = "biopython",
+                  part: Optional[int] = None) -> List[str]:
+    """Converts a batch of the alignments extracted to input/sequence.
+
+    Parameters:
+        input_dir: the dataset's input folder
+        names: paths of the alignments relative to input/sequence
+        formats: the formats needed by the dataset
+        codec: biopython or native, see convert_alignment
+        part: the part of the conversion manifest written by this batch
+    Returns:
+        the converted gene names
+    """
+    manifest = ConversionManifest(input_dir, part)
+    try:
+        for name in names:
+            with open(os.path.join(input_dir, 'sequence', name), 'rb') as f:
+                data = f.read()
+            input_format = detect_format(data.lstrip().split(b'\n', 1)[0].decode())
+            if input_format is None:
+                raise ValueError(f"Unknown alignment format in {name}")
+            digest = source_digest(data)
+            outputs = {output_format: path for output_format, path
+                       in output_files(name, input_format, formats, input_dir).items()
+                       if not manifest.up_to_date(path, digest)}
+            write_alignment(data, input_format, outputs, codec)
+            for path in outputs.values():
+                manifest.record(path, digest)
+    finally:
+        manifest.save()
+    return [gene_name(name) for name in names]
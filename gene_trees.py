@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+""" gene_trees.py. Gene Tree Collector (@) 2021
+
+This module gathers the best tree of each gene as soon as its raxml or iqtree
+task finishes, instead of reading every tree file once the last task is over.
+The trees are appended to a packed store in the tree folder, one line per
+gene, and when the last gene arrives the best trees file and the bootstrap
+list of ASTRAL are written in the order of the genes (gene_key), whatever the order
+in which the tasks finished.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from packed_store import PackedStore
+
+logger = logging.getLogger(__name__)
+
+GENE_TREES = "gene_trees"
+
+
+def gene_key(path: str) -> str:
+    """The gene of an alignment or of one of its tree files, by which the genes are ordered.
+
+    a.phy, RAxML_bestTree.a, RAxML_bootstrap.a, a.phy.treefile and a.phy.ufboot
+    are all gene a, so every list of a dataset's genes is sorted the same way
+    whether it is built from the alignments or from the outputs of a method.
+    """
+    name = os.path.basename(path)
+    if name.startswith('RAxML_'):
+        return name.split('.', 1)[1]
+    for suffix in ('.treefile', '.ufboot'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def read_gene_trees(tree_dir: str) -> Iterator[Tuple[str, str]]:
+    """Streams the (gene, newick line) of the store of a tree folder, in gene order."""
+    store = PackedStore(os.path.join(tree_dir, GENE_TREES))
+    for gene, tree in store.items(sorted(store.keys(), key=gene_key)):
+        yield gene, tree.decode()
+
+
+def write_atomic(path: str, data: str) -> None:
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class GeneTreeCollector:
+    """Collects the best trees of the genes of a dataset while their tasks finish.
+
+    The store is the PackedStore gene_trees of the tree folder, with the first
+    line of each tree file keyed by the gene and its bootstrap file as the
+    entry's text, appended in completion order. The genes are slotted by gene_key:
+    once every watched task is done, besttree_file and bs_file are written in
+    slot order and future is set to True, or to False when a gene is missing,
+    so setup_tree_output knows whether it still has to build them.
+
+    Example of use:
+
+    collector = GeneTreeCollector(raxml_dir, genes, besttree_file, bs_file)\\
+    for gene, tree_file, bootstrap in genes:\\
+        collector.watch(gene, raxml(...))\\
+    setup_tree_output(basedir, config, collected=collector.future, inputs=...)
+    """
+
+    def __init__(self, store_dir: str, genes: List[Tuple[str, str, str]], besttree_file: str,
+                 bs_file: str = None) -> None:
+        """
+        Parameters:
+            store_dir: the tree folder, where the store is written
+            genes: the (gene, tree file, bootstrap file) of every gene; the tree file
+                is read when the gene finishes, the bootstrap file is only listed
+            besttree_file: the concatenation of the best trees (besttrees.tre)
+            bs_file: the list of bootstrap files given to ASTRAL (BSlistfiles), None
+                when the bootstrap files are packed and astral exports its own list
+        """
+        self.store_dir = store_dir
+        self.besttree_file = besttree_file
+        self.bs_file = bs_file
+        self.future = Future()
+        self._genes = {gene: (slot, tree_file, bootstrap)
+                       for slot, (gene, tree_file, bootstrap) in enumerate(sorted(genes, key=lambda g: gene_key(g[0])))}
+        self._trees: Dict[int, Tuple[str, str]] = dict()
+        self._missing = list()
+        self._lock = threading.Lock()
+        self._store = PackedStore(os.path.join(store_dir, GENE_TREES), 'w')
+        self._remaining = len(self._genes)
+        if self._remaining == 0:
+            self._finish()
+
+    def watch(self, gene: str, future: Future) -> None:
+        """Collects the tree of the gene when its future is done (immediately if it already is)."""
+        future.add_done_callback(lambda f: self._collect(gene, f))
+
+    def _collect(self, gene: str, future: Future) -> None:
+        slot, tree_file, bootstrap = self._genes[gene]
+        tree = None
+        try:
+            if future.exception() is None:
+                with open(tree_file) as f:
+                    tree = f.readline()
+                if not tree.endswith('\n'):
+                    tree += '\n'
+        except OSError as e:
+            logger.warning(f'The tree of {gene} could not be collected: {e}')
+            tree = None
+        with self._lock:
+            if tree is None:
+                self._missing.append(gene)
+            else:
+                self._store.add(gene, tree.encode(), bootstrap)
+                self._trees[slot] = (tree, bootstrap)
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._finish()
+
+    def _finish(self) -> None:
+        self._store.close()
+        if self._missing:
+            logger.warning(f'{len(self._missing)} gene trees of {self.store_dir} were not collected')
+            self.future.set_result(False)
+            return
+        try:
+            trees = [self._trees[slot] for slot in sorted(self._trees)]
+            write_atomic(self.besttree_file, ''.join(tree for tree, _ in trees))
+            if self.bs_file is not None:
+                Path(os.path.dirname(self.bs_file)).mkdir(parents=True, exist_ok=True)
+                write_atomic(self.bs_file, ''.join(f'{bootstrap}\n' for _, bootstrap in trees))
+        except OSError as e:
+            logger.warning(f'The gene trees of {self.store_dir} could not be written: {e}')
+            self.future.set_result(False)
+            return
+        self.future.set_result(True)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+""" julia_pool.py. Warm Julia Worker Pool (@) 2021
+
+This module runs the Julia scripts of the workflow (snaq.jl, plot.jl) on a
+pool of long-lived Julia processes, started once per node, instead of a new
+julia process per task, so PhyloNetworks is loaded and compiled only once.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import argparse
+import fcntl
+import getpass
+import glob
+import os
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'scripts', 'julia_server.jl')
+START_TIMEOUT = 1800
+
+
+def default_pool_dir() -> str:
+    """A node-local folder, so every node has its own pool."""
+    return os.path.join(tempfile.gettempdir(), f'hp2net-julia-{getpass.getuser()}')
+
+
+def julia_command(config, script: str, args: List[str]) -> str:
+    """Builds the bash command that runs a julia script, on the pool if it is enabled.
+
+    Parameters:
+        config: the workflow's BioConfig
+        script: path of the julia script
+        args: the script's arguments
+    """
+    args = ' '.join(shlex.quote(str(a)) for a in args)
+    if not config.julia_pool:
+        sysimage = f' --sysimage={shlex.quote(config.julia_sysimage)}' if len(config.julia_sysimage) > 0 else ''
+        return f'julia{sysimage} {script} {args}'
+    client = [sys.executable, os.path.abspath(__file__), 'run', '--idle', str(config.julia_idle)]
+    if len(config.julia_sysimage) > 0:
+        client += ['--sysimage', config.julia_sysimage]
+    return f"{' '.join(shlex.quote(c) for c in client)} -- {script} {args}"
+
+
+def encode_request(fields: List[str]) -> bytes:
+    """Encodes a request of julia_server.jl: the number of fields, then the size
+    and the bytes of each one, so the fields may be empty or hold newlines.
+    """
+    request = f'{len(fields)}\n'.encode()
+    for field in fields:
+        data = str(field).encode()
+        request += f'{len(data)}\n'.encode() + data + b'\n'
+    return request
+
+
+class JuliaPool:
+    """Client side of the pool of one node.
+
+    Every slot of the pool is a julia_server.jl process listening on
+    slot<N>.sock and guarded by slot<N>.lock. A job takes the first slot whose
+    lock is free, starting its server if it is not running, so the pool grows
+    up to the number of concurrent Julia tasks of the node. The servers exit
+    after being idle for a while.
+    """
+
+    def __init__(self, pool_dir: Optional[str] = None, sysimage: str = "", idle: int = 600) -> None:
+        self.pool_dir = pool_dir if pool_dir is not None else default_pool_dir()
+        self.sysimage = sysimage
+        self.idle = idle
+        os.makedirs(self.pool_dir, exist_ok=True)
+
+    def _slot(self):
+        slot = 0
+        while True:
+            lock = open(os.path.join(self.pool_dir, f'slot{slot}.lock'), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot, lock
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+
+    @staticmethod
+    def _connect(socket_path: str) -> Optional[socket.socket]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+            return sock
+        except OSError:
+            sock.close()
+            return None
+
+    def _start(self, slot: int) -> socket.socket:
+        socket_path = os.path.join(self.pool_dir, f'slot{slot}.sock')
+        command = ['julia']
+        if len(self.sysimage) > 0:
+            command.append(f'--sysimage={self.sysimage}')
+        command += [SERVER_SCRIPT, socket_path, str(self.idle)]
+        with open(os.path.join(self.pool_dir, f'slot{slot}.server.log'), 'a') as log:
+            server = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                                      stdin=subprocess.DEVNULL, start_new_session=True)
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f'The julia server of slot {slot} exited with {server.returncode}, '
+                                   f'see {self.pool_dir}/slot{slot}.server.log')
+            sock = self._connect(socket_path) if os.path.exists(socket_path) else None
+            if sock is not None:
+                return sock
+            time.sleep(0.5)
+        server.kill()
+        raise RuntimeError(f'The julia server of slot {slot} did not start in {START_TIMEOUT}s')
+
+    def run(self, script: str, args: List[str]) -> int:
+        """Runs a julia script on a warm server, printing its output.
+
+        Returns:
+            the exit code of the script
+        """
+        slot, lock = self._slot()
+        try:
+            sock = self._connect(os.path.join(self.pool_dir, f'slot{slot}.sock'))
+            if sock is None:
+                sock = self._start(slot)
+            log = os.path.join(self.pool_dir, f'slot{slot}.job.log')
+            request = [log, os.path.abspath(script)] + [str(a) for a in args]
+            with sock, sock.makefile('r') as stream:
+                sock.sendall(encode_request(request))
+                reply = stream.readline().split()
+            if os.path.exists(log):
+                with open(log, 'r') as f:
+                    shutil.copyfileobj(f, sys.stdout)
+                sys.stdout.flush()
+            if len(reply) != 2 or reply[0] != 'exit':
+                print(f'The julia server of slot {slot} stopped during the job', file=sys.stderr)
+                return 1
+            return int(reply[1])
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def stop(self) -> None:
+        """Stops the idle servers of the pool."""
+        for socket_path in glob.glob(os.path.join(self.pool_dir, 'slot*.sock')):
+            lock_file = socket_path[:-len('.sock')] + '.lock'
+            with open(lock_file, 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                sock = self._connect(socket_path)
+                if sock is not None:
+                    with sock, sock.makefile('r') as stream:
+                        sock.sendall(encode_request(['shutdown']))
+                        stream.readline()
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs julia scripts on the warm julia pool of this node.',
+                                     usage='%(prog)s {run,stop} [options] [-- script args...]')
+    parser.add_argument('action', choices=['run', 'stop'])
+    parser.add_argument('--pool-dir', default=None)
+    parser.add_argument('--sysimage', default="")
+    parser.add_argument('--idle', type=int, default=600)
+    argv = sys.argv[1:]
+    # everything after -- belongs to the julia script
+    command = argv[argv.index('--') + 1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+    pool = JuliaPool(args.pool_dir, args.sysimage, args.idle)
+    if args.action == 'run':
+        if len(command) == 0:
+            parser.error('the julia script is missing')
+        sys.exit(pool.run(command[0], command[1:]))
+    pool.stop()
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+
+""" newick.py. Newick Toolkit (@) 2021
+
+This module holds the Newick tools of the apps. It roots the gene trees of
+root_tree without building Bio.Phylo objects, renames the leaves of a tree
+(setup_qmc_output) and writes the NEXUS blocks given to PhyloNet
+(setup_phylonet_data).
+
+For the rooting, a tree is parsed into a table of nodes (parallel lists of
+names, branch lengths, supports, comments and children, indexed by the node
+number) and rerooted in place. The parser, the rerooting and the writer follow
+Bio.Phylo's Newick parser, Tree.root_with_outgroup and Newick writer step by
+step, so both engines write the same rooted trees.
+
+The trees of a file are rooted in chunks on a pool of processes and written to
+the output as the chunks are done. A tree that cannot be parsed or rooted is
+left out of the output and reported with its number and the reason.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+# the tokens of Bio.Phylo.NewickIO
+TOKENIZER = re.compile(r"\(|\)|[^\s\(\)\[\]\'\:\;\,]+|\:\ ?[+-]?[0-9]*\.?[0-9]+(?:[eE][+-]?[0-9]+)?|\,"
+                       r"|\[(?:\\.|[^\]])*\]|\'(?:\\.|[^\'])*\'|\;|\n")
+UNQUOTED_LABEL = re.compile(r"[^\s\(\)\[\]\'\:\;\,]+")
+
+ENGINES = ("native", "biopython")
+
+
+class NewickError(ValueError):
+    """A tree that could not be parsed or rooted."""
+
+
+def parse_confidence(text: str):
+    if text.isdigit():
+        return int(text)
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+class Tree:
+    """A Newick tree as a node table.
+
+    Node i has the name name[i], the length of the branch above it length[i],
+    the support support[i] (a numeric label of an internal node), the comment
+    comment[i] and the children children[i]; root is the number of the root.
+    """
+
+    __slots__ = ("name", "length", "support", "comment", "children", "root")
+
+    def __init__(self) -> None:
+        self.name: List[Optional[str]] = list()
+        self.length: List[Optional[float]] = list()
+        self.support: List = list()
+        self.comment: List[Optional[str]] = list()
+        self.children: List[List[int]] = list()
+        self.root = 0
+
+    def add(self, length: Optional[float] = None) -> int:
+        self.name.append(None)
+        self.length.append(length)
+        self.support.append(None)
+        self.comment.append(None)
+        self.children.append(list())
+        return len(self.name) - 1
+
+    @classmethod
+    def parse(cls, text: str) -> 'Tree':
+        """Parses one Newick tree, as Bio.Phylo.NewickIO.Parser does."""
+        tokens = TOKENIZER.findall(text.strip())
+        # a node per '(' and ',', plus the root and the one added when the external parentheses are missing
+        size = 2 + sum(1 for token in tokens if token == '(' or token == ',')
+        tree = cls()
+        name = tree.name = [None]*size
+        length = tree.length = [None]*size
+        support = tree.support = [None]*size
+        tree.comment = [None]*size
+        children = tree.children = [[] for _ in range(size)]
+        # the parent of the nodes not attached yet, a node is attached to its parent when it is closed
+        pending = [-1]*size
+
+        def close(node):
+            if name[node] and support[node] is None and children[node]:
+                support[node] = parse_confidence(name[node])
+                if support[node] is not None:
+                    name[node] = None
+            parent = pending[node]
+            if parent >= 0:
+                children[parent].append(node)
+                pending[node] = -1
+            return parent
+
+        root = current = 0
+        count = 1
+        opened = closed = 0
+        for i, token in enumerate(tokens):
+            first = token[0]
+            if first == "(":
+                pending[count] = current
+                current = count
+                count += 1
+                opened += 1
+            elif first == ",":
+                if current == root:
+                    # the external parentheses are missing
+                    root = count
+                    count += 1
+                    pending[current] = root
+                pending[count] = close(current)
+                current = count
+                count += 1
+            elif first == ")":
+                current = close(current)
+                if current < 0:
+                    raise NewickError("Parenthesis mismatch.")
+                closed += 1
+            elif first == ":":
+                length[current] = float(token[1:])
+            elif first == "'":
+                if not name[current]:
+                    name[current] = token[1:-1]
+                else:
+                    name[current] += token[:-1]
+            elif first == "[":
+                tree.comment[current] = token[1:-1]
+            elif first == ";":
+                if i + 1 < len(tokens):
+                    raise NewickError(f"Text after semicolon in Newick tree: {tokens[i + 1]}")
+                break
+            elif first != "\n":
+                name[current] = token
+        if opened != closed:
+            raise NewickError(f"Mismatch, {opened} open vs {closed} close parentheses.")
+        close(current)
+        close(root)
+        for column in (tree.name, tree.length, tree.support, tree.comment, tree.children):
+            del column[count:]
+        tree.root = root
+        return tree
+
+    def path(self, name: str) -> Optional[List[int]]:
+        """The nodes from below the root down to the first node named name, in preorder; None if there is none."""
+        if self.name[self.root] == name:
+            return []
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack[-1]
+            if i == len(self.children[node]):
+                stack.pop()
+                continue
+            stack[-1] = (node, i + 1)
+            child = self.children[node][i]
+            stack.append((child, 0))
+            if self.name[child] == name:
+                return [n for n, _ in stack[1:]]
+        return None
+
+    def root_with_outgroup(self, outgroup: str) -> None:
+        """Reroots the tree on the node named outgroup, as Bio.Phylo's Tree.root_with_outgroup does.
+
+        A terminal outgroup gets a new bifurcating root with a 0 length branch
+        to it, an internal one becomes the root; the old root is dropped when
+        it is left with a single child, its branch length being kept.
+        """
+        path = self.path(outgroup)
+        if path is None:
+            raise NewickError(f"target {outgroup!r} is not in this tree")
+        if len(path) == 0:
+            return
+        length, children = self.length, self.children
+        out = path[-1]
+        prev = length[out] or 0.0
+        if not children[out]:
+            length[out] = 0.0
+            new_root = self.add(length[self.root])
+            children[new_root].append(out)
+            if len(path) == 1:
+                new_parent = new_root
+            else:
+                parent = path.pop(-2)
+                children[parent].remove(out)
+                prev, length[parent] = length[parent], prev - length[out]
+                children[new_root].insert(0, parent)
+                new_parent = parent
+        else:
+            new_root = out
+            length[new_root] = length[self.root]
+            new_parent = new_root
+        for parent in path[-2::-1]:
+            children[parent].remove(new_parent)
+            prev, length[parent] = length[parent], prev
+            children[new_parent].insert(0, parent)
+            new_parent = parent
+        old_root = self.root
+        if out in children[old_root]:
+            children[old_root].remove(out)
+        else:
+            children[old_root].remove(new_parent)
+        if len(children[old_root]) == 1:
+            ingroup = children[old_root][0]
+            if length[ingroup]:
+                length[ingroup] += prev
+            else:
+                length[ingroup] = prev
+            children[new_parent].insert(0, ingroup)
+        else:
+            length[old_root] = prev
+            children[new_parent].insert(0, old_root)
+        self.root = new_root
+
+    def format(self) -> str:
+        """The tree in Newick, as Bio.Phylo's tree.format("newick") writes it, without the new line."""
+        children = self.children
+        # the label, support, branch length and comment written after each node
+        tags = [":%1.8g" % (length or 0.0) for length in self.length]
+        for node, support in enumerate(self.support):
+            if support is not None and children[node]:
+                tags[node] = "%1.2f%s" % (support, tags[node])
+        if any(self.comment):
+            for node, comment in enumerate(self.comment):
+                if comment:
+                    tags[node] += "[%s]" % comment.replace("[", "\\[").replace("]", "\\]")
+        for node, name in enumerate(self.name):
+            if name:
+                if not UNQUOTED_LABEL.fullmatch(name):
+                    name = "'%s'" % name.replace("'", "''")
+                tags[node] = name + tags[node]
+        parts = list()
+        # a node is pushed as n when entered and as ~n to close it, None stands for a comma
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                parts.append(",")
+            elif node < 0:
+                parts.append(")")
+                parts.append(tags[~node])
+            elif not children[node]:
+                parts.append(tags[node])
+            else:
+                parts.append("(")
+                stack.append(~node)
+                kids = children[node]
+                stack.append(kids[-1])
+                for child in kids[-2::-1]:
+                    stack.append(None)
+                    stack.append(child)
+        parts.append(";")
+        return ''.join(parts)
+
+
+def relabel(text: str, mapping: Dict[str, str]) -> str:
+    """Renames the leaves of Newick text in a single pass over its tokens.
+
+    The unquoted labels of the leaves found in mapping are replaced; the
+    other labels (e.g. the supports of the internal nodes), the branch
+    lengths, comments and spacing are kept as they are.
+    """
+    last = ","
+
+    def replace(match):
+        nonlocal last
+        token = match.group()
+        first = token[0]
+        if first not in "():,;[\n'" and last in "(,":
+            token = mapping.get(token, token)
+        if first != "[" and first != "\n":
+            last = first
+        return token
+
+    return TOKENIZER.sub(replace, text)
+
+
+def leaf_labels(text: str) -> Set[str]:
+    """The unquoted labels of the leaves of Newick text, the ones relabel maps."""
+    labels = set()
+    last = ","
+    for token in TOKENIZER.findall(text):
+        first = token[0]
+        if first not in "():,;[\n'" and last in "(,":
+            labels.add(token)
+        if first != "[" and first != "\n":
+            last = first
+    return labels
+
+
+def write_nexus_trees(out: TextIO, trees: Iterable[str], prefix: str = "geneTree") -> List[str]:
+    """Starts a NEXUS file with a TREES block, one 'Tree <prefix><n> = <tree>' line per tree.
+
+    Returns:
+        the names given to the trees
+    """
+    names = list()
+    out.write("#NEXUS\nBEGIN TREES;\n")
+    for number, tree in enumerate(trees, 1):
+        names.append(f"{prefix}{number}")
+        out.write(f"Tree {names[-1]} = {tree.rstrip()}\n")
+    out.write("END;\n")
+    return names
+
+
+def write_phylonet_block(out: TextIO, commands: Iterable[str]) -> None:
+    """Writes a PHYLONET block with one command per line."""
+    out.write("BEGIN PHYLONET;")
+    for command in commands:
+        out.write(f"\n{command};")
+    out.write("\nEND;")
+
+
+def read_trees(tree_file: str) -> Iterator[str]:
+    """The text of each tree of a Newick file, split as Bio.Phylo.parse does (a tree ends on a line ending with ;)."""
+    buffer = ""
+    with open(tree_file) as f:
+        for line in f:
+            buffer += line.rstrip()
+            if buffer.endswith(";"):
+                yield buffer
+                buffer = ""
+    if buffer:
+        yield buffer
+
+
+def root_chunk(first: int, trees: List[str], outgroup: str, engine: str = "native") -> Tuple[str, List[Tuple[int, str]]]:
+    """Roots a chunk of trees.
+
+    Parameters:
+        first: the number of the first tree of the chunk in its file
+        trees: the Newick text of the trees
+        outgroup: the name of the outgroup taxon
+        engine: native (Tree) or biopython (Bio.Phylo)
+    Returns:
+        the rooted trees, one per line, and the (number, reason) of the trees that could not be rooted
+    """
+    rooted = list()
+    failed = list()
+    if engine == "biopython":
+        from io import StringIO
+        from Bio import Phylo
+    for number, text in enumerate(trees, first):
+        try:
+            if engine == "biopython":
+                tree = Phylo.read(StringIO(text), "newick")
+                tree.root_with_outgroup(outgroup)
+                rooted.append(tree.format("newick"))
+            else:
+                tree = Tree.parse(text)
+                tree.root_with_outgroup(outgroup)
+                rooted.append(tree.format() + "\n")
+        except Exception as e:
+            failed.append((number, f"{type(e).__name__}: {e}"))
+    return ''.join(rooted), failed
+
+
+def root_trees(tree_file: str, outgroup: str, out_file: str, engine: str = "native", workers: int = 0,
+               chunk: int = 500) -> Tuple[int, List[Tuple[int, str]]]:
+    """Roots every tree of a Newick file with an outgroup.
+
+    The chunks are rooted on a pool of processes, when there is more than one
+    chunk and one worker, and their trees are written in the order of the
+    input as each chunk is done. The output is replaced only once complete.
+
+    Parameters:
+        tree_file: the Newick file, e.g. besttrees.tre
+        outgroup: the name of the outgroup taxon
+        out_file: where the rooted trees are written
+        engine: native or biopython
+        workers: number of processes, 0 uses all the cores available to this process
+        chunk: trees per task of the pool
+    Returns:
+        the number of rooted trees and the (number, reason) of the trees left out, numbered from 1
+    """
+    from conversion import available_cores
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown rooting engine {engine}")
+    trees = list(read_trees(tree_file))
+    chunk = max(1, chunk)
+    chunks = [(first + 1, trees[first:first + chunk]) for first in range(0, len(trees), chunk)]
+    if workers < 1:
+        workers = available_cores()
+    workers = min(workers, len(chunks))
+    failed = list()
+    tmp = f"{out_file}.{os.getpid()}"
+    try:
+        with open(tmp, 'w') as out:
+            if workers <= 1:
+                results = (root_chunk(first, part, outgroup, engine) for first, part in chunks)
+                for text, errors in results:
+                    out.write(text)
+                    failed += errors
+            else:
+                # spawn, since the parsl worker that calls it may be running threads
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results = pool.map(root_chunk, [first for first, _ in chunks], [part for _, part in chunks],
+                                       [outgroup]*len(chunks), [engine]*len(chunks))
+                    for text, errors in results:
+                        out.write(text)
+                        failed += errors
+        os.replace(tmp, out_file)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return len(trees) - len(failed), failed
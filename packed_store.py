@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+""" packed_store.py. Packed File Store (@) 2021
+
+This module keeps many small files (the bootstrap trees, bipartitions and
+info files of each gene) in a single data file with an offset index, so a
+dataset leaves two files per kind of output instead of one per gene and the
+readers open one file instead of listing a folder and opening thousands.
+
+A store named raxml/bootstrap is made of raxml/bootstrap.pack, with the
+contents one after the other, and raxml/bootstrap.idx, with one tab separated
+line per entry: key, offset, length and an optional free text. The entries can
+be read by key or streamed in the order they were written, and exported back
+to the loose files they came from:
+
+    python3 packed_store.py export raxml/bootstrap raxml/bootstrap/
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import argparse
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+
+
+class Entry(NamedTuple):
+    offset: int
+    length: int
+    meta: str
+
+
+class PackedStore:
+    """A data file plus its offset index, keyed by the name of the packed file.
+
+    The modes are 'r' (read only), 'a' (append, creating the store when it
+    doesn't exist) and 'w' (truncate and append). Every entry is flushed as
+    it is added, so a store being written can be read by another process. A
+    key added twice keeps its last contents.
+
+    Example of use:
+
+    with PackedStore("raxml/bootstrap", 'w') as store:\\
+        store.add_file("RAxML_bootstrap.E", "raxml/RAxML_bootstrap.E")\\
+    for key, data in PackedStore("raxml/bootstrap").items():\\
+        ...
+    """
+
+    def __init__(self, path: str, mode: str = 'r') -> None:
+        if mode not in ('r', 'a', 'w'):
+            raise ValueError(f"Unknown packed store mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.entries: Dict[str, Entry] = dict()
+        self._lock = threading.Lock()
+        self._data = None
+        self._index = None
+        if mode == 'w' or (mode == 'a' and not PackedStore.exists(path)):
+            Path(os.path.dirname(path) or '.').mkdir(parents=True, exist_ok=True)
+            open(path + DATA_SUFFIX, 'wb').close()
+            open(path + INDEX_SUFFIX, 'w').close()
+        self._load()
+        if mode != 'r':
+            self._data = open(path + DATA_SUFFIX, 'ab')
+            self._index = open(path + INDEX_SUFFIX, 'a')
+            self._offset = self._data.tell()
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(path + DATA_SUFFIX) and os.path.exists(path + INDEX_SUFFIX)
+
+    def _load(self) -> None:
+        with open(self.path + INDEX_SUFFIX) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # an entry interrupted while being written
+                    break
+                key, offset, length, meta = line[:-1].split('\t', 3)
+                self.entries.pop(key, None)
+                self.entries[key] = Entry(int(offset), int(length), meta)
+
+    def __enter__(self) -> 'PackedStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def keys(self) -> List[str]:
+        """The keys in the order they were written."""
+        return list(self.entries)
+
+    def meta(self, key: str) -> str:
+        return self.entries[key].meta
+
+    def add(self, key: str, data: bytes, meta: str = '') -> None:
+        """Appends the contents of a key; neither the key nor meta may hold tabs or new lines."""
+        if self._data is None:
+            raise ValueError(f"The packed store {self.path} is read only")
+        with self._lock:
+            self._data.write(data)
+            self._data.flush()
+            self._index.write(f'{key}\t{self._offset}\t{len(data)}\t{meta}\n')
+            self._index.flush()
+            self.entries.pop(key, None)
+            self.entries[key] = Entry(self._offset, len(data), meta)
+            self._offset += len(data)
+
+    def add_file(self, key: str, filename: str, meta: str = '') -> None:
+        with open(filename, 'rb') as f:
+            self.add(key, f.read(), meta)
+
+    def get(self, key: str) -> bytes:
+        """The contents of one key, read at its offset."""
+        entry = self.entries[key]
+        with open(self.path + DATA_SUFFIX, 'rb') as f:
+            f.seek(entry.offset)
+            return f.read(entry.length)
+
+    def items(self, keys: Iterable[str] = None) -> Iterator[Tuple[str, bytes]]:
+        """Streams the (key, contents) of the given keys, all of them in the order they were written by default."""
+        keys = self.keys() if keys is None else keys
+        with open(self.path + DATA_SUFFIX, 'rb') as f:
+            for key in keys:
+                entry = self.entries[key]
+                if f.tell() != entry.offset:
+                    f.seek(entry.offset)
+                yield key, f.read(entry.length)
+
+    def export(self, folder: str, keys: Iterable[str] = None) -> List[str]:
+        """Writes the entries back as loose files of the folder, named by their keys.
+
+        Returns:
+            the paths of the files, in the order of keys
+        """
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        paths = list()
+        for key, data in self.items(keys):
+            path = os.path.join(folder, key)
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+
+def pack_files(path: str, files: List[str]) -> str:
+    """Writes the files to a new store, keyed by their base names, and removes them once it is complete."""
+    with PackedStore(path, 'w') as store:
+        for f in files:
+            store.add_file(os.path.basename(f), f)
+    for f in files:
+        os.remove(f)
+    return path
+
+
+def pack_outputs(folder: str, archives: List[Tuple[str, str]], workers: int = 0) -> List[str]:
+    """Packs the files of a folder in one store per pattern, the packed counterpart of archiver.archive_outputs.
+
+    A store is written for every pattern, even when no file matches it.
+
+    Parameters:
+        folder: the folder with the outputs, where the stores are written
+        archives: the (store name, file pattern) list, see archiver.RAXML_ARCHIVES and archiver.IQTREE_ARCHIVES
+        workers: number of stores written at the same time, 0 uses the cores available to this process
+    Returns:
+        the paths of the stores, without their suffixes
+    """
+    from archiver import group_files
+    from conversion import available_cores
+    groups = group_files(folder, archives)
+    if workers < 1:
+        workers = available_cores()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as pool:
+        futures = [pool.submit(pack_files, os.path.join(folder, name), files) for name, files in groups.items()]
+        return [f.result() for f in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lists or exports the files of a packed store")
+    parser.add_argument('command', choices=['list', 'export'])
+    parser.add_argument('store', help="path of the store, with or without its suffix")
+    parser.add_argument('folder', nargs='?', help="where the files are exported")
+    args = parser.parse_args()
+    path = args.store
+    for suffix in (DATA_SUFFIX, INDEX_SUFFIX):
+        if path.endswith(suffix):
+            path = path[:-len(suffix)]
+    store = PackedStore(path)
+    if args.command == 'list':
+        for key, entry in store.entries.items():
+            print(f'{key}\t{entry.length}\t{entry.meta}')
+    else:
+        if args.folder is None:
+            parser.error("export needs the folder")
+        store.export(args.folder)
+        print(f'{len(store)} files exported to {args.folder}')
+
+
+if __name__ == "__main__":
+    main()
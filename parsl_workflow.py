@@ -1,199 +1,297 @@
 import parsl
 import apps
-import glob
 import bioconfig
 import os
 import logging
 import argparse
-import math
+from concurrent.futures import Future
+from functools import partial
 from infra_manager import workflow_config, wait_for_all
-from utils import CircularList
+from scheduler import TokenScheduler
+from result_cache import ResultCache
+from checkpoint import CompletedStage, StageManifest
+from conversion import ALIGNMENT_LIST, FORMATS, listed_alignments, output_files
+from julia_pool import JuliaPool
+from concordance import snaq_table
+from quartets import log_selection, snaq_quartets
 
 reuse = False
 cache = dict()
+# dataset folder -> {converted file: (stage, convert_genes future, source alignment)},
+# or a future of it while the alignments are being extracted
+conversions = dict()
 # LOGGING SECTION
 logger = logging.getLogger()
 logging.basicConfig(level=logging.CRITICAL)
 
 
-def raxml_snaq(bio_config, basedir, prepare_to_run):
-    max_workers = bio_config.workflow_core*bio_config.workflow_node
+def conversion_stages(basedir):
+    """Stages that write the alignments read by the gene trees of the dataset."""
+    if basedir['dir'] not in conversions:
+        return ['phylip']
+    if isinstance(conversions[basedir['dir']], Future):
+        # the batches are submitted after the extraction, which runs again
+        return ['sequence']
+    return ['sequence'] + sorted({stage for stage, _, _ in conversions[basedir['dir']].values()})
+
+
+def tree_inference(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    # a dataset listed with both network methods shares its gene trees
+    key = (basedir['dir'], basedir['tree_method'])
+    if key not in cache:
+        tree_method = basedir['tree_method']
+        if tree_method == 'RAXML':
+            tree_dir = bio_config.raxml_dir
+            besttree_file = os.path.join(tree_dir, bio_config.raxml_output)
+        else:
+            tree_dir = bio_config.iqtree_dir
+            besttree_file = os.path.join(tree_dir, bio_config.iqtree_output)
+        if bio_config.packed_store:
+            bootstrap = [os.path.join(tree_dir, 'bootstrap.pack'), os.path.join(tree_dir, 'bootstrap.idx')]
+        else:
+            bootstrap = [os.path.join(tree_dir, 'bootstrap')]
+        cache[key] = manifest.run(f'{tree_method}/setup_tree_output',
+                                  [besttree_file] + bootstrap, conversion_stages(basedir),
+                                  apps.tree_inference, basedir, bio_config, scheduler, manifest,
+                                  conversions.get(basedir['dir']), inputs=prepare_to_run)
+    return cache[key]
+
+
+def astral(bio_config, basedir, ret_sad, manifest):
+    tree_method = basedir['tree_method']
+    tree_dir = bio_config.raxml_dir if tree_method == 'RAXML' else bio_config.iqtree_dir
+    astral_file = os.path.join(bio_config.astral_dir, tree_dir, bio_config.astral_output)
+    return manifest.run(f'{tree_method}/astral', [astral_file], [f'{tree_method}/setup_tree_output'],
+                        apps.astral, basedir, bio_config, inputs=[ret_sad])
+
+
+def log_quartets(bio_config, basedir, future):
+    """Records the quartets selected for the dataset in the run log once the future returns their number."""
+    def log(f):
+        if f.exception() is None and isinstance(f.result(), tuple):
+            ntax, selected = f.result()
+            log_selection(basedir['dir'], ntax, selected, bio_config.quartet_strategy, logging.getLogger("parsl"))
+    future.add_done_callback(log)
+    return future
+
+
+def setup_quartets(bio_config, basedir, ret_sad, manifest):
+    """The setup_quartets of the CF table of snaq, none when every quartet is kept."""
+    if bio_config.quartet_strategy == 'all':
+        return []
+    tree_method = basedir['tree_method']
+    quartet_file = os.path.join(bio_config.snaq_dir, snaq_quartets(os.path.basename(basedir['dir']), tree_method))
+    return [log_quartets(bio_config, basedir,
+                         manifest.run(f'{tree_method}/quartets', [quartet_file], [f'{tree_method}/setup_tree_output'],
+                                      apps.setup_quartets, basedir, bio_config, inputs=[ret_sad]))]
+
+
+def setup_cf_table(bio_config, basedir, ret_sad, ret_quartets, manifest):
+    """The setup_cf_table of the snaq processes and its stage, none when each one computes the CF table."""
+    if bio_config.snaq_cf != 'python':
+        return [], []
+    tree_method = basedir['tree_method']
+    table = os.path.join(bio_config.snaq_dir, snaq_table(os.path.basename(basedir['dir']), tree_method,
+                                                         bio_config.quartet_strategy))
+    stages = [f'{tree_method}/setup_tree_output']
+    if len(ret_quartets) > 0:
+        stages.append(f'{tree_method}/quartets')
+    ret_cf = manifest.run(f'{tree_method}/cf_table', [table], stages,
+                          apps.setup_cf_table, basedir, bio_config, inputs=[ret_sad] + ret_quartets)
+    return [ret_cf], [f'{tree_method}/cf_table']
+
+
+def root_tree(bio_config, basedir, ret_sad, scheduler, manifest):
+    tree_method = basedir['tree_method']
+    if tree_method == 'RAXML':
+        rooted_file = os.path.join(bio_config.raxml_dir, bio_config.raxml_rooted_output)
+    else:
+        rooted_file = os.path.join(bio_config.iqtree_dir, bio_config.iqtree_rooted_output)
+    return manifest.run(f'{tree_method}/root_tree', [rooted_file], [f'{tree_method}/setup_tree_output'],
+                        scheduler.submit, apps.root_tree, bio_config.rooting_workers, basedir, bio_config,
+                        inputs=[ret_sad])
+
+
+def snaq(bio_config, basedir, ret_tree, scheduler, manifest, after):
+    # after: the stages the snaq runs come after
     result = list()
-    ret_tree = list()
-    datalist = list()
-    pool = CircularList(math.floor(
-        max_workers/int(bio_config.raxml_threads)))
-    # append the input files
-    dir_ = os.path.join(os.path.join(basedir['dir'], "input"), "phylip")
-    datalist = glob.glob(os.path.join(dir_, '*.phy'))
-    for i, input_file in enumerate(datalist):
-        ret = apps.raxml(basedir=basedir,
-                         config=bio_config,
-                         inputs=prepare_to_run,
-                         input_file=input_file, next_pipe=pool.next())
-        pool.current(ret)
-        ret_tree.append(ret)
-    ret_sad = apps.setup_tree_output(
-        basedir=basedir, config=bio_config, inputs=ret_tree)
-    logging.info("Using the Maximum Pseudo Likelihood Method")
-    ret_ast = apps.astral(basedir, config=bio_config, inputs=[ret_sad])
-    pool_phylo = CircularList(math.floor(
-        max_workers/int(bio_config.snaq_threads)))
+    tree_method = basedir['tree_method']
+    networks = dict()
     for h in bio_config.snaq_hmax:
-        ret_snq = apps.snaq(basedir, config=bio_config, hmax=h, inputs=[
-                            ret_ast], next_pipe=pool_phylo.next())
-        pool_phylo.current(ret_snq)
+        networks[h] = os.path.join(bio_config.snaq_dir, f"{os.path.basename(basedir['dir'])}_{tree_method}_MPL_{h}.out")
+    if bio_config.snaq_sweep == 'single':
+        # one julia process goes through every hmax, each one warm-started
+        hmax = ','.join(bio_config.snaq_hmax)
+        ret_snq = manifest.run(f'{tree_method}/snaq_{hmax}', list(networks.values()), after,
+                               scheduler.submit, apps.snaq, bio_config.snaq_threads,
+                               basedir, bio_config, hmax, inputs=ret_tree)
         result.append(ret_snq)
+    elif bio_config.snaq_sweep == 'chain':
+        # the hmax=h run starts from the best network found with the previous hmax
+        previous = None
+        for h in sorted(bio_config.snaq_hmax, key=int):
+            start, inputs, stages = None, ret_tree, after
+            if previous is not None:
+                start = os.path.join(basedir['dir'], networks[previous])
+                inputs = ret_tree + [result[-1]]
+                stages = after + [f'{tree_method}/snaq_{previous}']
+            ret_snq = manifest.run(f'{tree_method}/snaq_{h}', [networks[h]], stages,
+                                   scheduler.submit, apps.snaq, bio_config.snaq_threads,
+                                   basedir, bio_config, h, start=start, inputs=inputs)
+            result.append(ret_snq)
+            previous = h
+    else:
+        for h in bio_config.snaq_hmax:
+            ret_snq = manifest.run(f'{tree_method}/snaq_{h}', [networks[h]], after,
+                                   scheduler.submit, apps.snaq, bio_config.snaq_threads,
+                                   basedir, bio_config, h, inputs=ret_tree)
+            result.append(ret_snq)
     return result
 
 
-def raxml_phylonet(bio_config, basedir, prepare_to_run):
+def phylonet(bio_config, basedir, ret_rooted, scheduler, manifest):
     result = list()
-    ret_tree = list()
-    datalist = list()
-    max_workers = bio_config.workflow_core*bio_config.workflow_node
-    pool = CircularList(math.floor(
-        max_workers/int(bio_config.raxml_threads)))
-    # append the input files
-    dir_ = os.path.join(os.path.join(basedir['dir'], "input"), "phylip")
-    datalist = glob.glob(os.path.join(dir_, '*.phy'))
-    for i, input_file in enumerate(datalist):
-        ret = apps.raxml(basedir=basedir,
-                         inputs=prepare_to_run,
-                         config=bio_config,
-                         input_file=input_file, next_pipe=pool.next())
-        pool.current(ret)
-        ret_tree.append(ret)
-    ret_sad = apps.setup_tree_output(
-        basedir=basedir, config=bio_config, inputs=ret_tree)
-    ret_rooted = apps.root_tree(basedir, config=bio_config, inputs=[ret_sad])
-    logging.info("Using the Maximum Parsimony Method")
+    tree_method = basedir['tree_method']
     out_dir = os.path.join(basedir['dir'], bio_config.phylonet_dir)
-    pool_phylo = CircularList(math.floor(
-        max_workers/int(bio_config.phylonet_threads)))
-    for h in bio_config.phylonet_hmax:
-        ret_spd = apps.setup_phylonet_data(
-            basedir, config=bio_config, hmax=h, inputs=[ret_rooted])
+
+    # in batch mode a single PhyloNet run goes through every hmax
+    batches = [','.join(bio_config.phylonet_hmax)] if bio_config.phylonet_batch else bio_config.phylonet_hmax
+    ret_spd = list()
+
+    def infer_network(h):
+        # the rooted trees are read once, by the setup_phylonet_data of the first batch that runs
+        if len(ret_spd) == 0:
+            ret_spd.append(apps.setup_phylonet_data(basedir, bio_config, batches, inputs=[ret_rooted]))
         filename = os.path.join(
-            out_dir, (basedir['tree_method'] + '_' + h + '_' + bio_config.phylonet_input))
-        ret_phylonet = apps.phylonet(basedir, config=bio_config, input_file=filename, inputs=[
-                                     ret_spd], next_pipe=pool_phylo.next())
-        pool_phylo.current(ret_phylonet)
+            out_dir, (tree_method + '_' + h.replace(',', '_') + '_' + bio_config.phylonet_input))
+        return scheduler.submit(apps.phylonet, bio_config.phylonet_threads,
+                                basedir, bio_config, filename, inputs=ret_spd)
+
+    for hmax in batches:
+        networks = [os.path.join(bio_config.phylonet_dir, f"{os.path.basename(basedir['dir'])}_{tree_method}_MP_{h}.nex")
+                    for h in hmax.split(',')]
+        ret_phylonet = manifest.run(f"{tree_method}/phylonet_{hmax.replace(',', '_')}", networks,
+                                    [f'{tree_method}/root_tree'], infer_network, hmax)
         result.append(ret_phylonet)
     return result
 
 
-def iqtree_snaq(bio_config, basedir, prepare_to_run):
-    max_workers = bio_config.workflow_core*bio_config.workflow_node
-    result = list()
-    ret_tree = list()
-    datalist = list()
-    pool = CircularList(math.floor(
-        max_workers/int(bio_config.iqtree_threads)))
-    # append the input files
-    dir_ = os.path.join(os.path.join(basedir['dir'], "input"), "phylip")
-    datalist = glob.glob(os.path.join(dir_, '*.phy'))
-    for input_file in datalist:
-        ret = apps.iqtree(basedir=basedir, config=bio_config,
-                          inputs=prepare_to_run,
-                          input_file=input_file, next_pipe=pool.next())
-        pool.current(ret)
-        ret_tree.append(ret)
-    ret_sad = apps.setup_tree_output(
-        basedir=basedir, config=bio_config, inputs=ret_tree)
+def raxml_snaq(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    # the gene trees are submitted once the phylip files exist
+    ret_sad = tree_inference(bio_config, basedir, prepare_to_run, scheduler, manifest)
     logging.info("Using the Maximum Pseudo Likelihood Method")
-    ret_ast = apps.astral(basedir, bio_config, inputs=[ret_sad])
-    pool_phylo = CircularList(math.floor(
-        max_workers/int(bio_config.snaq_threads)))
-    for h in bio_config.snaq_hmax:
-        ret_snq = apps.snaq(basedir, bio_config, h, inputs=[
-                            ret_ast], next_pipe=pool_phylo.next())
-        pool_phylo.current(ret_snq)
-        result.append(ret_snq)
-    return result
+    ret_ast = astral(bio_config, basedir, ret_sad, manifest)
+    ret_quartets = setup_quartets(bio_config, basedir, ret_sad, manifest)
+    ret_cf, cf_stages = setup_cf_table(bio_config, basedir, ret_sad, ret_quartets, manifest)
+    return snaq(bio_config, basedir, [ret_ast] + ret_quartets + ret_cf, scheduler, manifest,
+                ['RAXML/astral'] + cf_stages)
 
 
-def iqtree_phylonet(bio_config, basedir, prepare_to_run):
-    result = list()
-    ret_tree = list()
-    datalist = list()
-    max_workers = bio_config.workflow_core*bio_config.workflow_node
-    pool = CircularList(math.floor(max_workers/int(bio_config.iqtree_threads)))
-    # append the input files
-    dir_ = os.path.join(os.path.join(basedir['dir'], "input"), "phylip")
-    datalist = glob.glob(os.path.join(dir_, '*.phy'))
-    for input_file in datalist:
-        ret = apps.iqtree(basedir=basedir, config=bio_config, inputs=prepare_to_run,
-                          input_file=input_file, next_pipe=pool.next())
-        pool.current(ret)
-        ret_tree.append(ret)
-    ret_sad = apps.setup_tree_output(
-        basedir=basedir, config=bio_config, inputs=ret_tree)
-    ret_rooted = apps.root_tree(basedir, bio_config, inputs=[ret_sad])
+def raxml_phylonet(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    ret_sad = tree_inference(bio_config, basedir, prepare_to_run, scheduler, manifest)
+    ret_rooted = root_tree(bio_config, basedir, ret_sad, scheduler, manifest)
     logging.info("Using the Maximum Parsimony Method")
-    out_dir = os.path.join(basedir['dir'], bio_config.phylonet_dir)
-    pool_phylo = CircularList(math.floor(
-        max_workers/int(bio_config.phylonet_threads)))
-    for h in bio_config.phylonet_hmax:
-        ret_spd = apps.setup_phylonet_data(
-            basedir, bio_config, h, inputs=[ret_rooted])
-        filename = os.path.join(
-            out_dir, (basedir['tree_method'] + '_' + h + '_' + bio_config.phylonet_input))
-        ret_phylonet = apps.phylonet(basedir, bio_config, filename, inputs=[
-                                     ret_spd], next_pipe=pool_phylo.next())
-        pool_phylo.current(ret_phylonet)
-        result.append(ret_phylonet)
-    return result
+    return phylonet(bio_config, basedir, ret_rooted, scheduler, manifest)
 
 
-def mrbayes_snaq(bio_config, basedir, prepare_to_run):
-    max_workers = bio_config.workflow_core*bio_config.workflow_node
-    result = list()
-    ret_tree = list()
-    datalist = list()
-    # append the input files
-    dir_ = os.path.join(os.path.join(basedir['dir'], "input"), "nexus")
-    datalist = glob.glob(os.path.join(dir_, '*.nex'))
-    ret_mbsum = list()
-    for input_file in datalist:
-        ret_mb = apps.mrbayes(basedir, bio_config,
-                              input_file=input_file, inputs=prepare_to_run)
-        ret_mbsum.append(apps.mbsum(basedir, bio_config,
-                         input_file=input_file, inputs=[ret_mb]))
-    ret_pre_bucky = apps.setup_bucky_data(
-        basedir, bio_config, inputs=ret_mbsum)
-    wait_for_all([ret_pre_bucky])
-    bucky_folder = os.path.join(basedir['dir'], "bucky")
-    prune_trees = glob.glob(os.path.join(bucky_folder, "*.txt"))
-    ret_bucky = list()
-    for prune_tree in prune_trees:
-        ret_bucky.append(apps.bucky(basedir, bio_config,
-                         prune_file=prune_tree, inputs=[ret_pre_bucky]))
-    ret_post_bucky = apps.setup_bucky_output(
-        basedir, bio_config, inputs=ret_bucky)
-    ret_pre_qmc = apps.setup_qmc_data(
-        basedir, bio_config, inputs=[ret_post_bucky])
-    ret_qmc = apps.quartet_maxcut(basedir, bio_config, inputs=[ret_pre_qmc])
-    ret_tree.append(apps.setup_qmc_output(
-        basedir, bio_config, inputs=[ret_qmc]))
+def iqtree_snaq(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    ret_sad = tree_inference(bio_config, basedir, prepare_to_run, scheduler, manifest)
     logging.info("Using the Maximum Pseudo Likelihood Method")
-    pool_phylo = CircularList(math.floor(
-        max_workers/int(bio_config.snaq_threads)))
-    for h in bio_config.snaq_hmax:
-        ret_snq = apps.snaq(basedir, bio_config, h,
-                            inputs=ret_tree, next_pipe=pool_phylo.next())
-        pool_phylo.current(ret_snq)
-        result.append(ret_snq)
-    return result
+    ret_ast = astral(bio_config, basedir, ret_sad, manifest)
+    ret_quartets = setup_quartets(bio_config, basedir, ret_sad, manifest)
+    ret_cf, cf_stages = setup_cf_table(bio_config, basedir, ret_sad, ret_quartets, manifest)
+    return snaq(bio_config, basedir, [ret_ast] + ret_quartets + ret_cf, scheduler, manifest,
+                ['IQTREE/astral'] + cf_stages)
+
+
+def iqtree_phylonet(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    ret_sad = tree_inference(bio_config, basedir, prepare_to_run, scheduler, manifest)
+    ret_rooted = root_tree(bio_config, basedir, ret_sad, scheduler, manifest)
+    logging.info("Using the Maximum Parsimony Method")
+    return phylonet(bio_config, basedir, ret_rooted, scheduler, manifest)
 
-def prepare_to_run(config):
+
+def mrbayes_snaq(bio_config, basedir, prepare_to_run, scheduler, manifest):
+    dir_name = os.path.basename(basedir['dir'])
+
+    def quartet_maxcut(ret_post_bucky):
+        # the CF table and the taxa are handed over as results of the futures,
+        # only the files read by Quartet MaxCut and SNaQ are written
+        ret_pre_qmc = apps.setup_qmc_data(
+            basedir, bio_config, table=ret_post_bucky)
+        ret_qmc = apps.quartet_maxcut(basedir, bio_config, inputs=[ret_pre_qmc])
+        return apps.setup_qmc_output(basedir, bio_config, ret_pre_qmc, inputs=[ret_qmc])
+
+    # both the gene and the quartet chunk fan-outs are expanded by join apps, so
+    # the main thread never blocks on this dataset
+    ret_pre_bucky = manifest.run('MRBAYES/setup_bucky_data',
+                                 [os.path.join(bio_config.bucky_dir, 'quartets.txt')], conversion_stages(basedir),
+                                 apps.bayesian_inference, basedir, bio_config, manifest,
+                                 conversions.get(basedir['dir']), inputs=prepare_to_run)
+    log_quartets(bio_config, basedir, ret_pre_bucky)
+    ret_post_bucky = manifest.run('MRBAYES/bucky',
+                                  [os.path.join(bio_config.bucky_dir, f'{dir_name}.csv')], ['MRBAYES/setup_bucky_data'],
+                                  apps.bucky_quartets, basedir, bio_config, scheduler, inputs=[ret_pre_bucky])
+    ret_tree = [manifest.run('MRBAYES/qmc',
+                             [os.path.join(bio_config.quartet_maxcut_dir, f'{dir_name}.tre')], ['MRBAYES/bucky'],
+                             quartet_maxcut, ret_post_bucky)]
+    logging.info("Using the Maximum Pseudo Likelihood Method")
+    return snaq(bio_config, basedir, ret_tree, scheduler, manifest, ['MRBAYES/qmc'])
+
+def convert_batches(config, basedir, scheduler, manifest, ret_seq, alignments):
+    """Submits one convert_genes task per ConversionBatch genes of the dataset, each holding one core.
+
+    Returns:
+        the stage, the future and the source alignment of every file written
+    """
+    input_dir = os.path.join(basedir['dir'], 'input')
+    files = dict()
+    for part, start in enumerate(range(0, len(alignments), config.conversion_batch)):
+        batch = alignments[start:start + config.conversion_batch]
+        outputs = {path: os.path.join(input_dir, 'sequence', name) for name, input_format in batch
+                   for path in output_files(name, input_format, basedir['formats'], input_dir).values()}
+        stage = f'phylip/{part}'
+        ret = manifest.run(stage, [os.path.relpath(path, basedir['dir']) for path in outputs], ['sequence'],
+                           scheduler.submit, apps.convert_genes, 1, basedir, config, [name for name, _ in batch], part,
+                           inputs=[ret_seq])
+        for path, source in outputs.items():
+            files[path] = (stage, ret, source)
+    return files
+
+
+def prepare_to_run(config, manifests, scheduler, resume):
+    """Submits the conversion of the alignments and the creation of the folders of every dataset.
+
+    Returns:
+        the futures each dataset folder must wait for before its gene trees are submitted
+    """
     folder_list = list()
-    r = list()
-    phylip_folders = list()
+    r = dict()
     for basedir in config.workload:
-        if basedir['dir'] not in phylip_folders:
-            r.append(apps.setup_phylip_data(basedir, config))
-            phylip_folders.append(basedir['dir'])
+        if basedir['dir'] not in r:
+            manifest = manifests[basedir['dir']]
+            if config.conversion_batch > 0:
+                # the gene trees wait for the batch of their own gene only
+                ret_seq = manifest.run('sequence', [basedir['sequences'], os.path.join('input', 'sequence'),
+                                                    os.path.join('input', ALIGNMENT_LIST)], [],
+                                       apps.extract_sequences, basedir, config)
+                if isinstance(ret_seq, CompletedStage):
+                    # the alignments listed by the previous run
+                    alignments = listed_alignments(os.path.join(basedir['dir'], 'input'))
+                    conversions[basedir['dir']] = convert_batches(config, basedir, scheduler, manifest, ret_seq, alignments)
+                else:
+                    # the batches are fanned out from the listing of extract_sequences,
+                    # the tarball is not read while the workflow is being submitted
+                    conversions[basedir['dir']] = apps.expand(
+                        partial(convert_batches, config, basedir, scheduler, manifest, ret_seq), inputs=[ret_seq])
+                r[basedir['dir']] = [ret_seq]
+            else:
+                phylip_files = [basedir['sequences']]
+                phylip_files += [os.path.join('input', FORMATS[f][1], f'*.{FORMATS[f][2]}') for f in basedir['formats']]
+                # the parallel engine holds the cores of its pool of processes
+                workers = config.conversion_workers if config.conversion_engine == 'parallel' else 1
+                r[basedir['dir']] = [manifest.run('phylip', phylip_files, [],
+                                                  scheduler.submit, apps.setup_phylip_data, workers, basedir, config)]
         network_method = basedir['network_method']
         tree_method = basedir['tree_method']
         if (network_method == 'MPL'):
@@ -211,7 +309,7 @@ def prepare_to_run(config):
                 folder_list.extend([config.raxml_dir, config.phylonet_dir])
             elif (tree_method == 'IQTREE'):
                 folder_list.extend([config.iqtree_dir, config.phylonet_dir])
-        r.append(apps.create_folders(basedir, config, folders=folder_list))
+        r[basedir['dir']].append(apps.create_folders(basedir, config, folders=folder_list, clean=not resume))
     return r
 
 
@@ -227,30 +325,58 @@ def main(**kwargs):
     else:
         cf = bioconfig.ConfigFactory(config_file)
     bio_config = cf.build_config()
+    if kwargs.get("plan") is not None:
+        # dry run: the task graph is built without starting parsl
+        import planner
+        plan = planner.build_plan(bio_config)
+        print(plan.report())
+        plan.to_json(f'{kwargs["plan"]}.json')
+        plan.to_dot(f'{kwargs["plan"]}.dot')
+        return
     dkf_config = workflow_config(bio_config, **kwargs)
     logging.info(f"{hash(bio_config)}")
     dkf = parsl.load(dkf_config)
+    # the run log is the parsl's file logger
+    run_logger = logging.getLogger("parsl")
+    result_cache = None
+    if len(bio_config.cache_dir) > 0:
+        result_cache = ResultCache(bio_config.cache_dir, bio_config.cache_max_size)
+        cache_start = result_cache.stats()
+        run_logger.info(f'Result cache at {bio_config.cache_dir}: {cache_start["entries"]} entries')
     results = list()
-    prep = prepare_to_run(bio_config)
+    # one stage manifest per dataset folder, shared by its workload entries
+    resume = kwargs.get("resume", False)
+    manifests = dict()
+    for basedir in bio_config.workload:
+        if basedir['dir'] not in manifests:
+            # the outgroup, mapping or methods of a folder changed by the workload or its json are a new dataset
+            entries = [b for b in bio_config.workload if b['dir'] == basedir['dir']]
+            manifests[basedir['dir']] = StageManifest(basedir['dir'], resume, settings=cf.config_file, dataset=entries)
+    if resume:
+        run_logger.info(f'Resuming {len(manifests)} datasets from their stage manifests')
+    # the multi-threaded apps and the ones running a pool are started as soon as
+    # their cores are free in the allocation
+    scheduler = TokenScheduler(bio_config.workflow_node, bio_config.workflow_core)
+    prep = prepare_to_run(bio_config, manifests, scheduler, resume)
     for basedir in bio_config.workload:
         r = None
         network_method = basedir['network_method']
         tree_method = basedir['tree_method']
         if (network_method == 'MPL'):
             if (tree_method == 'RAXML'):
-                r = raxml_snaq(bio_config, basedir, prep)
+                r = raxml_snaq(bio_config, basedir, prep[basedir['dir']], scheduler, manifests[basedir['dir']])
             elif (tree_method == 'IQTREE'):
-                r = iqtree_snaq(bio_config, basedir, prep)
+                r = iqtree_snaq(bio_config, basedir, prep[basedir['dir']], scheduler, manifests[basedir['dir']])
             elif (tree_method == 'MRBAYES'):
-                r = mrbayes_snaq(bio_config, basedir, prep)
+                r = mrbayes_snaq(bio_config, basedir, prep[basedir['dir']], scheduler, manifests[basedir['dir']])
             else:
                 logging.error(
                     f'Invalid parameter combination: {bio_config.network_method} and {bio_config.tree_method}')
         elif (network_method == 'MP'):
             if (tree_method == 'RAXML'):
-                r = raxml_phylonet(bio_config, basedir, prep)
+                r = raxml_phylonet(bio_config, basedir, prep[basedir['dir']], scheduler, manifests[basedir['dir']])
             elif (tree_method == 'IQTREE'):
-                r = iqtree_phylonet(bio_config, basedir, prep)
+                r = iqtree_phylonet(bio_config, basedir, prep[basedir['dir']], scheduler, manifests[basedir['dir']])
             else:
                 logging.error(
                     f'Invalid parameter combination: {bio_config.network_method} and {bio_config.tree_method}')
@@ -265,6 +391,14 @@ def main(**kwargs):
         wait_for_all([plot])
     else:
         wait_for_all(results)
+    if result_cache is not None:
+        cache_end = result_cache.stats()
+        run_logger.info(f'Result cache: {cache_end["hits"] - cache_start["hits"]} hits, '
+                        f'{cache_end["misses"] - cache_start["misses"]} misses, '
+                        f'{cache_end["entries"]} entries using {cache_end["size"]} bytes')
+    if bio_config.julia_pool:
+        # the servers of the other nodes exit when they become idle
+        JuliaPool(sysimage=bio_config.julia_sysimage, idle=bio_config.julia_idle).stop()
     parsl.dfk().cleanup() 
     return
 
@@ -280,8 +414,14 @@ if __name__ == "__main__":
         "-r", "--runinfo", help="Folder to store the Parsl logs", required=False, type=str, default=None)
     parser.add_argument(
         '-m', "--maxworkers", help="Max workers", required=False, type=int, default=None)
+    parser.add_argument(
+        "--resume", help="Skip the stages completed by a previous run", action="store_true")
+    parser.add_argument(
+        "--plan", help="Only estimate the task graph and save it to PREFIX.json and PREFIX.dot",
+        required=False, type=str, nargs='?', const='plan', default=None, metavar='PREFIX')
 
     args = parser.parse_args()
 
     main(config_file=args.settings, workload_file=args.workload,
-         max_workers=args.maxworkers, runinfo=args.runinfo)
+         max_workers=args.maxworkers, runinfo=args.runinfo, resume=args.resume,
+         plan=args.plan)
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+""" planner.py. Dry-run Workflow Planner (@) 2021
+
+This module builds the task graph of a workload without starting Parsl and
+estimates, from the alignment dimensions and the thread settings, how many
+tasks each application runs, the critical path, the peak parallel width and
+the core-hours of every phase, so the allocation (PartNode, Walltime) can be
+sized before it is booked.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import json
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Tuple
+
+from alignment import AlignmentInfo, read_dimensions
+from bioconfig import BioConfig
+from quartets import selection_size
+
+# Rough per-unit costs, in core-seconds, of each application. They were taken
+# from small runs of the example data and should be calibrated against the
+# monitoring database of a previous run on the target cluster.
+COSTS = {
+    'setup_phylip_data':   2e-7,   # per alignment cell, plus 0.02 per gene
+    'extract_sequences':   2e-8,   # per alignment cell
+    'convert_genes':       2e-7,   # per alignment cell, plus 0.02 per gene
+    'raxml':               1e-5,   # per alignment cell and bootstrap replicate
+    'iqtree':              3e-4,   # per alignment cell (x5 for model selection)
+    'setup_tree_output':   0.05,   # per gene
+    'root_tree':           2e-3,   # per gene and taxon
+    'astral':              1e-6,   # per gene, squared taxa and replicate
+    'snaq':                0.07,   # per quartet, run and reticulation + 1
+    'setup_phylonet_data': 1e-3,   # per gene
+    'phylonet':            0.05,   # per gene, squared taxa and run, times (hmax + 1)^2
+    'mrbayes':             2e-9,   # per alignment cell and generation of every chain
+    'mbsum':               1e-6,   # per sampled tree and taxon
+    'setup_bucky_data':    1e-4,   # per quartet, plus 0.01 per gene
+    'bucky':               1e-6,   # per MCMC iteration and gene
+    'setup_bucky_output':  2e-3,   # per quartet
+    'setup_qmc_data':      1e-3,   # per quartet
+    'setup_quartets':      1e-5,   # per quartet selected, plus 2e-4 per gene
+    'setup_cf_table':      1e-7,   # per quartet and gene, plus 2e-4 per gene
+    'quartet_maxcut':      1e-5,   # per quartet and taxon
+    'setup_qmc_output':    0.01,
+    'create_folders':      0.01,
+    'plot_networks':       30.0,
+}
+BUCKY_ITERATIONS = 1000000
+
+PHASES = ['preparation', 'gene trees', 'gene tree summary', 'species tree',
+          'quartets', 'network', 'plot']
+
+
+@dataclass
+class PlanTask:
+    id:       int
+    app:      str
+    phase:    str
+    dataset:  str
+    cores:    int
+    duration: float
+    deps:     List[int] = field(default_factory=list)
+    label:    str = ""
+
+
+class Plan:
+    """Task graph of a workload with the estimated duration of every task.
+
+    The tasks are appended in topological order (their dependencies always
+    come before them), which is the order the workflow submits them.
+    """
+
+    def __init__(self, config: BioConfig) -> None:
+        self.config = config
+        self.tasks: List[PlanTask] = list()
+        self.alignments: Dict[str, List[AlignmentInfo]] = dict()
+
+    def add(self, app: str, phase: str, dataset: str, cores: int, work: float,
+            deps: List[int] = [], label: str = "") -> int:
+        """Adds a task that runs work core-seconds on cores threads.
+
+        Returns:
+            the task id
+        """
+        cores = max(1, int(cores))
+        task = PlanTask(len(self.tasks), app, phase, dataset, cores, work/cores, list(deps), label)
+        self.tasks.append(task)
+        return task.id
+
+    def counts(self) -> Dict[str, int]:
+        counts = OrderedDict()
+        for task in self.tasks:
+            counts[task.app] = counts.get(task.app, 0) + 1
+        return counts
+
+    def core_hours(self) -> Dict[str, float]:
+        hours = OrderedDict((phase, 0.0) for phase in PHASES)
+        for task in self.tasks:
+            hours[task.phase] += task.duration*task.cores/3600
+        return hours
+
+    def schedule(self) -> List[Tuple[float, float]]:
+        """Earliest start and finish of every task with unlimited cores."""
+        times = list()
+        for task in self.tasks:
+            start = max((times[d][1] for d in task.deps), default=0.0)
+            times.append((start, start + task.duration))
+        return times
+
+    def critical_path(self) -> Tuple[float, List[int]]:
+        times = self.schedule()
+        if len(times) == 0:
+            return 0.0, []
+        last = max(range(len(times)), key=lambda t: times[t][1])
+        path = [last]
+        while len(self.tasks[path[-1]].deps) > 0:
+            path.append(max(self.tasks[path[-1]].deps, key=lambda d: times[d][1]))
+        return times[last][1], path[::-1]
+
+    def peak_width(self) -> Tuple[int, int]:
+        """Peak number of concurrent tasks and cores in the earliest-start schedule."""
+        events = list()
+        for task, (start, finish) in zip(self.tasks, self.schedule()):
+            if finish > start:
+                events.append((start, 1, task.cores))
+                events.append((finish, -1, -task.cores))
+        peak_tasks = peak_cores = tasks = cores = 0
+        # the finish events come first when both happen at the same time
+        for _, d_tasks, d_cores in sorted(events, key=lambda e: (e[0], e[1])):
+            tasks += d_tasks
+            cores += d_cores
+            peak_tasks = max(peak_tasks, tasks)
+            peak_cores = max(peak_cores, cores)
+        return peak_tasks, peak_cores
+
+    def report(self) -> str:
+        config = self.config
+        total_cores = config.workflow_node*config.workflow_core
+        length, path = self.critical_path()
+        peak_tasks, peak_cores = self.peak_width()
+        hours = self.core_hours()
+        lines = [f"Plan of {len(self.alignments)} datasets, "
+                 f"{sum(len(a) for a in self.alignments.values())} gene alignments, {len(self.tasks)} tasks", ""]
+        lines.append("Tasks per app:")
+        for app, count in self.counts().items():
+            lines.append(f"  {app:<22}{count:>10}")
+        lines.append("")
+        lines.append("Estimated core-hours per phase:")
+        for phase, h in hours.items():
+            if h > 0:
+                lines.append(f"  {phase:<22}{h:>10.2f}")
+        lines.append(f"  {'total':<22}{sum(hours.values()):>10.2f}")
+        lines.append("")
+        lines.append(f"Critical path: {length/3600:.2f} h")
+        for t in path:
+            task = self.tasks[t]
+            lines.append(f"  {task.app:<22}{task.duration/3600:>10.3f} h  {os.path.basename(task.dataset)} {task.label}")
+        lines.append(f"Peak parallel width: {peak_tasks} tasks, {peak_cores} cores")
+        lines.append("")
+        # neither the dependencies nor the cores can be beaten
+        makespan = max(length, sum(hours.values())*3600/total_cores)
+        lines.append(f"Allocation of {config.workflow_node} node(s) x {config.workflow_core} cores: "
+                     f"makespan of at least {makespan/3600:.2f} h")
+        return '\n'.join(lines)
+
+    def to_json(self, filename: str) -> None:
+        length, path = self.critical_path()
+        peak_tasks, peak_cores = self.peak_width()
+        with open(filename, 'w') as f:
+            json.dump({"counts": self.counts(),
+                       "core_hours": self.core_hours(),
+                       "critical_path": {"seconds": length, "tasks": path},
+                       "peak_width": {"tasks": peak_tasks, "cores": peak_cores},
+                       "tasks": [asdict(task) for task in self.tasks]}, f, indent=1)
+
+    def to_dot(self, filename: str) -> None:
+        _, path = self.critical_path()
+        critical = set(path)
+        with open(filename, 'w') as f:
+            f.write("digraph HP2NET {\n  rankdir=LR;\n  node [shape=box, fontsize=10];\n")
+            for task in self.tasks:
+                label = f"{task.app}\\n{os.path.basename(task.dataset)} {task.label}\\n{task.duration/3600:.3f} h x {task.cores}"
+                color = ', color=red' if task.id in critical else ''
+                f.write(f'  t{task.id} [label="{label}"{color}];\n')
+            for task in self.tasks:
+                for d in task.deps:
+                    f.write(f"  t{d} -> t{task.id};\n")
+            f.write("}\n")
+
+
+def _mrbayes_parameter(config: BioConfig, name: str, default: float) -> float:
+    match = re.search(rf'\b{name}\s*=\s*([\d.eE+-]+)', config.mrbayes_parameters)
+    return float(match.group(1)) if match is not None else default
+
+
+def gene_tree_work(config: BioConfig, tree_method: str, gene: AlignmentInfo) -> float:
+    """Estimated core-seconds of the raxml or iqtree task of a gene."""
+    bootstrap = int(config.bootstrap)
+    if tree_method == 'RAXML':
+        return COSTS['raxml']*gene.cells*(bootstrap + 2)
+    work = COSTS['iqtree']*gene.cells*(1 + bootstrap/1000)
+    if config.iqtree_model.strip().upper() == "AUTO":
+        work *= 5
+    return work
+
+
+def _tree_phase(plan: Plan, basedir: dict, genes: List[AlignmentInfo], prepare: Dict[str, List[int]]) -> int:
+    config = plan.config
+    tree_tasks = list()
+    for gene in genes:
+        work = gene_tree_work(config, basedir['tree_method'], gene)
+        if basedir['tree_method'] == 'RAXML':
+            tree_tasks.append(plan.add('raxml', 'gene trees', basedir['dir'], config.raxml_threads,
+                                       work, prepare[gene.name], gene.name))
+        else:
+            tree_tasks.append(plan.add('iqtree', 'gene trees', basedir['dir'], config.iqtree_threads,
+                                       work, prepare[gene.name], gene.name))
+    return plan.add('setup_tree_output', 'gene tree summary', basedir['dir'], 1,
+                    COSTS['setup_tree_output']*len(genes), tree_tasks)
+
+
+def _snaq_phase(plan: Plan, basedir: dict, ntax: int, deps: List[int]) -> None:
+    config = plan.config
+    quartets = selection_size(ntax, config.quartet_strategy, config.quartet_budget, config.quartet_coverage)
+    # the runs are spread over the julia workers
+    cores = min(config.snaq_threads, config.snaq_runs)
+    work = {h: COSTS['snaq']*quartets*config.snaq_runs*(int(h) + 1) for h in config.snaq_hmax}
+    if config.snaq_sweep == 'single':
+        plan.add('snaq', 'network', basedir['dir'], cores, sum(work.values()), deps,
+                 f"hmax={','.join(config.snaq_hmax)}")
+    elif config.snaq_sweep == 'chain':
+        for h in sorted(config.snaq_hmax, key=int):
+            deps = [plan.add('snaq', 'network', basedir['dir'], cores, work[h], deps, f"hmax={h}")]
+    else:
+        for h in config.snaq_hmax:
+            plan.add('snaq', 'network', basedir['dir'], cores, work[h], deps, f"hmax={h}")
+
+
+def build_plan(config: BioConfig) -> Plan:
+    """Builds the task graph of the workload as parsl_workflow.main submits it."""
+    plan = Plan(config)
+    for basedir in config.workload:
+        if basedir['dir'] not in plan.alignments:
+            plan.alignments[basedir['dir']] = read_dimensions(basedir['sequences'])
+    # the genes of a dataset wait for its own preparation, or only for the
+    # batch of their gene with ConversionBatch (see parsl_workflow.prepare_to_run)
+    folders = dict()
+    for basedir in config.workload:
+        folders.setdefault(basedir['dir'], list()).append(
+            plan.add('create_folders', 'preparation', basedir['dir'], 1, COSTS['create_folders']))
+    prepare = dict()
+    for work_dir, genes in plan.alignments.items():
+        if config.conversion_batch > 0:
+            extract = plan.add('extract_sequences', 'preparation', work_dir, 1,
+                               COSTS['extract_sequences']*sum(g.cells for g in genes))
+            prepare[work_dir] = dict()
+            for start in range(0, len(genes), config.conversion_batch):
+                batch = genes[start:start + config.conversion_batch]
+                work = sum(0.02 + COSTS['convert_genes']*g.cells for g in batch)
+                convert = plan.add('convert_genes', 'preparation', work_dir, 1, work, [extract],
+                                   f"{batch[0].name}..{batch[-1].name}")
+                for gene in batch:
+                    prepare[work_dir][gene.name] = [extract, convert] + folders[work_dir]
+        else:
+            work = sum(0.02 + COSTS['setup_phylip_data']*g.cells for g in genes)
+            setup = [plan.add('setup_phylip_data', 'preparation', work_dir, 1, work)] + folders[work_dir]
+            prepare[work_dir] = {gene.name: setup for gene in genes}
+    tree_outputs = dict()
+    for basedir in config.workload:
+        genes = plan.alignments[basedir['dir']]
+        tree_method = basedir['tree_method']
+        network_method = basedir['network_method']
+        ntax = max((g.ntax for g in genes), default=0)
+        if tree_method in ('RAXML', 'IQTREE'):
+            key = (basedir['dir'], tree_method)
+            if key not in tree_outputs:
+                tree_outputs[key] = _tree_phase(plan, basedir, genes, prepare[basedir['dir']])
+            setup = tree_outputs[key]
+            if network_method == 'MPL':
+                work = COSTS['astral']*len(genes)*ntax**2*(int(config.bootstrap) + 1)
+                ret_ast = plan.add('astral', 'species tree', basedir['dir'], 1, work, [setup])
+                deps = [ret_ast]
+                if config.quartet_strategy != 'all':
+                    work = 2e-4*len(genes) + COSTS['setup_quartets']*selection_size(
+                        ntax, config.quartet_strategy, config.quartet_budget, config.quartet_coverage)
+                    deps.append(plan.add('setup_quartets', 'quartets', basedir['dir'], 1, work, [setup]))
+                if config.snaq_cf == 'python':
+                    quartets = selection_size(ntax, config.quartet_strategy, config.quartet_budget,
+                                              config.quartet_coverage)
+                    work = 2e-4*len(genes) + COSTS['setup_cf_table']*quartets*len(genes)
+                    deps.append(plan.add('setup_cf_table', 'quartets', basedir['dir'], 1, work, [setup] + deps[1:]))
+                _snaq_phase(plan, basedir, ntax, deps)
+            elif network_method == 'MP':
+                rooted = plan.add('root_tree', 'gene tree summary', basedir['dir'], 1,
+                                  COSTS['root_tree']*len(genes)*ntax, [setup])
+                batches = [config.phylonet_hmax] if config.phylonet_batch else [[h] for h in config.phylonet_hmax]
+                # a single setup_phylonet_data writes the input of every batch
+                spd = plan.add('setup_phylonet_data', 'network', basedir['dir'], 1,
+                               COSTS['setup_phylonet_data']*len(genes)*len(batches), [rooted])
+                for batch in batches:
+                    label = f"hmax={','.join(batch)}"
+                    work = sum(COSTS['phylonet']*len(genes)*ntax**2*int(config.phylonet_runs)*(int(h) + 1)**2
+                               for h in batch)
+                    plan.add('phylonet', 'network', basedir['dir'], config.phylonet_threads, work, [spd], label)
+        elif tree_method == 'MRBAYES' and network_method == 'MPL':
+            ngen = _mrbayes_parameter(config, 'ngen', 1000000)
+            chains = _mrbayes_parameter(config, 'nruns', 2)*_mrbayes_parameter(config, 'nchains', 4)
+            samplefreq = _mrbayes_parameter(config, 'samplefreq', 500)
+            mbsum_tasks = list()
+            for gene in genes:
+                mb = plan.add('mrbayes', 'gene trees', basedir['dir'], 1,
+                              COSTS['mrbayes']*gene.cells*ngen*chains, prepare[basedir['dir']][gene.name], gene.name)
+                work = COSTS['mbsum']*(ngen/samplefreq)*_mrbayes_parameter(config, 'nruns', 2)*gene.ntax
+                mbsum_tasks.append(plan.add('mbsum', 'gene tree summary', basedir['dir'], 1, work, [mb], gene.name))
+            # bucky runs one task per chunk of quartets of the taxa shared by every gene
+            shared = set(genes[0].taxa) if len(genes) > 0 else set()
+            for gene in genes[1:]:
+                shared &= set(gene.taxa)
+            quartets = selection_size(len(shared), config.quartet_strategy, config.quartet_budget,
+                                      config.quartet_coverage)
+            bucky_data = plan.add('setup_bucky_data', 'quartets', basedir['dir'], 1,
+                                  0.01*len(genes) + COSTS['setup_bucky_data']*quartets, mbsum_tasks)
+            bucky_tasks = [plan.add('bucky', 'quartets', basedir['dir'], min(config.bucky_workers, count) or 1,
+                                    COSTS['bucky']*BUCKY_ITERATIONS*len(genes)*count, [bucky_data])
+                           for count in [min(config.bucky_chunk, quartets - first)
+                                         for first in range(0, quartets, config.bucky_chunk)]]
+            bucky_output = plan.add('setup_bucky_output', 'quartets', basedir['dir'], 1,
+                                    COSTS['setup_bucky_output']*quartets, bucky_tasks)
+            qmc_data = plan.add('setup_qmc_data', 'species tree', basedir['dir'], 1,
+                                COSTS['setup_qmc_data']*quartets, [bucky_output])
+            qmc = plan.add('quartet_maxcut', 'species tree', basedir['dir'], 1,
+                           COSTS['quartet_maxcut']*quartets*len(shared), [qmc_data])
+            qmc_output = plan.add('setup_qmc_output', 'species tree', basedir['dir'], 1,
+                                  COSTS['setup_qmc_output'], [qmc])
+            _snaq_phase(plan, basedir, len(shared), [qmc_output])
+    if config.plot_networks:
+        networks = [t.id for t in plan.tasks if t.app in ('snaq', 'phylonet')]
+        plan.add('plot_networks', 'plot', '', 1, COSTS['plot_networks'], networks)
+    return plan
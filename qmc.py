@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+""" qmc.py. Quartet MaxCut Input (@) 2021
+
+This module turns the CF table of bucky into the input of Quartet MaxCut
+with NumPy, instead of walking the table row by row. Each quartet gives its
+split of highest concordance factor, or its two or three splits when they tie,
+written as 'a,b|c,d' with the taxa replaced by their ids:
+
+    taxon1 ... CF12.34 ... CF13.24 ... CF14.23 ...      1,2|3,4 1,3|2,4 ...
+    A  B  C  D   0.6         0.2         0.2       -->
+    A  B  C  E   0.3         0.3         0.4
+
+The ids are given from 1 to the taxa sorted by name, and the names are put
+back in the tree of Quartet MaxCut by setup_qmc_output.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import os
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+TAXA_COLUMNS = ['taxon1', 'taxon2', 'taxon3', 'taxon4']
+CF_COLUMNS = ['CF12.34', 'CF13.24', 'CF14.23']
+# the taxon columns on each side of the split of every CF column
+SPLITS = np.array([[0, 1, 2, 3],     # 12|34
+                   [0, 2, 1, 3],     # 13|24
+                   [0, 3, 1, 2]])    # 14|23
+
+
+class CFTable(NamedTuple):
+    """The columns of a CF table used by Quartet MaxCut.
+
+    The taxa are interned: names holds them sorted and ids the id of each
+    taxon of each quartet, its index in names + 1. The concordance factors
+    are interned too: values holds the distinct ones and cf_text the index of
+    the text each factor of the three splits of a quartet is written with,
+    which decides the ties. The table is small enough to be the result of a
+    Parsl app, e.g. setup_bucky_output's.
+    """
+    names: List[str]
+    ids: np.ndarray         # (n, 4) int32
+    values: np.ndarray      # (k,) float
+    cf_text: np.ndarray     # (n, 3) int32
+
+    @property
+    def cf(self) -> np.ndarray:
+        """The (n, 3) concordance factors."""
+        return self.values[self.cf_text]
+
+
+def intern(values: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    """The distinct values sorted and the index of each value among them."""
+    import pandas as pd
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    uniques = np.asarray(uniques, dtype=object)
+    order = np.argsort(uniques, kind='stable')
+    rank = np.empty(len(uniques), dtype=np.int32)
+    rank[order] = np.arange(len(uniques))
+    return uniques[order].tolist(), rank[codes]
+
+
+def cf_table(taxa: Sequence[Sequence[str]], cf_text: Sequence[Sequence[str]]) -> CFTable:
+    """Builds the CFTable of the columns taxon1 to taxon4 and CF12.34, CF13.24 and CF14.23 of a table."""
+    names, ids = intern(np.concatenate([np.asarray(column, dtype=object) for column in taxa]))
+    texts, codes = intern(np.concatenate([np.asarray(column, dtype=object) for column in cf_text]))
+    # the factors are parsed once per distinct text
+    values = np.array([float(t) for t in texts], dtype=float)
+    return CFTable(names, (ids.reshape(4, -1).T + 1).astype(np.int32), values, codes.reshape(3, -1).T.copy())
+
+
+def read_cf_table(table_file: str) -> CFTable:
+    """Reads the taxa and concordance factors of the CF table written by setup_bucky_output."""
+    import pandas as pd
+    table = pd.read_csv(table_file, delimiter=',', dtype=str, keep_default_na=False,
+                        usecols=TAXA_COLUMNS + CF_COLUMNS)
+    return cf_table([table[c] for c in TAXA_COLUMNS], [table[c] for c in CF_COLUMNS])
+
+
+def qmc_quartets(table: CFTable) -> np.ndarray:
+    """The quartets given to Quartet MaxCut, with the ids of their taxa.
+
+    The splits of each row are ranked by one stable argsort of the negated
+    factors, so equal factors keep the column order. The second and the third
+    splits are also taken when their factors are written as the first one.
+
+    Returns:
+        a (m, 4) array with the ids of each quartet, the first two on one side
+        of the split, in the order of the rows and of the ranks
+    """
+    n = len(table.ids)
+    order = np.argsort(-table.cf, axis=1, kind='stable')
+    text = np.take_along_axis(table.cf_text, order, axis=1)
+    first_two = text[:, 0] == text[:, 1]
+    # ranks taken per row: 3 when the three tie, 2 when the first two do, 1 otherwise
+    taken = np.where(first_two & (text[:, 1] == text[:, 2]), 3, np.where(first_two, 2, 1))
+    rows = np.repeat(np.arange(n), taken)
+    # the rank of each repeated row, 0 to taken - 1
+    ranks = np.arange(len(rows)) - np.repeat(np.cumsum(taken) - taken, taken)
+    columns = SPLITS[order[rows, ranks]]
+    return np.take_along_axis(table.ids[rows], columns, axis=1)
+
+
+def format_quartets(quartets: np.ndarray) -> str:
+    """The quartets as Quartet MaxCut reads them, 'a,b|c,d' separated by spaces."""
+    if len(quartets) == 0:
+        return ""
+    labels = np.array([str(i) for i in range(quartets.max() + 1)], dtype=object)
+    a, b, c, d = (labels[quartets[:, i]] for i in range(4))
+    return ' '.join((a + ',' + b + '|' + c + ',' + d).tolist())
+
+
+def taxon_ids(names: List[str]) -> Dict[str, str]:
+    """The id to name map of the taxa, used to relabel the tree of Quartet MaxCut."""
+    return {str(i): name for i, name in enumerate(names, 1)}
+
+
+def write_qmc_input(qmc_input: str, quartets: np.ndarray) -> None:
+    tmp = f"{qmc_input}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        f.write(format_quartets(quartets))
+    os.replace(tmp, qmc_input)
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+
+""" quartets.py. Quartet Manifest (@) 2021
+
+This module replaces the prune tree file that setup_bucky_data wrote for each
+quartet of taxa, and the bucky task that ran on each of them, by a manifest
+with one quartet per line and chunks of quartets run by a single task. A chunk
+runs bucky on its quartets with the cores of its worker and keeps the .out and
+.concordance files of every quartet in a packed store named after the chunk,
+so a dataset of 30 taxa leaves a few hundred tasks and files instead of the
+tens of thousands of C(30, 4) = 27405 quartets. The chunk also parses those
+outputs into the rows of the CF table, so setup_bucky_output only has to
+concatenate the rows of the chunks.
+
+    bucky/quartets.txt          taxon1<TAB>taxon2<TAB>taxon3<TAB>taxon4
+    bucky/chunk-00000000.pack   A--B--C--D.out, A--B--C--D.concordance, ...
+
+The quartets are made of the taxa found in the translate block of every
+mbsum output. Only the header of each .sum file is read, and the taxa of each
+file are kept in mbsum/taxa.json with its size and modification time, so the
+files are not parsed again by a later run.
+
+The quartets listed can be all of them or a sample (QuartetStrategy): a
+random budget of quartets drawn with a seed, or a covering design in which
+every pair of taxa is in at least QuartetCoverage quartets. The same selection
+restricts the CF table given to SNaQ in the RAxML and IQ-TREE flows.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import combinations, islice
+from math import comb
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from packed_store import DATA_SUFFIX, INDEX_SUFFIX, PackedStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "quartets.txt"
+CHUNK_PREFIX = "chunk-"
+BUCKY_OUTPUTS = (".out", ".concordance")
+STRATEGIES = ("all", "random", "covering")
+TAXA_CACHE = "taxa.json"
+# the CF table rows of a chunk, stored after the outputs of its quartets
+CF_ROWS = "cf_rows"
+CF_HEADER = ("taxon1,taxon2,taxon3,taxon4,CF12.34,CF12.34_lo,CF12.34_hi,CF13.24,CF13.24_lo,CF13.24_hi,"
+             "CF14.23,CF14.23_lo,CF14.23_hi,ngenes\n")
+NUM_GENES = re.compile(r"Read \d+ genes with a ")
+TRANSLATE_BLOCK = re.compile(r"translate\n(\s*\w+\s*\w+(,|;)\n*)+")
+SPLIT = re.compile(r"{\w+,\w+\|\w+,\w+}")
+MEAN_NUM_LOCI = re.compile(r"(=\s+\d+\.\d+\s+\(number of loci\))")
+CF_95 = re.compile(r"(95% CI for CF = \(\w+,\w+\))")
+
+Quartet = Tuple[str, str, str, str]
+
+
+def snaq_quartets(dir_name: str, tree_method: str) -> str:
+    """Name of the list of the quartets kept in the CF table of snaq, in the snaq folder."""
+    return f"{dir_name}_{tree_method}_{MANIFEST}"
+
+
+def quartet_name(quartet: Sequence[str]) -> str:
+    """The name bucky's outputs of a quartet are written with, e.g. A--B--C--D."""
+    return "--".join(quartet)
+
+
+def prune_text(quartet: Sequence[str]) -> str:
+    """The translate block bucky reads with -p to keep the taxa of a quartet."""
+    return "translate\n" + ",\n".join(f" {i} {taxon}" for i, taxon in enumerate(quartet, 1)) + ";\n"
+
+
+def read_translate(sum_file: str) -> List[str]:
+    """The taxa of the translate block of a mbsum output, in the order of their numbers.
+
+    The file is read line by line up to the end of the block, which is at
+    its top, instead of loading the sampled topologies that follow it.
+    """
+    block = None
+    with open(sum_file) as f:
+        for line in f:
+            if block is None:
+                start = line.lower().find("translate")
+                if start < 0:
+                    continue
+                line = line[start + len("translate"):]
+                block = ""
+            end = line.find(";")
+            if end >= 0:
+                block += line[:end]
+                break
+            block += line
+    if block is None:
+        raise ValueError(f"{sum_file} has no translate block")
+    return [entry.split()[-1] for entry in block.split(",") if entry.strip()]
+
+
+def shared_taxa(mbsum_dir: str, workers: int = 0) -> List[str]:
+    """The taxa found in every mbsum output of the folder, in the order of the first one (by name).
+
+    The outputs are parsed in parallel, except the ones whose size and
+    modification time match their entry in the folder's TAXA_CACHE, which is
+    rewritten with the taxa of each file and the shared ones.
+
+    Parameters:
+        mbsum_dir: the folder with the .sum files
+        workers: number of files parsed at the same time, 0 uses the cores available to this process
+    """
+    from conversion import available_cores
+    files = sorted(glob.glob(os.path.join(mbsum_dir, '*.sum')))
+    cache_file = os.path.join(mbsum_dir, TAXA_CACHE)
+    cached: Dict[str, dict] = dict()
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    entries = dict()
+    missing = list()
+    for path in files:
+        st = os.stat(path)
+        name = os.path.basename(path)
+        entry = cached.get(name)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            entries[name] = entry
+        else:
+            entries[name] = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+            missing.append(path)
+    if missing:
+        if workers < 1:
+            workers = available_cores()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as pool:
+            for path, taxa in zip(missing, pool.map(read_translate, missing)):
+                entries[os.path.basename(path)]['taxa'] = taxa
+    if len(files) == 0:
+        return []
+    shared = set.intersection(*(set(entry['taxa']) for entry in entries.values()))
+    taxa = [t for t in entries[os.path.basename(files[0])]['taxa'] if t in shared]
+    if missing or len(cached) != len(entries):
+        tmp = f"{cache_file}.{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump({'files': entries, 'taxa': taxa}, f)
+        os.replace(tmp, cache_file)
+    logger.info(f'{len(taxa)} taxa shared by {len(files)} mbsum outputs, {len(missing)} of them parsed')
+    return taxa
+
+
+def random_quartets(n: int, budget: int, rng: random.Random) -> List[Tuple[int, ...]]:
+    """budget distinct quartets of range(n) drawn uniformly, in lexicographic order."""
+    total = comb(n, 4)
+    if budget >= total:
+        return list(combinations(range(n), 4))
+    if budget > total//2:
+        return sorted(rng.sample(list(combinations(range(n), 4)), budget))
+    picked = set()
+    while len(picked) < budget:
+        picked.add(tuple(sorted(rng.sample(range(n), 4))))
+    return sorted(picked)
+
+
+def covering_quartets(n: int, coverage: int, rng: random.Random) -> List[Tuple[int, ...]]:
+    """Quartets of range(n) in which every pair of taxa is at least coverage times, in lexicographic order.
+
+    A greedy design: while a pair a, b lacks quartets, it is completed with
+    the taxa c and then d that most lack quartets with the ones already
+    chosen, the ties broken at random. It takes a few percent more quartets
+    than the lower bound of coverage*C(n,2)/6.
+    """
+    if n < 4:
+        return []
+    # a pair is in C(n-2, 2) quartets at most
+    coverage = min(coverage, comb(n - 2, 2))
+    count = [[0]*n for _ in range(n)]
+    picked = set()
+
+    def deficit(x, y):
+        return max(coverage - count[x][y], 0)
+
+    def candidates(chosen):
+        scores = [(sum(deficit(x, t) for x in chosen), rng.random(), t) for t in range(n) if t not in chosen]
+        return [t for _, _, t in sorted(scores, reverse=True)]
+
+    for a in range(n):
+        for b in range(a + 1, n):
+            while count[a][b] < coverage:
+                quartet = None
+                for c in candidates((a, b)):
+                    for d in candidates((a, b, c)):
+                        q = tuple(sorted((a, b, c, d)))
+                        if q not in picked:
+                            quartet = q
+                            break
+                    if quartet is not None:
+                        break
+                picked.add(quartet)
+                for x, y in combinations(quartet, 2):
+                    count[x][y] += 1
+                    count[y][x] += 1
+    return sorted(picked)
+
+
+def select_quartets(taxa: Sequence[str], strategy: str = "all", budget: int = 0, seed: int = 0,
+                    coverage: int = 1) -> Iterable[Quartet]:
+    """The quartets of the taxa chosen by a strategy, each one with its taxa in the order of taxa.
+
+    Parameters:
+        taxa: the taxa, without repetitions
+        strategy: all, random or covering (see STRATEGIES)
+        budget: number of quartets of the random strategy
+        seed: seed of the random and covering strategies
+        coverage: minimum number of quartets of each pair of taxa of the covering strategy
+    Returns:
+        the quartets, streamed in the order of itertools.combinations when strategy is all
+    """
+    if strategy == "all":
+        return combinations(taxa, 4)
+    rng = random.Random(seed)
+    if strategy == "random":
+        indexes = random_quartets(len(taxa), budget, rng)
+    elif strategy == "covering":
+        indexes = covering_quartets(len(taxa), coverage, rng)
+    else:
+        raise ValueError(f"Unknown quartet strategy {strategy}")
+    return [tuple(taxa[i] for i in q) for q in indexes]
+
+
+def selection_size(ntax: int, strategy: str = "all", budget: int = 0, coverage: int = 1) -> int:
+    """Expected number of quartets selected from ntax taxa, the lower bound for covering."""
+    total = comb(ntax, 4)
+    if strategy == "random":
+        return min(budget, total)
+    if strategy == "covering":
+        pairs = comb(ntax, 2)*min(coverage, comb(max(ntax - 2, 0), 2))
+        return min(-(-pairs//6), total)
+    return total
+
+
+def log_selection(name: str, ntax: int, selected: int, strategy: str, log: logging.Logger = logger) -> None:
+    """Logs the number of quartets selected and the reduction of the work done per quartet."""
+    total = comb(ntax, 4)
+    if total == 0:
+        log.info(f'{name}: no quartets of {ntax} taxa')
+        return
+    reduction = total/selected if selected > 0 else float('inf')
+    log.info(f'{name}: {selected} of the {total} quartets of {ntax} taxa selected ({strategy}), '
+             f'{100*selected/total:.2f}% of the work per quartet, {reduction:.1f}x less')
+
+
+def write_manifest(path: str, quartets: Iterable[Quartet]) -> int:
+    """Writes the quartets one per line, tab separated.
+
+    Returns:
+        the number of quartets written
+    """
+    count = 0
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, 'w') as f:
+        for quartet in quartets:
+            f.write('\t'.join(quartet) + '\n')
+            count += 1
+    os.replace(tmp, path)
+    return count
+
+
+def read_manifest(path: str, first: int = 0, count: int = None) -> Iterator[Quartet]:
+    """Streams the quartets of the manifest from the first-th, count of them or up to the end."""
+    with open(path) as f:
+        stop = None if count is None else first + count
+        for line in islice(f, first, stop):
+            yield tuple(line.rstrip('\n').split('\t'))
+
+
+def manifest_size(path: str) -> int:
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def chunks(total: int, size: int) -> List[Tuple[int, int]]:
+    """The (first, count) of the chunks of size quartets covering total quartets."""
+    size = max(1, size)
+    return [(first, min(size, total - first)) for first in range(0, total, size)]
+
+
+def chunk_store(bucky_dir: str, first: int) -> str:
+    """The packed store of the chunk starting at the first-th quartet."""
+    return os.path.join(bucky_dir, f"{CHUNK_PREFIX}{first:08d}")
+
+
+def chunk_stores(bucky_dir: str) -> List[str]:
+    """The packed stores of the chunks already written, in manifest order."""
+    return sorted(p[:-len(INDEX_SUFFIX)] for p in glob.glob(os.path.join(bucky_dir, f"{CHUNK_PREFIX}*{INDEX_SUFFIX}")))
+
+
+def run_bucky(bucky: str, params: str, sum_files: List[str], quartet: Quartet, scratch: str) -> Tuple[str, int, str]:
+    """Runs bucky on one quartet, writing its prune file and outputs in the scratch folder.
+
+    Returns:
+        the quartet's name, bucky's exit status and the tail of its stderr
+    """
+    name = quartet_name(quartet)
+    prune_file = os.path.join(scratch, f"{name}-prune.txt")
+    with open(prune_file, 'w') as f:
+        f.write(prune_text(quartet))
+    command = f"{bucky} {params} -o {os.path.join(scratch, name)} -p {prune_file} {' '.join(sum_files)}"
+    proc = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return name, proc.returncode, proc.stderr.decode(errors='replace')[-500:]
+
+
+def run_bucky_chunk(bucky: str, params: str, sum_files: List[str], manifest: str, first: int, count: int,
+                    store: str, workers: int = 0) -> int:
+    """Runs bucky on count quartets of the manifest and packs their outputs and CF table rows in one store.
+
+    The quartets run on workers threads (0 uses the cores available to this
+    process) in a scratch folder of the node's temporary directory, which is
+    removed afterwards. The store is only written when every quartet
+    succeeded, so a chunk that failed is run again by the next execution.
+
+    Parameters:
+        bucky: bucky's executable
+        params: bucky's parameters, without the output, prune and input files
+        sum_files: mbsum's outputs of every gene
+        manifest: the quartet manifest
+        first, count: the quartets of the chunk
+        store: the chunk's packed store
+        workers: number of bucky processes run at the same time
+    Returns:
+        the number of quartets of the chunk
+    Raises:
+        RuntimeError, with the quartets for which bucky failed
+    """
+    from conversion import available_cores
+    quartets = list(read_manifest(manifest, first, count))
+    if workers < 1:
+        workers = available_cores()
+    scratch = tempfile.mkdtemp(prefix='bucky_')
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(quartets)))) as pool:
+            results = list(pool.map(lambda q: run_bucky(bucky, params, sum_files, q, scratch), quartets))
+        failed = [(name, status, err) for name, status, err in results if status != 0]
+        if failed:
+            name, status, err = failed[0]
+            raise RuntimeError(f"bucky failed on {len(failed)} of {len(quartets)} quartets, "
+                               f"first {name} with status {status}: {err.strip()}")
+        # written aside and renamed, so chunk_stores never lists a partial chunk
+        tmp = os.path.join(os.path.dirname(store), f"tmp-{os.path.basename(store)}")
+        with PackedStore(tmp, 'w') as chunk:
+            rows = list()
+            for name, _, _ in results:
+                outputs = list()
+                for suffix in BUCKY_OUTPUTS:
+                    with open(os.path.join(scratch, name + suffix), 'rb') as f:
+                        outputs.append(f.read())
+                    chunk.add(name + suffix, outputs[-1])
+                rows.append(cf_row(*(data.decode() for data in outputs)))
+            chunk.add(CF_ROWS, ''.join(rows).encode())
+        for suffix in (DATA_SUFFIX, INDEX_SUFFIX):
+            os.replace(tmp + suffix, store + suffix)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return len(quartets)
+
+
+def cf_row(out: str, concordance: str) -> str:
+    """The CF table row of a quartet, from the texts of bucky's .out and .concordance files.
+
+    The concordance factors and their 95% credibility intervals are divided
+    by the number of genes, as readTableCF of PhyloNetworks expects them.
+    """
+    num_genes = re.search(r"\d+", NUM_GENES.search(out).group(0)).group(0)
+    genes = float(num_genes)
+    translate_block = re.sub(r"(,|;|translate\n)", "", TRANSLATE_BLOCK.search(concordance).group(0))
+    taxa = list()
+    for taxon in translate_block.split('\n'):
+        if taxon == "":
+            break
+        taxa.append(taxon.split(" ")[2])
+    all_splits_block = concordance.split("All Splits:\n")[1]
+    split = SPLIT.findall(all_splits_block)
+    cf = MEAN_NUM_LOCI.findall(all_splits_block)
+    cf_95 = CF_95.findall(all_splits_block)
+    splits = dict()
+    for i in range(0, len(split)):
+        lo, hi = re.sub(r"(95% CI for CF = \(|\))", "", cf_95[i]).split(',')
+        mean = re.sub(r"(=|\(number of loci\)|\s+)", "", cf[i])
+        splits[re.sub("({|,|})", "", split[i])] = f"{float(mean)/genes},{float(lo)/genes},{float(hi)/genes}"
+    columns = [splits.get(s, "0,0,0") for s in ("12|34", "13|24", "14|23")]
+    return f"{','.join(taxa)},{','.join(columns)},{num_genes}\n"
+
+
+def parse_chunk(path: str) -> str:
+    """The CF table rows of the quartets of a chunk store, parsed from their outputs."""
+    outputs = {key: data.decode() for key, data in PackedStore(path).items()}
+    return ''.join(cf_row(outputs[key], outputs[key[:-len(".out")] + ".concordance"])
+                   for key in outputs if key.endswith(".out"))
+
+
+def cf_rows(bucky_dir: str, reparse: bool = False, workers: int = 0) -> Iterator[str]:
+    """Streams the CF table rows of the bucky outputs of the folder, a block of rows per chunk.
+
+    The rows recorded by each chunk are read as they are. The chunks
+    without them, or every chunk when reparse is set, are parsed again on
+    workers processes (0 uses the cores available to this process).
+    """
+    from conversion import available_cores
+    stores = chunk_stores(bucky_dir)
+    recorded = dict()
+    if not reparse:
+        for path in stores:
+            store = PackedStore(path)
+            if CF_ROWS in store:
+                recorded[path] = store
+    pending = [path for path in stores if path not in recorded]
+    if workers < 1:
+        workers = available_cores()
+    workers = min(workers, len(pending))
+    if workers > 1:
+        # spawn, since the parsl worker that calls it may be running threads
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        parsed = pool.map(parse_chunk, pending)
+    else:
+        pool = None
+        parsed = map(parse_chunk, pending)
+    try:
+        for path in stores:
+            yield recorded[path].get(CF_ROWS).decode() if path in recorded else next(parsed)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    if pending:
+        logger.info(f'{len(pending)} bucky chunks of {bucky_dir} parsed again')
+
+
+def write_cf_table(table: str, bucky_dir: str, reparse: bool = False, workers: int = 0) -> 'CFTable':
+    """Writes the CF table read by snaq.jl, with the rows of cf_rows appended in buffered blocks.
+
+    Returns:
+        the taxa and concordance factors of the table as a qmc.CFTable, so
+        setup_qmc_data doesn't have to read the file again
+    """
+    import io
+    import numpy as np
+    import pandas as pd
+    from qmc import cf_table
+    # taxon1 to taxon4, CF12.34, CF13.24 and CF14.23
+    usecols = [0, 1, 2, 3, 4, 7, 10]
+    columns = [list() for _ in usecols]
+    pending = list()
+
+    def parse():
+        # the rows written since the last call, parsed by pandas in memory
+        block = pd.read_csv(io.StringIO(''.join(pending)), header=None, dtype=str, keep_default_na=False,
+                            usecols=usecols)
+        for column, i in zip(columns, usecols):
+            column.append(block[i].to_numpy(dtype=object))
+        pending.clear()
+
+    size = 0
+    tmp = f"{table}.{os.getpid()}"
+    with open(tmp, 'w', buffering=1 << 20) as f:
+        f.write(CF_HEADER)
+        for rows in cf_rows(bucky_dir, reparse, workers):
+            f.write(rows)
+            if rows:
+                pending.append(rows)
+                size += len(rows)
+            if size >= 1 << 22:
+                parse()
+                size = 0
+    os.replace(tmp, table)
+    if pending:
+        parse()
+    columns = [np.concatenate(column) if column else np.array([], dtype=object) for column in columns]
+    return cf_table(columns[:4], columns[4:])
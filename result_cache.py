@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+""" result_cache.py. Persistent Result Cache (@) 2021
+
+This module keeps the outputs of the gene-level applications (raxml, iqtree,
+mrbayes and mbsum) in a content-addressed directory, so a gene alignment that
+was already processed with the same parameters is restored instead of being
+computed again, either in a rerun or in another dataset.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import argparse
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+PLACEHOLDER = "{}"
+
+
+class ResultCache:
+    """On-disk cache of application outputs with size-bounded LRU eviction.
+
+    Every entry is a folder under objects/ named by its key. The files are
+    stored with the gene name replaced by a placeholder, so they can be
+    restored under the name of any gene with the same content. The index
+    (sizes, last access and the hit/miss counters) is shared by all workers
+    and protected by a lock file.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.lock_file = os.path.join(cache_dir, ".lock")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @staticmethod
+    def key(alignment_file: str, *fields) -> str:
+        """Combines the hash of the alignment bytes with the application parameters
+        (tool, model, bootstrap, seed...). An unseeded run is keyed with seed None.
+        """
+        digest = hashlib.sha256()
+        with open(alignment_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        for field in fields:
+            digest.update(b'\0' + str(field).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def outputs_key(files: list, *fields) -> str:
+        """Combines the hashes of the bytes of the files, in the given order, with the
+        application parameters, for the applications that read the outputs of another one.
+        """
+        digest = hashlib.sha256()
+        for name in files:
+            file_digest = hashlib.sha256()
+            with open(name, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    file_digest.update(block)
+            digest.update(file_digest.digest())
+        for field in fields:
+            digest.update(b'\0' + str(field).encode())
+        return digest.hexdigest()
+
+    @contextmanager
+    def _index(self):
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.index_file, 'r') as f:
+                        index = json.load(f)
+                except (IOError, ValueError):
+                    index = {"hits": 0, "misses": 0, "entries": {}}
+                yield index
+                tmp = f"{self.index_file}.{os.getpid()}"
+                with open(tmp, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp, self.index_file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def restore(self, key: str, directory: str, name: str) -> bool:
+        """Copies the entry's files into directory, named after name.
+
+        Returns:
+            True on a cache hit
+        """
+        entry_dir = os.path.join(self.objects_dir, key)
+        with self._index() as index:
+            entry = index["entries"].get(key)
+            if entry is None or not os.path.isdir(entry_dir):
+                index["entries"].pop(key, None)
+                index["misses"] += 1
+                return False
+            for stored in entry["files"]:
+                shutil.copyfile(os.path.join(entry_dir, stored),
+                                os.path.join(directory, stored.replace(PLACEHOLDER, name)))
+            entry["atime"] = time.time()
+            index["hits"] += 1
+        return True
+
+    def store(self, key: str, directory: str, name: str, pattern: str) -> None:
+        """Stores the files of directory matching pattern, where the placeholder
+        in pattern (at its beginning or end) stands for name.
+        """
+        files = glob.glob(os.path.join(directory, pattern.replace(PLACEHOLDER, glob.escape(name))))
+        if len(files) == 0:
+            return
+        tmp_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=self.objects_dir)
+        stored, size = list(), 0
+        for f in files:
+            filename = os.path.basename(f)
+            if pattern.startswith(PLACEHOLDER):
+                filename = PLACEHOLDER + filename[len(name):]
+            else:
+                filename = filename[:-len(name)] + PLACEHOLDER
+            shutil.copyfile(f, os.path.join(tmp_dir, filename))
+            stored.append(filename)
+            size += os.path.getsize(f)
+        entry_dir = os.path.join(self.objects_dir, key)
+        with self._index() as index:
+            if key in index["entries"]:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(tmp_dir, entry_dir)
+            index["entries"][key] = {"size": size, "atime": time.time(), "files": stored}
+            self._evict(index, keep=key)
+
+    def _evict(self, index: dict, keep: str) -> None:
+        entries = index["entries"]
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["atime"]):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            total -= entries.pop(key)["size"]
+            shutil.rmtree(os.path.join(self.objects_dir, key), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._index() as index:
+            return {"hits": index["hits"],
+                    "misses": index["misses"],
+                    "entries": len(index["entries"]),
+                    "size": sum(e["size"] for e in index["entries"].values())}
+
+
+def cached_command(cache_dir: str, max_size: int, key: str, directory: str,
+                   name: str, pattern: str, command: str) -> str:
+    """Builds the bash command of a cached application.
+
+    On a hit the outputs are restored right away and the command only reports it,
+    on a miss the application's command is followed by the storage of its outputs.
+    """
+    cache = ResultCache(cache_dir, max_size)
+    if cache.restore(key, directory, name):
+        return f"echo {shlex.quote(f'Restored {name} from the result cache ({key})')}"
+    store = ' '.join(shlex.quote(arg) for arg in [
+        sys.executable, os.path.abspath(__file__), "store", cache_dir, str(max_size),
+        key, directory, name, pattern])
+    return f"{command} && {store}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stores application outputs in the result cache.')
+    parser.add_argument('action', choices=['store', 'stats'])
+    parser.add_argument('cache_dir')
+    parser.add_argument('max_size', type=int)
+    parser.add_argument('key', nargs='?')
+    parser.add_argument('directory', nargs='?')
+    parser.add_argument('name', nargs='?')
+    parser.add_argument('pattern', nargs='?')
+    args = parser.parse_args()
+    cache = ResultCache(args.cache_dir, args.max_size)
+    if args.action == 'store':
+        cache.store(args.key, args.directory, args.name, args.pattern)
+    else:
+        print(json.dumps(cache.stats()))
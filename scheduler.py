@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+""" scheduler.py. Core-token Task Scheduler (@) 2021
+
+This module provides the scheduler used by the workflow orchestration to
+decide when a multi-threaded application, or one running a pool of
+workers, may be handed over to Parsl, according to the number of free
+cores of the allocation.
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with
+this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# COPYRIGHT SECTION
+__author__ = "Diego Carvalho"
+__copyright__ = "Copyright 2021, The Biocomp Informal Collaboration (CEFET/RJ and LNCC)"
+__credits__ = ["Diego Carvalho", "Carla Osthoff", "Kary Ocaña", "Rafael Terra"]
+__license__ = "GPL"
+__version__ = "1.0.1"
+__maintainer__ = "Rafael Terra"
+__email__ = "rafaelst@posgrad.lncc.br"
+__status__ = "Research"
+
+
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CoreTokenPool:
+    """Keeps one token per core of the allocation, nodes times cores per node.
+
+    Parsl's executor places a task on any free worker, so the tokens are not
+    tied to a node: they only bound the cores used by all the running tasks.
+    A request is clamped to the cores of a node, since the applications are
+    multi-threaded and cannot span nodes.
+    """
+
+    def __init__(self, nodes: int, cores_per_node: int) -> None:
+        if nodes < 1 or cores_per_node < 1:
+            raise ValueError("The pool needs at least one node with one core")
+        self.cores_per_node = cores_per_node
+        self.free = nodes*cores_per_node
+
+    def fit(self, cores: int) -> int:
+        """Clamps a request to the size of a node, so it can always be served."""
+        return max(1, min(int(cores), self.cores_per_node))
+
+    def acquire(self, cores: int) -> bool:
+        """Takes the tokens of a task.
+
+        Returns:
+            False if there are not enough free cores
+        """
+        cores = self.fit(cores)
+        if self.free < cores:
+            return False
+        self.free -= cores
+        return True
+
+    def release(self, cores: int) -> None:
+        self.free += self.fit(cores)
+
+    @property
+    def available(self) -> int:
+        return self.free
+
+
+class _Task:
+    __slots__ = ("app", "cores", "args", "kwargs", "inputs", "future", "pending", "priority", "seq", "hold")
+
+    def __init__(self, app, cores, args, kwargs, inputs, priority, seq, hold) -> None:
+        self.app = app
+        self.cores = cores
+        self.args = args
+        self.kwargs = kwargs
+        self.inputs = inputs
+        self.future = Future()
+        self.pending = 0
+        self.priority = priority
+        self.seq = seq
+        self.hold = hold
+
+    def order(self):
+        # higher priorities first, then in submission order
+        return (-self.priority, self.seq)
+
+
+class Hold:
+    """Keeps the scheduler from starting the tasks submitted with it until it is released.
+
+    It lets a producer queue a group of tasks before any of them starts, so
+    the priorities are honoured within the group. Only the tasks of the
+    group wait for it, the other ones keep being started. Releasing it more
+    than once has no effect.
+    """
+
+    def __init__(self, scheduler: "TokenScheduler") -> None:
+        self.scheduler = scheduler
+        self.released = False
+
+    def release(self) -> None:
+        with self.scheduler._lock:
+            if self.released:
+                return
+            self.released = True
+        self.scheduler._dispatch()
+
+
+class TokenScheduler:
+    """Hands applications over to Parsl only when their cores are free.
+
+    Every submitted task waits until the futures in its inputs are done and
+    then joins the ready queue, or fails with the first failed input, which is kept sorted by priority. Whenever a
+    task finishes, its tokens are given back and the ready queue is scanned
+    again, starting the next tasks that fit in the free cores.
+
+    Example of use:
+
+    scheduler = TokenScheduler(nodes=2, cores_per_node=24)\\
+    fut = scheduler.submit(apps.snaq, 6, basedir, config, h, inputs=[ret_ast])
+    """
+
+    def __init__(self, nodes: int, cores_per_node: int) -> None:
+        self.pool = CoreTokenPool(nodes, cores_per_node)
+        self.ready: List[_Task] = list()
+        self.running = 0
+        self.submitted = 0
+        self._lock = threading.Lock()
+
+    def hold(self) -> Hold:
+        """A Hold of the tasks submitted with it, released by the caller once they are all queued."""
+        return Hold(self)
+
+    def submit(self, app: Callable, cores: Any, *args, inputs=[], priority: float = 0, hold: Optional[Hold] = None,
+               **kwargs) -> Future:
+        """Queues an application call that needs `cores` cores to run.
+
+        Parameters:
+            app: parsl's application (or any callable returning a future)
+            cores: number of threads used by the application
+            inputs: futures the application depends on
+            priority: the ready tasks with higher priorities are started first
+            hold: the task is not started until this Hold is released
+        Returns:
+            a future that mirrors the application's AppFuture
+        """
+        with self._lock:
+            self.submitted += 1
+            seq = self.submitted
+        task = _Task(app, int(cores), args, kwargs, list(inputs), priority, seq, hold)
+        deps = [d for d in task.inputs if isinstance(d, Future)]
+        task.pending = len(deps) + 1
+        for dep in deps:
+            dep.add_done_callback(lambda _, t=task: self._dependency_done(t))
+        self._dependency_done(task)
+        return task.future
+
+    def _dependency_done(self, task: _Task) -> None:
+        with self._lock:
+            task.pending -= 1
+            if task.pending > 0:
+                return
+        failed = [d for d in task.inputs if isinstance(d, Future) and (d.cancelled() or d.exception() is not None)]
+        if len(failed) > 0:
+            # the application would fail on its dependency, no tokens are taken for it
+            if failed[0].cancelled():
+                task.future.cancel()
+            else:
+                task.future.set_exception(failed[0].exception())
+            return
+        with self._lock:
+            self.ready.append(task)
+            self.ready.sort(key=_Task.order)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        launch = list()
+        with self._lock:
+            waiting = list()
+            for task in self.ready:
+                # the held tasks wait to be ordered with the rest of their
+                # group, the other ones need not
+                if task.hold is not None and not task.hold.released:
+                    waiting.append(task)
+                elif self.pool.acquire(task.cores):
+                    self.running += 1
+                    launch.append(task)
+                else:
+                    waiting.append(task)
+            self.ready = waiting
+        # the applications are called outside the lock, since parsl may run
+        # the callbacks of already finished futures on this same thread
+        for task in launch:
+            try:
+                app_future = task.app(*task.args, inputs=task.inputs, **task.kwargs)
+            except Exception as e:
+                self._task_done(task, None, e)
+                continue
+            app_future.add_done_callback(
+                lambda f, t=task: self._task_done(t, f, None))
+
+    def _task_done(self, task: _Task, app_future: Optional[Future], error: Optional[Exception]) -> None:
+        with self._lock:
+            self.pool.release(task.cores)
+            self.running -= 1
+        if error is None:
+            error = app_future.exception()
+        if error is not None:
+            task.future.set_exception(error)
+        else:
+            task.future.set_result(app_future.result())
+        self._dispatch()
@@ -0,0 +1,34 @@
+#!/bin/env julia
+
+# Builds a sysimage with the packages used by snaq.jl and plot.jl precompiled,
+# to be set as JuliaSysimage in the [JULIA] section of the settings file.
+#
+# Argument usage:
+# ARGS[1] = path of the sysimage to create (e.g. hp2net.so)
+# ARGS[2] = (optional) julia script run to trace the methods to precompile
+
+import Pkg
+
+if length(ARGS) < 1
+    println("Usage: build_sysimage.jl <sysimage path> [precompile execution file]")
+    exit(1)
+end
+
+if Base.find_package("PackageCompiler") === nothing
+    Pkg.add("PackageCompiler")
+end
+using PackageCompiler
+
+packages = [:PhyloNetworks, :CSV]
+for pkg in [:PhyloPlots, :RCall]
+    if Base.find_package(string(pkg)) !== nothing
+        push!(packages, pkg)
+    end
+end
+
+if length(ARGS) > 1
+    create_sysimage(packages; sysimage_path=ARGS[1], precompile_execution_file=ARGS[2])
+else
+    create_sysimage(packages; sysimage_path=ARGS[1])
+end
+println("Sysimage written to $(ARGS[1])")
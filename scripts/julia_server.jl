@@ -0,0 +1,121 @@
+#!/bin/env julia
+
+# Long-lived Julia process of the julia_pool.py worker pool.
+#
+# Argument usage:
+# ARGS[1] = path of the unix socket the server listens on
+# ARGS[2] = (optional) idle time in seconds before the server exits (default 600)
+#
+# Protocol: a client sends the number of fields on a line, then every field as
+# its size in bytes on a line followed by its bytes and a newline, so a field
+# may be empty or hold newlines:
+#   <number of fields>
+#   <size>\n<log file>
+#   <size>\n<julia script>
+#   <size>\n<script argument 1>
+#   ...
+# The script runs in a fresh module with these ARGS, its stdout and stderr are
+# written to the log file, and the server answers "exit <code>". A request with
+# the single field "shutdown" stops the server.
+
+using Sockets
+using Distributed
+
+socket_path = ARGS[1]
+idle = parse(Float64, get(ARGS, 2, "600"))
+
+# The packages are loaded (and compiled) once, so the jobs only pay their own work
+for pkg in ["PhyloNetworks", "CSV"]
+    if Base.find_package(pkg) !== nothing
+        Core.eval(Main, :(using $(Symbol(pkg))))
+    end
+end
+
+struct ScriptExit <: Exception
+    code::Int
+end
+
+function run_job(script::String, args::Vector{String}, logpath::String)::Int
+    job = Module(:Job)
+    Core.eval(job, :(const ARGS = $args))
+    # exit() ends the job, not the server
+    Core.eval(job, :(exit(code::Integer=0) = throw($ScriptExit(code))))
+    # the workers spawned by a previous job are reused, the ones beyond n are removed
+    Core.eval(job, :(import Distributed))
+    Core.eval(job, :(function addprocs(n::Integer; kw...)
+        spawned = Distributed.nprocs() - 1
+        if n > spawned
+            Distributed.addprocs(n - spawned; kw...)
+        elseif n < spawned
+            Distributed.rmprocs(Distributed.workers()[max(n, 0)+1:end])
+        end
+        return Distributed.workers()
+    end))
+    code = 0
+    open(logpath, "w") do log
+        redirect_stdout(log) do
+            redirect_stderr(log) do
+                try
+                    Base.include(job, script)
+                catch e
+                    if e isa ScriptExit
+                        code = e.code
+                    else
+                        showerror(log, e, catch_backtrace())
+                        println(log)
+                        code = 1
+                    end
+                end
+            end
+        end
+    end
+    return code
+end
+
+ispath(socket_path) && rm(socket_path)
+server = listen(socket_path)
+last_job = Ref(time())
+busy = Ref(false)
+println("Julia server listening on $socket_path")
+
+Timer(10; interval=10) do t
+    if !busy[] && time() - last_job[] > idle
+        println("Idle for $(idle)s, exiting")
+        close(server)
+    end
+end
+
+while isopen(server)
+    sock = try
+        accept(server)
+    catch
+        break
+    end
+    busy[] = true
+    fields = String[]
+    try
+        for _ in 1:parse(Int, readline(sock))
+            nbytes = parse(Int, readline(sock))
+            data = read(sock, nbytes)
+            length(data) == nbytes || error("the request ended in a field")
+            push!(fields, String(data))
+            readline(sock)
+        end
+    catch e
+        # a truncated or malformed request is answered with exit 2
+        println("Malformed request: $e")
+        empty!(fields)
+    end
+    if fields == ["shutdown"]
+        println(sock, "exit 0")
+        close(sock)
+        close(server)
+        break
+    end
+    code = length(fields) < 2 ? 2 : run_job(fields[2], fields[3:end], fields[1])
+    println(sock, "exit $code")
+    close(sock)
+    last_job[] = time()
+    busy[] = false
+end
+ispath(socket_path) && rm(socket_path)
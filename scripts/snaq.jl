@@ -6,34 +6,49 @@
 # ARGS[3] = path of the topology
 # ARGS[4] = output dir
 # ARGS[5] = num_workers
-# ARGS[6] = hmax
+# ARGS[6] = hmax, or a comma-separated list of hmax values run one after the other
 # ARGS[7] = runs
 # ARGS[8] = (optional) outgroup
+# Options:
+# --start=<file>   (optional) network (.out) or tree used as the starting topology of the first hmax
+# --cftable=<file> (optional) CF table read if it is newer than the tree (e.g. written by setup_cf_table), otherwise computed and written there
+# --quartets=<file> (optional) quartets kept in the CF table, one per line with its taxa separated by tabs
+# --require-cftable (optional) fail instead of computing the CF table when --cftable is missing or older than the tree
 
 println("Starting PhyloNetworks...")
 
+options = Dict{String, String}()
+for arg in filter(a -> startswith(a, "--"), ARGS)
+    kv = split(arg[3:end], '=', limit=2)
+    options[kv[1]] = length(kv) > 1 ? kv[2] : ""
+end
+positional = filter(a -> !startswith(a, "--"), ARGS)
+
 # Validate arguments
-if length(ARGS) < 7
-    println("Usage: script.jl <tree method> <tree path> <topology path> <output dir> <num_workers> <hmax> <runs> [outgroup]")
+if length(positional) < 7
+    println("Usage: script.jl <tree method> <tree path> <topology path> <output dir> <num_workers> <hmax[,hmax...]> <runs> [outgroup] [--start=file] [--cftable=file] [--quartets=file] [--require-cftable]")
     exit(1)
 end
 
 # Parse required arguments
-method = ARGS[1]
-tree_path = ARGS[2]
-topology_path = ARGS[3]
-output_dir = ARGS[4]
-num_workers = max(1, parse(Int, ARGS[5]) - 1)
-hmax = parse(Int, ARGS[6])
-runs = parse(Int, ARGS[7])
-outgroup = get(ARGS, 8, nothing)  # Optional
+method = positional[1]
+tree_path = positional[2]
+topology_path = positional[3]
+output_dir = positional[4]
+num_workers = max(1, parse(Int, positional[5]) - 1)
+hmax_list = sort([parse(Int, h) for h in split(positional[6], ',')])
+runs = parse(Int, positional[7])
+outgroup = get(positional, 8, nothing)  # Optional
+start_path = get(options, "start", nothing)
+cf_path = get(options, "cftable", nothing)
+quartets_path = get(options, "quartets", nothing)
 
 println("Tree method: $method")
 println("Tree path: $tree_path")
 println("Topology path: $topology_path")
 println("Output folder: $output_dir")
 println("Number of processors: $num_workers")
-println("Hybridization max: $hmax")
+println("Hybridization max: $hmax_list")
 println("Number of runs: $runs")
 if outgroup !== nothing
     println("Species mapping: $outgroup")
@@ -65,13 +80,36 @@ end
 @everywhere using PhyloNetworks
 
 basedir = dirname(output_dir)
-name = string(replace(basename(basedir), "/" => ""), "_", method, "_MPL_", hmax)
-output = joinpath(output_dir, name)
+prefix = string(replace(basename(basedir), "/" => ""), "_", method, "_MPL_")
 
 println("Using PhyloNetworks on every processor")
 
-# Process different tree methods
-if method in ["RAXML", "IQTREE"]
+# Keeps the rows of the CF table whose taxa are a quartet of --quartets
+function select_quartets(cf)
+    selected = Set{Vector{String}}()
+    for line in eachline(quartets_path)
+        push!(selected, sort(String.(split(line, '\t'))))
+    end
+    df = writeTableCF(cf)
+    keep = [sort(String[df.t1[i], df.t2[i], df.t3[i], df.t4[i]]) in selected for i in 1:size(df, 1)]
+    println("Keeping $(sum(keep)) of the $(size(df, 1)) quartets of the CF table listed in $quartets_path")
+    return readTableCF(df[keep, :])
+end
+
+# The CF table is built only once per process, or read from --cftable when a
+# previous process of the sweep already wrote it from the same gene trees
+function gene_tree_cf()
+    fresh(path) = mtime(cf_path) >= mtime(path)
+    if cf_path !== nothing && isfile(cf_path) && fresh(tree_path) && (quartets_path === nothing || fresh(quartets_path))
+        println("Reading the CF table from $cf_path")
+        return readTableCF(cf_path)
+    end
+    if haskey(options, "require-cftable")
+        # the table written by setup_cf_table holds the quartet selection, which
+        # this script doesn't know, so it is not computed again here
+        println("The CF table $cf_path is missing or older than $tree_path")
+        exit(1)
+    end
     if outgroup !== nothing
         genetrees = readMultiTopology(tree_path)
         taxon_map = Dict{String, String}()
@@ -87,19 +125,38 @@ if method in ["RAXML", "IQTREE"]
         df_sp = writeTableCF(q, t)
         println(df_sp)
         CSV.write(joinpath(output_dir, "tableCF_species.csv"), df_sp)
-        raxmlCF = readTableCF(joinpath(output_dir, "tableCF_species.csv"))
+        cf = readTableCF(joinpath(output_dir, "tableCF_species.csv"))
     else
-        raxmlCF = readTrees2CF(tree_path, writeTab=false, writeSummary=false)
+        cf = readTrees2CF(tree_path, writeTab=false, writeSummary=false)
     end
-    astraltree = readTopology(last(readlines(topology_path)))
-    net = snaq!(astraltree, raxmlCF, hmax=hmax, filename=output, runs=runs)
+    if quartets_path !== nothing
+        cf = select_quartets(cf)
+    end
+    if cf_path !== nothing
+        CSV.write(cf_path, writeTableCF(cf))
+    end
+    return cf
+end
 
+# Process different tree methods
+if method in ["RAXML", "IQTREE"]
+    dataCF = gene_tree_cf()
+    start = readTopology(last(readlines(topology_path)))
 elseif method == "MRBAYES"
-    buckyCF = readTableCF(tree_path)
-    qmc_tree = readTopology(topology_path)
-    net = snaq!(qmc_tree, buckyCF, hmax=hmax, filename=output, runs=runs)
-
+    dataCF = readTableCF(tree_path)
+    start = readTopology(topology_path)
 else
     println("Invalid tree method! Supported methods: RAXML, IQTREE, MRBAYES")
     exit(1)
 end
+if start_path !== nothing
+    println("Starting from $start_path")
+    start = endswith(start_path, ".out") ? readSnaqNetwork(start_path) : readTopology(start_path)
+end
+
+# Every hmax starts from the best network found with the previous one
+for hmax in hmax_list
+    output = joinpath(output_dir, string(prefix, hmax))
+    println("Running SNaQ with hmax=$hmax")
+    global start = snaq!(start, dataCF, hmax=hmax, filename=output, runs=runs)
+end
@@ -1,7 +1,7 @@
 import parsl, apps, glob, bioconfig, os, logging, argparse, math, filecmp
 from pandas.core import base
 from datetime import datetime
-from infra_manager import workflow_config, wait_for_all, CircularList
+from infra_manager import workflow_config, wait_for_all
 def test_raxml(bio_config, logger1 = None):
     logger1.critical("Testing RAXML...")
     basedir = {
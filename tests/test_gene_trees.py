@@ -0,0 +1,32 @@
+import os
+from concurrent.futures import Future
+
+from gene_trees import GeneTreeCollector, gene_key
+
+
+def test_gene_key_of_alignments_and_tree_files():
+    assert gene_key('input/phylip/a.b.phy') == 'a.b'
+    assert gene_key('RAxML_bestTree.a.b') == 'a.b'
+    assert gene_key('RAxML_bootstrap.a.b') == 'a.b'
+    assert gene_key('iqtree/a.b.phy.treefile') == 'a.b'
+    assert gene_key('a.b.phy.ufboot') == 'a.b'
+
+
+def test_collector_and_output_files_share_the_gene_order(tmp_path):
+    names = ['a-b', 'a', 'b']
+    genes = list()
+    for name in names:
+        tree_file = tmp_path / f'RAxML_bestTree.{name}'
+        tree_file.write_text(f'({name});\n')
+        genes.append((f'{name}.phy', str(tree_file), f'RAxML_bootstrap.{name}'))
+    besttree_file = tmp_path / 'besttrees.tre'
+    collector = GeneTreeCollector(str(tmp_path), genes, str(besttree_file), str(tmp_path / 'BSlistfiles'))
+    for gene, _, _ in reversed(genes):
+        done = Future()
+        done.set_result(0)
+        collector.watch(gene, done)
+    assert collector.future.result(timeout=1)
+    # the order of setup_tree_output when it concatenates the tree files itself
+    fallback = sorted((str(tmp_path / f'RAxML_bestTree.{name}') for name in names), key=gene_key)
+    assert besttree_file.read_text() == ''.join(open(f).readline() for f in fallback)
+    assert [os.path.basename(f) for f in fallback] == ['RAxML_bestTree.a', 'RAxML_bestTree.a-b', 'RAxML_bestTree.b']
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+from newick import (NewickError, Tree, leaf_labels, relabel, root_chunk, root_trees, write_nexus_trees,
+                    write_phylonet_block)
+
+TREE = "((A:1,B:2)90:0.5,(C:1,D:1)80:0.3,E:4);"
+
+
+def test_parse_builds_the_node_table():
+    tree = Tree.parse(TREE)
+    leaves = [tree.name[n] for n in range(len(tree.name)) if not tree.children[n]]
+    assert sorted(leaves) == ["A", "B", "C", "D", "E"]
+    assert len(tree.children[tree.root]) == 3
+    # the numeric labels of the internal nodes are supports, not names
+    supports = sorted(s for s in tree.support if s is not None)
+    assert supports == [80, 90]
+    assert tree.length[tree.path("B")[-1]] == 2.0
+
+
+def test_parse_adds_the_missing_external_parentheses():
+    tree = Tree.parse("A:1,B:2,C:3;")
+    assert [tree.name[n] for n in tree.children[tree.root]] == ["A", "B", "C"]
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("((A,B),(C,D);", "Mismatch"),
+    ("(A,B));", "Parenthesis mismatch"),
+    ("(A,B);C", "Text after semicolon"),
+])
+def test_parse_rejects_malformed_trees(text, reason):
+    with pytest.raises(NewickError, match=reason):
+        Tree.parse(text)
+
+
+@pytest.mark.parametrize("outgroup, rooted", [
+    ("A", "((((C:1,D:1)80.00:0.3,E:4):0.5,B:2)90.00:1,A:0):0;"),
+    ("E", "(((A:1,B:2)90.00:0.5,(C:1,D:1)80.00:0.3):4,E:0):0;"),
+    ("C", "((((A:1,B:2)90.00:0.5,E:4):0.3,D:1)80.00:1,C:0):0;"),
+])
+def test_root_with_a_terminal_outgroup(outgroup, rooted):
+    tree = Tree.parse(TREE)
+    tree.root_with_outgroup(outgroup)
+    assert tree.format() == rooted
+
+
+def test_root_with_a_missing_outgroup():
+    tree = Tree.parse(TREE)
+    with pytest.raises(NewickError, match="not in this tree"):
+        tree.root_with_outgroup("Z")
+
+
+def test_native_and_biopython_engines_write_the_same_trees():
+    pytest.importorskip("Bio")
+    trees = [TREE, "(A,(B,(C,D)));", "((A:0.1,'B b':0.2)[c]:0.3,(C:1e-3,D:2):1,(E,F));"]
+    for outgroup in ["A", "D", "E"]:
+        native, native_failed = root_chunk(1, trees, outgroup)
+        biopython, biopython_failed = root_chunk(1, trees, outgroup, "biopython")
+        assert native == biopython
+        assert [n for n, _ in native_failed] == [n for n, _ in biopython_failed]
+
+
+@pytest.mark.parametrize("workers, chunk", [(1, 500), (2, 1)])
+def test_root_trees_leaves_out_the_trees_that_cannot_be_rooted(tmp_path, workers, chunk):
+    tree_file = tmp_path / "besttrees.tre"
+    tree_file.write_text("\n".join([TREE, "((A,B),(C,D);", "(B,(C,D));", "(D,(A,C));"]) + "\n")
+    out_file = tmp_path / "besttrees_rooted.tre"
+    rooted, failed = root_trees(str(tree_file), "A", str(out_file), workers=workers, chunk=chunk)
+    assert rooted == 2
+    assert [number for number, _ in failed] == [2, 3]
+    assert "NewickError" in failed[0][1] and "not in this tree" in failed[1][1]
+    lines = out_file.read_text().splitlines()
+    assert lines == ["((((C:1,D:1)80.00:0.3,E:4):0.5,B:2)90.00:1,A:0):0;", "((D:0,C:0):0,A:0):0;"]
+
+
+def test_root_trees_rejects_an_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        root_trees(str(tmp_path / "none.tre"), "A", str(tmp_path / "out.tre"), engine="ete3")
+
+
+def test_relabel_only_renames_the_leaves():
+    text = "((1:0.1,2:0.2)1:0.3,('1',3)[1]:1,4);"
+    mapping = {"1": "A", "2": "B", "3": "C", "4": "D"}
+    # the support 1, the quoted label and the comment are kept
+    assert relabel(text, mapping) == "((A:0.1,B:0.2)1:0.3,('1',C)[1]:1,D);"
+    assert relabel(text, {}) == text
+
+
+def test_leaf_labels_are_the_ones_relabel_maps():
+    assert leaf_labels("((1:0.1,2:0.2)1:0.3,('1',3)[1]:1,4);") == {"1", "2", "3", "4"}
+
+
+def test_nexus_and_phylonet_blocks():
+    out = io.StringIO()
+    names = write_nexus_trees(out, ["(A,B);\n", "(B,C);"])
+    write_phylonet_block(out, ["InferNetwork_MPL (all) 1", "Other"])
+    assert names == ["geneTree1", "geneTree2"]
+    assert out.getvalue() == ("#NEXUS\nBEGIN TREES;\nTree geneTree1 = (A,B);\nTree geneTree2 = (B,C);\nEND;\n"
+                              "BEGIN PHYLONET;\nInferNetwork_MPL (all) 1;\nOther;\nEND;")
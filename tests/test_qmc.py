@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pytest
+
+from qmc import cf_table, format_quartets, qmc_quartets, taxon_ids
+
+
+def table(rows):
+    """The CFTable of rows of (taxon1, taxon2, taxon3, taxon4, CF12.34, CF13.24, CF14.23) texts."""
+    return cf_table([[row[i] for row in rows] for i in range(4)], [[row[i] for row in rows] for i in range(4, 7)])
+
+
+def splits(rows):
+    return format_quartets(qmc_quartets(table(rows))).split(' ')
+
+
+@pytest.mark.parametrize("cf, expected", [
+    # the highest factor only, even when the other two tie
+    (("0.6", "0.2", "0.2"), ["1,2|3,4"]),
+    (("0.2", "0.7", "0.1"), ["1,3|2,4"]),
+    (("0.1", "0.2", "0.7"), ["1,4|2,3"]),
+    # the ties with the highest factor, in column order
+    (("0.4", "0.4", "0.2"), ["1,2|3,4", "1,3|2,4"]),
+    (("0.4", "0.2", "0.4"), ["1,2|3,4", "1,4|2,3"]),
+    (("0.2", "0.4", "0.4"), ["1,3|2,4", "1,4|2,3"]),
+    (("0.333", "0.333", "0.333"), ["1,2|3,4", "1,3|2,4", "1,4|2,3"]),
+    # factors written differently don't tie, the first column is taken
+    (("0.5", "0.50", "0.0"), ["1,2|3,4"]),
+])
+def test_tie_rules(cf, expected):
+    assert splits([("A", "B", "C", "D") + cf]) == expected
+
+
+def test_taxa_are_numbered_by_name():
+    rows = [("D", "B", "C", "A", "0.1", "0.8", "0.1")]
+    # A=1, B=2, C=3, D=4: the split 13|24 of D B C A is D,C|B,A
+    assert splits(rows) == ["4,3|2,1"]
+    assert taxon_ids(table(rows).names) == {"1": "A", "2": "B", "3": "C", "4": "D"}
+
+
+def test_rows_keep_their_order():
+    rows = [("A", "B", "C", "D", "0.4", "0.4", "0.2"),
+            ("A", "B", "C", "E", "0.1", "0.1", "0.8"),
+            ("B", "C", "D", "E", "1", "1", "1")]
+    assert splits(rows) == ["1,2|3,4", "1,3|2,4", "1,5|2,3", "2,3|4,5", "2,4|3,5", "2,5|3,4"]
+
+
+def test_matches_the_row_by_row_rules():
+    rng = random.Random(11)
+    texts = ["0", "0.1", "0.10", "0.25", "0.3", "0.5"]
+    rows = [tuple(rng.sample("ABCDEFG", 4)) + tuple(rng.choice(texts) for _ in range(3)) for _ in range(400)]
+    ids = {name: i for i, name in enumerate(sorted("ABCDEFG"), 1)}
+    sides = [(0, 1, 2, 3), (0, 2, 1, 3), (0, 3, 1, 2)]
+    expected = list()
+    for row in rows:
+        cf = row[4:]
+        ranked = sorted(range(3), key=lambda i: -float(cf[i]))
+        taken = [ranked[0]]
+        if cf[ranked[1]] == cf[ranked[0]]:
+            taken.append(ranked[1])
+            if cf[ranked[2]] == cf[ranked[0]]:
+                taken.append(ranked[2])
+        for i in taken:
+            a, b, c, d = (ids[row[j]] for j in sides[i])
+            expected.append(f"{a},{b}|{c},{d}")
+    assert splits(rows) == expected
+
+
+def test_empty_table():
+    assert len(qmc_quartets(table([]))) == 0
+    assert format_quartets(np.zeros((0, 4), dtype=np.int32)) == ""
@@ -0,0 +1,67 @@
+import random
+from itertools import combinations
+from math import comb
+
+import pytest
+
+from quartets import chunks, covering_quartets, random_quartets, read_manifest, select_quartets, selection_size, \
+    write_manifest
+
+
+def pair_counts(n, quartets):
+    count = {pair: 0 for pair in combinations(range(n), 2)}
+    for quartet in quartets:
+        for pair in combinations(quartet, 2):
+            count[pair] += 1
+    return count
+
+
+@pytest.mark.parametrize("n, budget", [(6, 5), (8, 40), (8, 69), (12, 300), (30, 1000)])
+def test_random_quartets_are_distinct_and_sorted(n, budget):
+    quartets = random_quartets(n, budget, random.Random(1))
+    assert len(quartets) == budget
+    assert len(set(quartets)) == budget
+    assert quartets == sorted(quartets)
+    assert all(q == tuple(sorted(q)) and len(set(q)) == 4 and max(q) < n for q in quartets)
+
+
+def test_random_quartets_with_a_budget_above_the_total():
+    assert random_quartets(6, 100, random.Random(1)) == list(combinations(range(6), 4))
+
+
+def test_random_quartets_depend_on_the_seed_only():
+    assert random_quartets(20, 50, random.Random(3)) == random_quartets(20, 50, random.Random(3))
+
+
+@pytest.mark.parametrize("n, coverage", [(4, 1), (7, 1), (10, 2), (15, 3), (25, 1), (9, 100)])
+def test_covering_quartets_cover_every_pair(n, coverage):
+    quartets = covering_quartets(n, coverage, random.Random(0))
+    assert len(set(quartets)) == len(quartets)
+    assert quartets == sorted(quartets)
+    # a pair is in C(n-2, 2) quartets at most
+    k = min(coverage, comb(n - 2, 2))
+    assert min(pair_counts(n, quartets).values()) >= k
+    assert len(quartets) >= selection_size(n, "covering", coverage=coverage)
+
+
+def test_covering_quartets_of_less_than_four_taxa():
+    assert covering_quartets(3, 1, random.Random(0)) == []
+
+
+def test_select_quartets_names_the_taxa():
+    taxa = ["E", "D", "C", "B", "A"]
+    assert list(select_quartets(taxa)) == list(combinations(taxa, 4))
+    selected = select_quartets(taxa, "random", budget=2, seed=5)
+    assert len(selected) == 2
+    assert all(list(q) == [t for t in taxa if t in q] for q in selected)
+    with pytest.raises(ValueError):
+        select_quartets(taxa, "greedy")
+
+
+def test_manifest_round_trip_and_chunks(tmp_path):
+    quartets = list(combinations("ABCDEF", 4))
+    manifest = str(tmp_path / "quartets.txt")
+    assert write_manifest(manifest, quartets) == 15
+    assert [tuple(q) for q in read_manifest(manifest)] == quartets
+    assert [tuple(q) for q in read_manifest(manifest, 10, 3)] == quartets[10:13]
+    assert chunks(15, 4) == [(0, 4), (4, 4), (8, 4), (12, 3)]
@@ -0,0 +1,113 @@
+import random
+from concurrent.futures import Future
+
+import pytest
+
+from scheduler import CoreTokenPool, TokenScheduler
+
+
+class FakeApp:
+    """Stands for a parsl app: records its calls and returns a future finished by the test."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = list()
+        self.futures = dict()
+
+    def __call__(self, name, inputs=[]):
+        if self.error is not None:
+            raise self.error
+        self.calls.append(name)
+        self.futures[name] = Future()
+        return self.futures[name]
+
+    def running(self):
+        return [name for name, future in self.futures.items() if not future.done()]
+
+
+def test_fit_clamps_to_a_node():
+    pool = CoreTokenPool(2, 4)
+    assert pool.fit(0) == 1
+    assert pool.fit(3) == 3
+    assert pool.fit(16) == 4
+    assert pool.acquire(16)
+    assert pool.available == 4
+    pool.release(16)
+    assert pool.available == 8
+
+
+def test_pool_needs_a_core():
+    with pytest.raises(ValueError):
+        CoreTokenPool(0, 4)
+
+
+def test_dependency_failure_reaches_the_future():
+    scheduler = TokenScheduler(1, 2)
+    app = FakeApp()
+    dep = Future()
+    future = scheduler.submit(app, 2, 'a', inputs=[dep])
+    dep.set_exception(RuntimeError('gene failed'))
+    assert isinstance(future.exception(timeout=1), RuntimeError)
+    assert app.calls == []
+    assert scheduler.pool.available == 2
+
+
+def test_tokens_are_released_when_the_app_raises():
+    scheduler = TokenScheduler(1, 2)
+    failing = FakeApp(error=OSError('no executor'))
+    app = FakeApp()
+    first = scheduler.submit(failing, 2, 'a')
+    second = scheduler.submit(app, 2, 'b')
+    assert isinstance(first.exception(timeout=1), OSError)
+    assert app.calls == ['b']
+    app.futures['b'].set_result('done')
+    assert second.result(timeout=1) == 'done'
+    assert scheduler.pool.available == 2
+    assert scheduler.running == 0
+
+
+def test_held_tasks_wait_for_the_release():
+    scheduler = TokenScheduler(1, 4)
+    app = FakeApp()
+    hold = scheduler.hold()
+    scheduler.submit(app, 1, 'short', priority=1, hold=hold)
+    scheduler.submit(app, 1, 'long', priority=9, hold=hold)
+    scheduler.submit(app, 1, 'other')
+    # the unheld task is not kept waiting by the hold
+    assert app.calls == ['other']
+    hold.release()
+    assert app.calls == ['other', 'long', 'short']
+    hold.release()
+    assert len(app.calls) == 3
+
+
+def test_ready_tasks_start_by_priority():
+    scheduler = TokenScheduler(1, 1)
+    app = FakeApp()
+    scheduler.submit(app, 1, 'first')
+    scheduler.submit(app, 1, 'low', priority=1)
+    scheduler.submit(app, 1, 'high', priority=5)
+    scheduler.submit(app, 1, 'low again', priority=1)
+    while len(app.calls) < 4:
+        app.futures[app.calls[-1]].set_result(None)
+    assert app.calls == ['first', 'high', 'low', 'low again']
+
+
+def test_running_tasks_never_exceed_the_free_tokens():
+    rng = random.Random(7)
+    scheduler = TokenScheduler(2, 4)
+    app = FakeApp()
+    deps = [Future() for _ in range(10)]
+    cores = [rng.randint(0, 12) for _ in range(60)]
+    futures = [scheduler.submit(app, cores[i], i, inputs=rng.sample(deps, rng.randint(0, 2))) for i in range(60)]
+    for dep in deps:
+        dep.set_result(None)
+    while not all(f.done() for f in futures):
+        running = app.running()
+        # the requests are clamped to a node, 0 to 12 cores take 1 to 4 tokens
+        assert sum(scheduler.pool.fit(cores[i]) for i in running) + scheduler.pool.available == 8
+        assert scheduler.pool.available >= 0
+        assert len(running) > 0
+        app.futures[rng.choice(running)].set_result(None)
+    assert sorted(app.calls) == list(range(60))
+    assert scheduler.pool.available == 8
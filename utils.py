@@ -1,5 +1,4 @@
 import functools
-from typing import Any
 import logging
 
 logger = logging.getLogger(__name__)
@@ -68,22 +67,3 @@ def app_reuse(cache, args_to_ignore):
         return wrapper_decorator
     return decorator
 
-
-class CircularList:
-    def __init__(self, slots: int) -> None:
-        if not slots:
-            raise ValueError
-        self.list = [None for _ in range(slots)]
-        self.index = 0
-        self.max_index = len(self.list) - 1
-
-    def next(self) -> Any:
-        if self.index == self.max_index:
-            self.index = 0
-        else:
-            self.index += 1
-        return self.list[self.index]
-
-    def current(self, value: Any) -> None:
-        self.list[self.index] = value
-        return